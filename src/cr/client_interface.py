@@ -57,6 +57,8 @@ faulthandler.enable(file = fault_text_file)
 logger = setup_logging('client_interface', base_app = get_base_app_version())
 
 TIMEOUT = 5.0 #seconds
+IDLE_POLL_MAX = 100 # millisecs, longest the main loop sleeps with nothing to do
+STRAGGLER_CHECK = 'straggler_check' # deadline key for the next look for slow nodes
 crowdrender = sys.modules[__package__]
 ERROR_SHARING_VIOLATION = 32 
 SESSION_FILES = 1
@@ -332,42 +334,79 @@ class CRContactServer(threading.Thread):
                     self.connector_inproc.setsockopt(zmq.LINGER, 0)
                     self.connector_inproc.close()
                     self.pollclient.unregister(self.connector_inproc)
-                    
-                
-            
-class ResponseTimer(threading.Thread):
-    """ Run a count down timer that will set status of a machine to sync_fail if timedout
+
+
+
+class CRProgressAggregator:
+    """ Coalesces progress updates and forwards them to blender at a limited rate
+
+    Description:
+    Nodes report upload and download progress far more often than the user can see
+    it change. Each progress msg is keyed by who it's going to and which node it is
+    about, only the latest for each key is kept. Pending msgs are published to
+    blender no more than 'rate' times a second, so progress doesn't compete with
+    tile data and sync msgs, or cause blender to redraw for every chunk received.
+
+    A msg reporting a transfer is complete is published from add, along with 
+    anything else pending, so it is sent before any msg handled after it, such
+    as the result it refers to.
     """
-    
-    def __init__(self, machine):
-        threading.Thread.__init__(self)
-        
-        
-        self.machine = machine
-        self.seconds = 5
-        
-        self.start() 
-        
-    def run(self):
-        
-        while not self.machine.status == utils.synced:
-            
-            if self.seconds == 0: 
-                
-                self.machine.status = utils.unresponsive
-                break
-            # in this case we might be able to manually re-sync, so we don't want
-            # to disconnect this machine, we'll assume its still there since it 
-            # reported a sync fail as opposed to not responding at all. 
-            # This gives the user the chance to try a re-sync
-            
-            elif self.machine.status == utils.sync_failed:
-                break
-            else: 
-                time.sleep(1.0)
-                self.seconds -= 1
-            
-        
+
+    def __init__(self, rate):
+
+        self.interval = 1.0 / rate if rate > 0.0 else 0.0
+        self.last_publish = 0.0
+        self.pending = {}
+
+    def add(self, identity, node_uuid, msg, router):
+        """ Keep msg as the latest progress for the node, sent to identity
+
+        Arguments:
+            identity:   bytes       - zmq identity of the recipient of the msg
+            node_uuid:  string      - the node that the progress is for
+            msg:        MsgWrapper  - the progress update msg
+            router:     zmq.Socket  - ROUTER socket connected to blender, used
+                                        to publish straight away when msg says
+                                        the transfer is complete
+        """
+
+        # pop first so this key moves to the end and keeps the msg order
+        self.pending.pop((identity, node_uuid), None)
+        self.pending[(identity, node_uuid)] = msg
+
+        if msg.attributes.get(utils.percent_complete, 0.0) >= 100.0:
+
+            self.last_publish = 0.0
+            self.publish(router)
+
+    def poll_timeout(self, max_wait):
+        """ Return the millisecs until pending progress is due to be published
+        """
+
+        if not self.pending: return max_wait
+
+        wait = (self.last_publish + self.interval - time.perf_counter()) * 1000.0
+
+        return int(min(max(wait, 0), max_wait))
+
+    def publish(self, router):
+        """ Send all pending progress msgs via router if the interval has passed
+
+        Arguments:
+            router:     zmq.Socket  - ROUTER socket connected to blender
+        """
+
+        if not self.pending or not timed_out(self.last_publish, self.interval):
+            return
+
+        for (identity, node_uuid), msg in self.pending.items():
+
+            router.send_multipart([identity, bytes(
+                json.dumps(msg.serialize(), cls = utils.BTEncoder),'utf-8')])
+
+        self.pending.clear()
+        self.last_publish = time.perf_counter()
+
 
 class CRServerMachine:
     """ Represents a render server
@@ -404,6 +443,7 @@ class CRServerMachine:
                     not value == utils.unresponsive:
                     
                     self.client.machines_working.pop(self.machine_uuid)
+                    self.client.deadlines.cancel(self.machine_uuid)
             
             if value ==utils.exited: 
                 self.closed()
@@ -435,6 +475,8 @@ class CRServerMachine:
         self.node_name = node_name
         self.machine_uuid = machine_uuid
         self.screen_coords = ()
+        self.tile_no = None # tile being rendered when tiles are taken from a queue
+        self.slots = {} # render target uuid : CRRenderSlot, when divided into slots
         self.node_A_manual = 0.001 # manual screen space allocation
         self.node_A_auto = 0.001 # automatic screen space allocation
         self.machine_cores = machine_cores
@@ -446,6 +488,7 @@ class CRServerMachine:
         self.exited = False
         self.ssp_endpoints = ssp_endpoints
         self.render_processes = list()
+        self.render_worker = None
         if self.node_name == "local":
             self.render_thread_sock = self.client.render_thread_sock
         self.compute_devices = compute_devices
@@ -455,28 +498,20 @@ class CRServerMachine:
         self.compute_device = 'CPU'
         self.k = k
         self.t_s = t_s
+        self.bandwidth = 0.0 # bytes/s results download at from this node, 0 unknown
         
         ## LOAD LOCAL'S RENDER PERF DATA
         # if this is the local node, we'll need to load the data
         # for it now. 
         
         if machine_uuid == 'local':
-            render_data = read_config_file([config.node_perf_data])
+            estimate = render.perf_store().get(
+                self.session_uuid.decode('utf-8'), 
+                bpy.context.scene.render.engine, 
+                machine_uuid)
             
-            local_render_data = render_data[config.node_perf_data]
-        
-            session_render_data = local_render_data.get(self.session_uuid.decode('utf-8'))
-            
-#             if session_render_data is not None:
-#                 
-#                 eng_data = session_render_data.get(engine)
-#                 
-#                 self.k = mean(session_render_data[0])
-#                 self.t_s = session_render_data[1]
-        
-        
-        
-        
+            if estimate is not None:
+                self.k, self.t_s = estimate
         
         if not self.ssp_cip_pubsub is None:
             self.client.poller.register(self.ssp_cip_pubsub, zmq.POLLIN)
@@ -571,8 +606,9 @@ class CRServerMachine:
         msg.attributes[utils.node_uuid] = self.machine_uuid
         msg.attributes[utils.node_name] = self.node_name
         
-        self.cli_cip_router.send_multipart([msg.s_uuid, bytes(
-            json.dumps(msg.serialize()),'utf-8') ])
+        # coalesced with other updates for this node and sent from the main loop
+        self.client.progress.add(msg.s_uuid, self.machine_uuid, msg,
+                                 self.cli_cip_router)
             
     def cancel_tile_download(self, msg):
         """ Cleanup on cancelling an upload
@@ -587,6 +623,7 @@ class CRServerMachine:
         # calculate the task_uuid for these stats
         
         msg.attributes[utils.node_name] = self.node_name
+        self.client.render_progress(self.slot_for(msg).machine_uuid, msg)
         self.cli_cip_router.send_multipart(
             [msg.t_uuid, 
             bytes(json.dumps(
@@ -670,7 +707,7 @@ class CRServerMachine:
         if self.ssp_cip_pubsub in sockets:
             
             self.ssp_cip_pubsub_message = MsgWrapper.deserialize(
-                                    self.ssp_cip_pubsub.recv_string())
+                                    utils.recv_msg_string(self.ssp_cip_pubsub))
             
             # TODO:JIRA:CR_66 need to be more consistent with use of command or message, 
             # should seriously consider using a single item to carry meta data 
@@ -709,9 +746,14 @@ class CRServerMachine:
                 
                     self.get_finished_view(message)
                     
+                elif message.message == utils.render_failed:
+                    
+                    self.handle_failed_render(message)
+                    
                 else:
                     
                     message.attributes[utils.node_name] = 'local'
+                    self.client.render_progress(self.machine_uuid, message)
                     
                                      
                     self.client.cli_cip_router.send_multipart([message.t_uuid, 
@@ -746,6 +788,9 @@ class CRServerMachine:
             self.start_time = time.perf_counter()
             self.time_elapsed = 0.0                           
             
+            self.client.deadlines.schedule_at(self.machine_uuid, 
+                                              self.start_time + TIMEOUT)
+            
             if self.machine_uuid in self.client.machines_working:
             
                 pass
@@ -826,17 +871,42 @@ class CRServerMachine:
             output_path = os.path.join(self.client.session_path, 
                                        msg.attributes[utils.scene],
                                        '_local_') 
+            if msg.attributes.get(utils.tile_no) is not None:
+                output_path += "tile" + str(msg.attributes[utils.tile_no]) + "_"
+            if msg.attributes.get(utils.first_frame) is not None:
+                output_path += "frame" + str(msg.attributes[utils.current_frame]) + "_"
             views = msg.attributes[utils.views]
             load_trusted = msg.attributes[utils.load_trusted]
             
             ## CREATE RENDER PROCESS
             
-            process = create_render_process(
-                load_trusted, self.screen_coords,
-                tile_x, tile_y, compute_device, compute_devices,
-                threads, temp_blend_file, output_path, target_engine, 
-                img_output_fmt, current_frame, exr_codec,
-                self.logger, scene_name)
+            if utils.read_config_file(
+                    [config.render_workers])[config.render_workers]:
+                
+                # the CLI saves the temp file for every render, with changes the
+                # hash tree doesn't track, so the file itself is part of the version
+                blend_stat = os.stat(temp_blend_file)
+                
+                self.render_worker = render.render_worker(
+                    self.render_worker, load_trusted, temp_blend_file,
+                    (self.client.top_hash, blend_stat.st_size, 
+                        blend_stat.st_mtime_ns), 
+                    scene_name, self.logger)
+                    
+                process = self.render_worker.render(
+                    self.screen_coords, tile_x, tile_y, compute_device, 
+                    compute_devices, threads, output_path, target_engine, 
+                    img_output_fmt, current_frame, exr_codec, 
+                    self.screen_resolution, samples)
+                    
+            else:
+                
+                process = create_render_process(
+                    load_trusted, self.screen_coords,
+                    tile_x, tile_y, compute_device, compute_devices,
+                    threads, temp_blend_file, output_path, target_engine, 
+                    img_output_fmt, current_frame, exr_codec,
+                    self.logger, scene_name)
             
             self.render_processes.append(process)
             
@@ -858,12 +928,51 @@ class CRServerMachine:
         
             msg.attributes[utils.screen_coords] = self.screen_coords
             msg.attributes[utils.machine_uuid] = self.machine_uuid
+            msg.attributes[utils.render_target] = self.machine_uuid
+            msg.attributes[utils.render_slot] = None
                             
             msg.attributes[utils.message_uuid] = str(uuid.uuid4())
             
-            self.cip_ssp_pubsub.send_string( json.dumps (msg.serialize(),
+            utils.send_msg_string(self.cip_ssp_pubsub,  json.dumps (msg.serialize(),
                                                     cls = utils.BTEncoder) )   
             
+    def render_targets(self, slots):
+        """ Return the render targets this node is used as, itself or its slots
+        
+        Arguments:
+            slots   -   int     - number of render slots the node is divided into
+        Returns:
+            list    -   [CRServerMachine] or [CRRenderSlot, ...]
+        Side Effects:
+            Creates the slots when their number changes
+        Description:
+            The local node renders in a single process alongside blender, only
+            render nodes are divided into slots.
+        """
+        
+        if slots <= 1 or self.machine_uuid == 'local':
+            self.slots = {}
+            return [self]
+            
+        if len(self.slots) != slots:
+            
+            self.slots = {}
+            
+            for slot in range(slots):
+                render_slot = CRRenderSlot(self, slot, slots)
+                self.slots[render_slot.machine_uuid] = render_slot
+                
+        for render_slot in self.slots.values():
+            render_slot.node_A_manual = self.node_A_manual / slots
+            
+        return list(self.slots.values())
+        
+    def slot_for(self, msg):
+        """ Return the slot a msg from the node is about, or the node itself
+        """
+        
+        return self.slots.get(msg.attributes.get(utils.render_target), self)
+        
     def cancel_rendering(self, msg):  
         """ does what it says on the tin...
         """
@@ -907,7 +1016,7 @@ class CRServerMachine:
                 
         else:
             
-            self.cip_ssp_pubsub.send_string(json.dumps(msg.serialize(), 
+            utils.send_msg_string(self.cip_ssp_pubsub, json.dumps(msg.serialize(), 
                             cls = utils.BTEncoder))
     
     def handle_failed_render(self, msg):
@@ -958,17 +1067,20 @@ class CRServerMachine:
         local_file_path = os.path.join( self.client.session_path,
                      os.path.split(fid)[1])
         rendered_view = msg.attributes[utils.view]
+        target = self.slot_for(msg)
         
-        ready_msg_attrs = {utils.screen_coords:self.screen_coords,
+        ready_msg_attrs = {utils.screen_coords:target.screen_coords,
                             utils.current_frame:frame_no,
                             utils.node_name:self.node_name,
                             utils.file_path:(fid,local_file_path),
                             utils.node_uuid:self.machine_uuid,
-                            utils.view:rendered_view}
+                            utils.render_target:target.machine_uuid,
+                            utils.view:rendered_view,
+                            utils.tile_no:target.tile_no}
         
         ## UPDATE K AND SETUP TIME
-        self.k = msg.attributes[utils.k]
-        self.t_s = msg.attributes[utils.t_s]
+        target.k = msg.attributes[utils.k]
+        target.t_s = msg.attributes[utils.t_s]
                             
         
         
@@ -989,6 +1101,7 @@ class CRServerMachine:
             
             ready_msg_attrs[utils.command] = utils.view_ready
             ready_msg_attrs[utils.cancelled_command] = utils.cancel_tile_download
+            ready_msg_attrs[utils.priority] = network_engine.PRIORITY_INTERACTIVE
             
             get_image_msg = MsgWrapper(command = utils.file_transf_req,
                                         t_uuid = msg.t_uuid,
@@ -1013,17 +1126,21 @@ class CRServerMachine:
         local_file_path = os.path.join( self.client.session_path,
                      os.path.split(fid)[1])
         rendered_view = msg.attributes.get(utils.view,'')
+        # the node or, if it's divided into render slots, the slot that rendered
+        target = self.slot_for(msg)
         
-        ready_msg_attrs = {utils.screen_coords:self.screen_coords,
+        ready_msg_attrs = {utils.screen_coords:target.screen_coords,
                             utils.current_frame:frame_no,
                             utils.node_name:self.node_name,
                             utils.file_path:(fid,local_file_path),
                             utils.node_uuid:self.machine_uuid,
-                            utils.view:rendered_view}
+                            utils.render_target:target.machine_uuid,
+                            utils.view:rendered_view,
+                            utils.tile_no:target.tile_no}
         
         ## UPDATE K AND SETUP TIME
-        self.k = msg.attributes[utils.k]
-        self.t_s = msg.attributes[utils.t_s]
+        target.k = msg.attributes[utils.k]
+        target.t_s = msg.attributes[utils.t_s]
                             
         self.logger.info("CRServerMachine.get_finished_tile; "+\
                          str(self.machine_uuid) + \
@@ -1061,6 +1178,7 @@ class CRServerMachine:
             
             ready_msg_attrs[utils.command] = utils.result_ready
             ready_msg_attrs[utils.cancelled_command] = utils.cancel_tile_download
+            ready_msg_attrs[utils.priority] = network_engine.PRIORITY_INTERACTIVE
             
             get_image_msg = MsgWrapper(command = utils.file_transf_req,
                                         t_uuid = msg.t_uuid,
@@ -1069,6 +1187,13 @@ class CRServerMachine:
             
             self.client.file_request_sock.send_json(get_image_msg.serialize())
         
+        # when an animation is rendered frame by frame, or tiles are taken from 
+        # a queue, this node is now idle, give it the next frame or tile while
+        # its result downloads
+        self.client.speculation.rendered(target.machine_uuid)
+        self.client.frame_finished(target, msg)
+        self.client.tile_finished(target)
+        
         #TODO the request to get the file will likely trigger another handler
         # yet to be written that tells the engine in self.ready_engines that 
         # the file can now be loaded. Or why not just get the CRRenderThread
@@ -1087,7 +1212,7 @@ class CRServerMachine:
         
             msg.attributes[utils.message_uuid] = str(uuid.uuid4())
         
-            self.cip_ssp_pubsub.send_string( json.dumps (msg.serialize(),
+            utils.send_msg_string(self.cip_ssp_pubsub,  json.dumps (msg.serialize(),
                                                     cls = utils.BTEncoder) )
             self.closed()
                                                      
@@ -1101,8 +1226,13 @@ class CRServerMachine:
                                                     
     def closed(self):
         
-        #nothing to disconnect if this is the local process
-        if self.machine_uuid == 'local': pass
+        #nothing to disconnect if this is the local process, but its render 
+        # worker has to go
+        if self.machine_uuid == 'local':
+            
+            if self.render_worker is not None:
+                self.render_worker.stop()
+                self.render_worker = None
         
         else:
             #Disconnect the file server from the node
@@ -1146,6 +1276,78 @@ class CRServerMachine:
         self.exited = True
         
 
+class CRRenderSlot:
+    """ One of several render processes on a node, a render target of its own
+    
+    Arguments:
+        machine     -   CRServerMachine - the node the slot is part of
+        slot        -   int     - number of the slot, from 0
+        slots       -   int     - number of slots the node is divided into
+    
+    Description:
+        A node with several GPUs, or so many CPU cores that cycles no longer 
+        scales across them, is underused by a single render process. Divided 
+        into slots it renders one region per slot at once, each slot with its 
+        own share of the node's devices, see render.partition_devices.
+        
+        The load balancer and the tile and frame queues treat each slot as a 
+        node, with its own k and t_s. Everything to do with the connection is
+        the node's, msgs are sent through it and it passes the ones about a 
+        slot's render on to the slot, see CRServerMachine.slot_for.
+        
+    """
+    
+    def __init__(self, machine, slot, slots):
+        
+        self.machine = machine
+        self.slot = slot
+        self.slots = slots
+        self.machine_uuid = render.slot_uuid(machine.machine_uuid, slot, slots)
+        self.node_name = machine.node_name + " [" + str(slot + 1) + "/" +\
+            str(slots) + "]"
+        # until the slot has rendered, assume it is its share of the node
+        self.k = machine.k * slots
+        self.t_s = machine.t_s
+        self.screen_coords = (0.0, 0.0, 0.0, 0.0)
+        self.tile_no = None
+        self.node_A_manual = machine.node_A_manual / slots
+        self.node_A_auto = 0.0
+        
+    @property
+    def status(self):
+        
+        return self.machine.status
+        
+    @property
+    def bandwidth(self):
+        # the slots of a node share its connection
+        return self.machine.bandwidth / self.slots
+        
+    def render(self, msg):
+        """ Send the node a command to render the slot's region
+        """
+        
+        msg.attributes[utils.screen_coords] = self.screen_coords
+        msg.attributes[utils.machine_uuid] = self.machine.machine_uuid
+        msg.attributes[utils.render_target] = self.machine_uuid
+        msg.attributes[utils.render_slot] = self.slot
+        msg.attributes[utils.message_uuid] = str(uuid.uuid4())
+        
+        utils.send_msg_string(self.machine.cip_ssp_pubsub, 
+            json.dumps(msg.serialize(), cls = utils.BTEncoder))
+            
+    def cancel_rendering(self, msg):
+        """ Cancel the slot's render, the node's other slots keep rendering
+        """
+        
+        # every node receives the cancel, it's for the slot's node only
+        msg.attributes[utils.machine_uuid] = self.machine.machine_uuid
+        msg.attributes[utils.render_target] = self.machine_uuid
+        
+        utils.send_msg_string(self.machine.cip_ssp_pubsub, 
+            json.dumps(msg.serialize(), cls = utils.BTEncoder))
+            
+            
 class CRClientServerManager:
     """ Client Server Manager
     """
@@ -1186,11 +1388,18 @@ class CRClientServerManager:
         self.machines = {}
         self.rendering = {}
         self.machines_working = {}
+        self.deadlines = utils.CRDeadlines()
+        self.progress = CRProgressAggregator(
+            read_config_file([config.progress_rate])[config.progress_rate])
         self.syncing = {}
         self.machine_uuid = utils.get_machine_uuid()
         self.pending_connections = {}
         self.ready_engines = {}
         self.progress_tiles = {}
+        self.frame_queue = None # render.CRFrameQueue of an animation rendered by frame
+        self.tile_queue = None # render.CRTileQueue of a frame whose tiles are shared
+        self.speculation = render.CRSpeculation() # regions watched for slow nodes
+        self.targets = {} # uuid : node or render slot, for the frame being rendered
         self.http_requests = {}
         self.http_refresh_interval = 30.0
         #note this is actually reset each time init_session is called to dump 
@@ -1370,7 +1579,11 @@ class CRClientServerManager:
     def process_msgs(self):
         #sometimes this is put in a 'try/except handler'
         # 1000 is equivilent to a 1 second timeout
-        sock_events = dict(self.poller.poll(16))
+        # sleep until a msg arrives, a machine's response is due or there's 
+        # progress to publish
+        sock_events = dict(self.poller.poll(
+                                self.progress.poll_timeout(
+                                    self.deadlines.poll_timeout(IDLE_POLL_MAX))))
         #self.logger.info("process_msgs : completed timeout")
         
         try:
@@ -1566,14 +1779,24 @@ class CRClientServerManager:
             # are late. They will be added back if they eventually respond, but they
             # won't be included in the render unless they respond.
             
-            for machine in self.machines_working.values():
+            for machine_uuid in self.deadlines.pop_expired():
+                
+                if machine_uuid == STRAGGLER_CHECK:
+                    self.speculate()
+                    continue
+                
+                machine = self.machines_working.get(machine_uuid)
+                
+                if machine is None: continue
                 
                 machine.time_elapsed = time.perf_counter() - machine.start_time
                 
-                if machine.time_elapsed > TIMEOUT and \
-                         not machine.status == utils.unresponsive: 
+                if not machine.status == utils.unresponsive: 
                     
                     machine.status = utils.unresponsive
+            
+            # forward the latest progress for each node, if its time to
+            self.progress.publish(self.cli_cip_router)
   
             
             if not self.render_jobs_queue.empty():
@@ -1585,9 +1808,15 @@ class CRClientServerManager:
                 self.render_jobs_queue.task_done()
             
            
-            for machine in list(self.machines):
-                if self.machines[machine].exited:
-                    self.machines.pop(machine)
+            exited = [machine for machine in self.machines 
+                        if self.machines[machine].exited]
+            
+            for machine in exited:
+                self.machines.pop(machine)
+                
+            # the other nodes stop asking those that have gone for file chunks
+            if exited:
+                self.send_swarm_peers()
                     
                         
     def update_tile_size(self, sess_uuid, msg):
@@ -1654,6 +1883,26 @@ class CRClientServerManager:
             mach.update_client_status(copy.deepcopy(msg))                       
        
     
+    def send_swarm_peers(self):
+        """ Tell each render node where the file servers of the others are
+        
+        Render nodes fetch chunks of the session files from each other as well as 
+        from this machine, so the upload of each file doesn't grow with the number
+        of nodes. Each node ignores its own entry and those it already knows.
+        """
+        
+        swarm_nodes = [[m_uuid, machine.ssp_endpoints[utils.file_server_ep]]\
+            for m_uuid, machine in self.machines.items() \
+                if not m_uuid == 'local' and machine.ssp_endpoints]
+                
+        msg = MsgWrapper(command = utils.swarm_peers,
+            attributes = {utils.swarm_nodes:swarm_nodes})
+            
+        msg.attributes[utils.message_uuid] = str(uuid.uuid4())
+        
+        utils.send_msg_string(self.cip_ssp_pubsub, json.dumps(msg.serialize(),
+                                                cls = utils.BTEncoder))
+        
     def data_update(self, s_uuid, msg):
         """ forward data updates to all servers
         
@@ -1670,7 +1919,7 @@ class CRClientServerManager:
 #             self.syncing[uuid] = machine
         msg.attributes[utils.message_uuid] = str(uuid.uuid4())
         
-        self.cip_ssp_pubsub.send_string( json.dumps (msg.serialize(),
+        utils.send_msg_string(self.cip_ssp_pubsub,  json.dumps (msg.serialize(),
                                                 cls = utils.BTEncoder) )
             
         
@@ -1713,6 +1962,18 @@ class CRClientServerManager:
         Y = 1
         PERCENTAGE = 2
         
+        by_frame = msg.attributes.get(utils.frame_distribution, False) and\
+            msg.attributes[utils.is_animation]
+        
+        # the nodes are already working through this animation's frames, the 
+        # engine only has to wait for its frame to come back.
+        if by_frame and self.frame_queue is not None and\
+            msg.attributes[utils.current_frame] in self.frame_queue.frames:
+            
+            self.wait_for_frame(msg)
+            
+            return
+        
         screen_resolutions = msg.attributes[utils.screen_res]
         
         screen_res_x = screen_resolutions[X] * screen_resolutions[PERCENTAGE] / 100
@@ -1737,7 +1998,24 @@ class CRClientServerManager:
             machine.node_A_manual = manual_lb
             
             if not machine.status == utils.synced: continue
-            machines_rendering[uuid] = machine
+            
+            # a node divided into render slots takes part as one target per slot
+            slots = msg.attributes[utils.nodes][uuid].get(utils.render_slots, 1)
+            
+            for target in machine.render_targets(slots):
+                machines_rendering[target.machine_uuid] = target
+            
+        self.targets = dict(machines_rendering)
+            
+        # regions of nodes that fall behind are given to idle nodes as well, not
+        # for stereo renders since their views arrive separately
+        if not by_frame and not msg.attributes[utils.views] and read_config_file(
+                [config.speculate_stragglers])[config.speculate_stragglers]:
+                
+            self.speculation.begin(msg, machines_rendering, 
+                                   screen_res_x, screen_res_y, samples)
+        else:
+            self.speculation.clear()
             
         #If there are no machines enabled for rendering Don't try and render.
         if not machines_rendering:
@@ -1750,18 +2028,38 @@ class CRClientServerManager:
             self.cli_cip_router.send_multipart([msg.t_uuid, 
                 bytes(json.dumps(report_msg.serialize(), 
                                 cls = utils.BTEncoder), 'utf-8')])
+        elif by_frame:
+            
+            self.start_frame_job(msg, machines_rendering)
+            
+        elif msg.attributes.get(utils.dynamic_tiles, False):
+            
+            self.start_tile_job(msg, machines_rendering, 
+                                screen_res_x, screen_res_y)
+            
         else:
             
             ### CALCULATE TILE SIZES FOR EACH NODE ###    
+            bytes_per_pixel = render.result_bytes_per_pixel(
+                msg.attributes.get(utils.result_channels, 4),
+                msg.attributes[utils.exr_codec],
+                msg.attributes.get(utils.color_depth, '32'))
+            
             machines_rendering = render.screen_divide(machines_rendering, 
                         screen_res_x, 
                         screen_res_y,
                         samples,
                         msg.attributes[utils.manual_loadb],#use manual load balancing
-                        self.logger)
+                        self.logger,
+                        bytes_per_pixel)
             
             
             self.progress_tiles = machines_rendering
+            
+            for machine in nodes.values():
+                if machine.slots:
+                    machine.node_A_auto = sum(render_slot.node_A_auto 
+                        for render_slot in machine.slots.values())
                     
             
             ### SEND THE RENDER COMMAND ###
@@ -1772,13 +2070,434 @@ class CRClientServerManager:
                 
             sorted_macs = sorted(machines_rendering)
                 
-            for uuid in sorted_macs:
+            saved = set()
+                
+            for region, uuid in enumerate(sorted_macs):
                 
                 machine = machines_rendering[uuid]
                 
+                # the slots of a node all render from the file its first one saves
+                msg.attributes[utils.first_tile] =\
+                    render.slot_node(uuid) not in saved
+                saved.add(render.slot_node(uuid))
+                
+                self.speculation.start(uuid, region, machine.screen_coords, 
+                    self.speculation.predict(machine, machine.screen_coords))
+                
                 machine.render(msg)
                 
                 self.rendering[machine.machine_uuid] = machine
+                
+            self.speculate()
+                
+    def start_tile_job(self, msg, machines, screen_x, screen_y):
+        """ Render a frame as many small tiles that nodes take as they become idle
+        
+        Arguments:
+            msg         -   utils.MsgWrapper - render command for the frame
+            machines    -   dict    - {machine_uuid:CRServerMachine} nodes that 
+                                        can render
+            screen_x    -   float   - width of the image in pixels
+            screen_y    -   float   - height of the image in pixels
+        Returns:
+            None
+        Side Effects:
+            Creates self.tile_queue and sends each node its first tile
+        Exceptions:
+            None
+        Description:
+            Tiles are streamed to blender's render engine as they arrive, the 
+            frame is finalised once all of them are in. See render.CRTileQueue.
+            
+        """
+        
+        num_tiles = len(machines) *\
+            read_config_file([config.tiles_per_node])[config.tiles_per_node]
+        
+        self.tile_queue = render.CRTileQueue(
+            msg, render.split_screen(screen_x, screen_y, num_tiles), machines)
+            
+        self.progress_tiles.clear()
+        
+        self.logger.info("CRClientServerManager.start_tile_job" + l_sep +\
+            " rendering " + str(len(self.tile_queue.tiles)) + " tiles on " +\
+            str(len(machines)) + " nodes")
+        
+        self.dispatch_tiles()
+        
+    def dispatch_tiles(self):
+        """ Send the next tile of the frame to each idle node
+        """
+        
+        tile_queue = self.tile_queue
+        
+        for node_uuid in tile_queue.idle_nodes():
+            
+            machine = self.targets.get(node_uuid)
+            
+            if machine is None:
+                tile_queue.drop_node(node_uuid)
+                continue
+                
+            tile_no = tile_queue.next_tile(node_uuid)
+            
+            if tile_no is None: continue
+            
+            job = tile_queue.job
+            
+            tile_msg = MsgWrapper(command = job.command, 
+                                  t_uuid = job.t_uuid,
+                                  s_uuid = job.s_uuid, 
+                                  attributes = dict(job.attributes))
+            
+            tile_msg.attributes[utils.tile_no] = tile_no
+            # a node saves its copy of the session file before its first tile
+            tile_msg.attributes[utils.first_tile] =\
+                render.slot_node(node_uuid) not in tile_queue.started
+            tile_queue.started.add(render.slot_node(node_uuid))
+            
+            machine.screen_coords = tile_queue.tiles[tile_no]
+            machine.tile_no = tile_no
+            
+            self.speculation.start(node_uuid, tile_no, machine.screen_coords,
+                self.speculation.predict(machine, machine.screen_coords))
+            
+            machine.render(tile_msg)
+            
+            self.rendering[node_uuid] = machine
+            
+        self.speculate()
+            
+    def tile_finished(self, machine):
+        """ Handle a node finishing a tile taken from the tile queue
+        """
+        
+        if self.tile_queue is None: return
+        
+        self.tile_queue.tile_rendered(machine.machine_uuid)
+        
+        self.dispatch_tiles()
+        
+    def tile_result(self, msg):
+        """ Pass a downloaded tile to blender, finalising the frame after the last one
+        """
+        
+        accepted, owner, losers = self.speculation.accept(
+            msg.attributes.get(utils.render_target) or msg.attributes[utils.node_uuid],
+            msg.attributes.get(utils.tile_no))
+        
+        if not accepted: return
+        
+        self.cancel_copies(losers)
+        
+        self.cli_cip_router.send_multipart([msg.t_uuid, 
+            bytes(json.dumps(msg.serialize()),'utf-8')])
+            
+        self.tile_queue.tile_received(msg.attributes.get(utils.tile_no))
+        
+        if self.tile_queue.finished():
+            
+            final_msg = MsgWrapper(command = utils.finalise_render,
+                attributes = self.end_speculation())
+            
+            self.cli_cip_router.send_multipart([msg.t_uuid, 
+                bytes(json.dumps(final_msg.serialize()),'utf-8')])
+                
+            self.tile_queue = None
+            self.rendering.clear()
+        
+    def render_progress(self, node_uuid, msg):
+        """ Note how far through its region a node is from its render stats
+        """
+        
+        stats = msg.attributes.get(utils.render_stats)
+        
+        if stats:
+            self.speculation.update(node_uuid, stats[-1][0])
+            
+    def speculate(self):
+        """ Give the regions of nodes that have fallen behind to idle nodes as well
+        
+        Arguments:
+            None
+        Returns:
+            None
+        Side Effects:
+            Sends copies of late nodes' regions to idle nodes and schedules the
+            next check for late nodes
+        Exceptions:
+            None
+        Description:
+            A node is late once it has taken render.SPECULATE_SLOWDOWN times its
+            predicted time for its region and is less than render.SPECULATE_PROGRESS
+            of the way through it. Its region is given to the idle node predicted
+            to render it fastest, as long as that node is expected to finish before
+            the late one. The first of the two results to arrive is used, see 
+            render.CRSpeculation.accept and cancel_copies.
+            
+        """
+        
+        spec = self.speculation
+        
+        if not spec.active: return
+        
+        if self.tile_queue is not None:
+            # nodes only run out of tiles at the end of the frame
+            idle = [] if self.tile_queue.pending else self.tile_queue.idle_nodes()
+        else:
+            idle = [uuid for uuid in sorted(spec.nodes) 
+                        if uuid not in self.progress_tiles]
+                        
+        idle = [self.targets[uuid] for uuid in idle 
+                    if uuid in self.targets and uuid not in spec.assigned]
+        
+        for node_uuid in spec.stragglers():
+            
+            if not idle: break
+            
+            region = spec.assigned[node_uuid]
+            coords = spec.regions[region]
+            
+            backup = min(idle, key = lambda machine: spec.predict(machine, coords))
+            
+            if spec.predict(backup, coords) >= spec.remaining(node_uuid): continue
+            
+            idle.remove(backup)
+            
+            self.render_copy(backup, node_uuid, region, coords)
+            
+        deadline = spec.next_check()
+        
+        if deadline is None:
+            self.deadlines.cancel(STRAGGLER_CHECK)
+        else:
+            self.deadlines.schedule_at(STRAGGLER_CHECK, deadline)
+            
+    def render_copy(self, machine, node_uuid, region, coords):
+        """ Send machine a copy of the region a late node is rendering
+        """
+        
+        job = self.speculation.job
+        
+        copy_msg = MsgWrapper(command = job.command, 
+                              t_uuid = job.t_uuid,
+                              s_uuid = job.s_uuid, 
+                              attributes = dict(job.attributes))
+        
+        # the region's number gives the copy its own output file
+        copy_msg.attributes[utils.tile_no] = region
+        
+        if self.tile_queue is not None:
+            copy_msg.attributes[utils.first_tile] =\
+                render.slot_node(machine.machine_uuid) not in self.tile_queue.started
+            self.tile_queue.started.add(render.slot_node(machine.machine_uuid))
+            self.tile_queue.rendering[machine.machine_uuid] = region
+        else:
+            # the node has saved the file already to render its own region
+            copy_msg.attributes[utils.first_tile] = False
+            
+        machine.screen_coords = coords
+        machine.tile_no = region
+        
+        self.speculation.start(machine.machine_uuid, region, coords,
+            self.speculation.predict(machine, coords))
+            
+        self.logger.info("CRClientServerManager.render_copy" + l_sep +\
+            str(machine.node_name) + " is also rendering region " + str(region) +\
+            " of " + str(self.targets[node_uuid].node_name) + " which is late")
+            
+        machine.render(copy_msg)
+        
+        self.rendering[machine.machine_uuid] = machine
+        
+    def cancel_copies(self, losers):
+        """ Cancel renders of a region whose result has already been received
+        """
+        
+        job = self.speculation.job
+        
+        for node_uuid in losers:
+            
+            if self.tile_queue is not None:
+                self.tile_queue.tile_rendered(node_uuid)
+                
+            machine = self.targets.get(node_uuid)
+            
+            if machine is None: continue
+            
+            # every node receives a cancel, so it must name the node it is for
+            # or all of them would stop rendering their own regions
+            cancel_msg = MsgWrapper(command = utils.cancel_render,
+                s_uuid = job.s_uuid,
+                t_uuid = job.t_uuid,
+                attributes = {utils.message_uuid:str(uuid.uuid4()),
+                              utils.machine_uuid:render.slot_node(node_uuid)})
+                
+            machine.cancel_rendering(cancel_msg)
+            
+    def end_speculation(self):
+        """ Stop watching the frame for slow nodes, returning the frame's counters
+        
+        Returns:
+            dict    -   attributes for the finalise_render msg, the number of 
+                        regions copied to other nodes and the number of those 
+                        copies that came back first
+        """
+        
+        spec = self.speculation
+        
+        counters = {utils.speculative_launches:spec.frame_launches,
+                    utils.speculative_wins:spec.frame_wins}
+                    
+        if spec.frame_launches:
+            
+            self.logger.info("CRClientServerManager.end_speculation" + l_sep +\
+                " copied " + str(spec.frame_launches) + " regions of late nodes, " +\
+                str(spec.frame_wins) + " copies finished first. Session totals: " +\
+                str(spec.launches) + " copies, " + str(spec.wins) + " finished first")
+                
+        spec.clear()
+        self.deadlines.cancel(STRAGGLER_CHECK)
+        
+        return counters
+        
+    def start_frame_job(self, msg, machines):
+        """ Start rendering an animation by giving whole frames to idle nodes
+        
+        Arguments:
+            msg         -   utils.MsgWrapper - render command for the animation's 
+                                                first frame
+            machines    -   dict    - {machine_uuid:CRServerMachine} nodes that 
+                                        can render
+        Returns:
+            None
+        Side Effects:
+            Creates self.frame_queue and sends each node its first frame
+        Exceptions:
+            None
+        Description:
+            Instead of each frame being split into strips across every node, 
+            nodes take whole frames from a shared queue and render them 
+            ahead of blender. See render.CRFrameQueue.
+            
+        """
+        
+        start_frame, end_frame = msg.attributes[utils.frame_range]
+        
+        frames = range(msg.attributes[utils.current_frame], end_frame + 1,
+                       max(1, msg.attributes.get(utils.frame_step, 1)))
+        
+        self.frame_queue = render.CRFrameQueue(
+            msg, frames, sorted(machines), 
+            read_config_file([config.frame_batch_size])[config.frame_batch_size])
+            
+        self.progress_tiles.clear()
+        
+        self.logger.info("CRClientServerManager.start_frame_job" + l_sep +\
+            " rendering " + str(len(frames)) + " frames on " +\
+            str(len(machines)) + " nodes")
+        
+        self.dispatch_frames()
+        self.wait_for_frame(msg)
+        
+    def dispatch_frames(self):
+        """ Send the next frame of the animation to each idle node
+        """
+        
+        frame_queue = self.frame_queue
+        
+        for node_uuid in frame_queue.idle_nodes():
+            
+            machine = self.targets.get(node_uuid)
+            
+            if machine is None:
+                frame_queue.drop_node(node_uuid)
+                continue
+                
+            frame = frame_queue.next_frame(node_uuid)
+            
+            if frame is None: continue
+            
+            job = frame_queue.job
+            
+            frame_msg = MsgWrapper(command = job.command, 
+                                   t_uuid = job.t_uuid,
+                                   s_uuid = job.s_uuid, 
+                                   attributes = dict(job.attributes))
+            
+            frame_msg.attributes[utils.current_frame] = frame
+            # a node saves its copy of the session file before its first frame
+            frame_msg.attributes[utils.first_frame] =\
+                render.slot_node(node_uuid) not in frame_queue.started
+            frame_queue.started.add(render.slot_node(node_uuid))
+            
+            machine.screen_coords = render.FULL_FRAME
+            machine.render(frame_msg)
+            
+            self.rendering[node_uuid] = machine
+            
+    def frame_finished(self, machine, msg):
+        """ Handle a node finishing a frame of an animation rendered by frame
+        """
+        
+        if self.frame_queue is None: return
+        
+        self.frame_queue.frame_rendered(machine.machine_uuid, 
+                                        msg.attributes[utils.current_frame])
+        
+        self.dispatch_frames()
+        
+    def wait_for_frame(self, msg):
+        """ Register the render engine that is waiting for a frame
+        
+        The engine's t_uuid is also used for the frames sent from now on, so 
+        their render stats reach an engine that is still open.
+        """
+        
+        frame = msg.attributes[utils.current_frame]
+        
+        self.frame_queue.engines[frame] = msg.t_uuid
+        self.frame_queue.job.t_uuid = msg.t_uuid
+        
+        self.deliver_frame(frame)
+        
+    def frame_result(self, msg, complete):
+        """ Keep a downloaded frame until blender's render engine asks for it
+        """
+        
+        frame = msg.attributes[utils.current_frame]
+        
+        self.frame_queue.add_result(frame, msg, complete)
+        
+        if complete:
+            self.deliver_frame(frame)
+            
+    def deliver_frame(self, frame):
+        """ Send a frame's results to its render engine once both have arrived
+        """
+        
+        ready = self.frame_queue.take_frame(frame)
+        
+        if ready is None: return
+        
+        t_uuid, results = ready
+        
+        for result in results:
+            self.cli_cip_router.send_multipart([t_uuid, 
+                bytes(json.dumps(result.serialize()),'utf-8')])
+                
+        final_msg = MsgWrapper(command = utils.finalise_render)
+            
+        self.cli_cip_router.send_multipart([t_uuid, 
+            bytes(json.dumps(final_msg.serialize()),'utf-8')])
+            
+        if self.frame_queue.finished():
+            
+            self.logger.info("CRClientServerManager.deliver_frame" + l_sep +\
+                " all frames of the animation delivered")
+            
+            self.frame_queue = None
+            self.rendering.clear()
         
         
     def cancel_render(self, sess_uuid, msg):
@@ -1791,6 +2510,10 @@ class CRClientServerManager:
 
         self.rendering.clear()
         self.progress_tiles.clear()
+        self.frame_queue = None
+        self.tile_queue = None
+        self.speculation.clear()
+        self.deadlines.cancel(STRAGGLER_CHECK)
         
         self.logger.info("CRServerManager.cancel_render: " + "Cancelling render")
  
@@ -1826,8 +2549,68 @@ class CRClientServerManager:
             a chance to rectify the situation.
                 
         """
-        node_uuid = msg.attributes[utils.node_uuid]
+        # the node, or its render slot, that failed
+        node_uuid = msg.attributes.get(utils.render_target) or\
+            msg.attributes[utils.node_uuid]
         node_name = msg.attributes[utils.node_name]
+        
+        # the render was stopped because another node finished its region first
+        if self.speculation.was_cancelled(node_uuid):
+            
+            self.logger.info("CRServerManager.render_failed" + l_sep +\
+                " cancelled render on :" + str(node_name) + " has stopped")
+            
+            return
+            
+        # another node has a copy of the region, the frame can do without this one
+        if self.speculation.drop(node_uuid):
+            
+            self.logger.warning("CRServerManager.render_failed" + l_sep +\
+                " Render failed on :" + str(node_name) + ", another node is " +\
+                "rendering its region, the error messsage follows: " +\
+                 l_sep.join(msg.attributes[utils.error_message]))
+            
+            if self.tile_queue is not None:
+                self.tile_queue.rendering.pop(node_uuid, None)
+                self.tile_queue.drop_node(node_uuid)
+                
+            return
+            
+        # rendering by frame, the node's frames go to the other nodes. The engine
+        # only hears of it when there's no node left to render the animation.
+        if self.frame_queue is not None:
+            
+            self.logger.warning("CRServerManager.render_failed" + l_sep +\
+                " Render failed on :" + str(node_name) + ", its frames are " +\
+                "being given to other nodes, the error messsage follows: " +\
+                 l_sep.join(msg.attributes[utils.error_message]))
+            
+            if self.frame_queue.drop_node(node_uuid):
+                self.dispatch_frames()
+                return
+                
+            for t_uuid in set(self.frame_queue.engines.values()):
+                self.cli_cip_router.send_multipart([t_uuid, 
+                    bytes(json.dumps(msg.serialize()),'utf-8')])
+            
+            self.frame_queue = None
+            
+            return
+            
+        # sharing tiles, the node's tile goes back to the queue for the others
+        if self.tile_queue is not None:
+            
+            self.logger.warning("CRServerManager.render_failed" + l_sep +\
+                " Render failed on :" + str(node_name) + ", its tile is " +\
+                "being given to other nodes, the error messsage follows: " +\
+                 l_sep.join(msg.attributes[utils.error_message]))
+            
+            if self.tile_queue.drop_node(node_uuid):
+                self.dispatch_tiles()
+                return
+                
+            self.tile_queue = None
+            
         try:
             #Remove the node from the list of rendering machines
             self.progress_tiles.pop(node_uuid)
@@ -1839,7 +2622,7 @@ class CRClientServerManager:
                 str(node_name) + " from the list of rendering nodes")
         
         self.logger.warning("CRServerManager.render_failed" + l_sep +\
-            " Render failed on :" + self.machines[node_uuid].node_name +\
+            " Render failed on :" + str(node_name) +\
             " the error messsage follows: " +\
                  l_sep.join(msg.attributes[utils.error_message])
             )
@@ -1855,6 +2638,9 @@ class CRClientServerManager:
         
         """    
            
+        if self.frame_queue is not None:
+            self.frame_result(msg, False)
+            return
         
         # Route the message to the right render engine instance inside blender
         self.cli_cip_router.send_multipart([msg.t_uuid, 
@@ -1876,14 +2662,32 @@ class CRClientServerManager:
         render engine in blender to finish the frame. See CrenderEngine.frame_done for 
         the details.
         
+        When an animation is rendered by frame, the result is held until the engine
+        for its frame asks for it, see start_frame_job.
+        
         """    
            
+        self.update_bandwidth(msg)
+        
+        if self.frame_queue is not None:
+            self.frame_result(msg, True)
+            return
+            
+        if self.tile_queue is not None:
+            self.tile_result(msg)
+            return
+        
+        # a copy of a region that has already been received is dropped
+        accepted, node_uuid, losers = self.speculation.accept(
+            msg.attributes.get(utils.render_target) or msg.attributes[utils.node_uuid])
+        
+        if not accepted: return
+        
+        self.cancel_copies(losers)
         
         # Route the message to the right render engine instance inside blender
         self.cli_cip_router.send_multipart([msg.t_uuid, 
             bytes(json.dumps(msg.serialize()),'utf-8')])
-           
-        node_uuid = msg.attributes[utils.node_uuid]
         
         if node_uuid in self.progress_tiles:
             self.progress_tiles.pop(node_uuid)
@@ -1891,15 +2695,33 @@ class CRClientServerManager:
             self.logger.warning("CRClientServerManager.result_ready()" + l_sep +\
             "Node " + str(node_uuid) + " not found in progress_tiles")
         
-        if not self.progress_tiles:
+        if self.progress_tiles:
+            # the node that sent this is idle now, it may be able to help a slow one
+            self.speculate()
+        else:
             #when progress_tiles is empty we need to finalise the render
-            final_msg = MsgWrapper(command = utils.finalise_render)
+            final_msg = MsgWrapper(command = utils.finalise_render,
+                attributes = self.end_speculation())
             
             self.cli_cip_router.send_multipart([msg.t_uuid, 
                 bytes(json.dumps(final_msg.serialize()),'utf-8')])
         
          
         
+    def update_bandwidth(self, msg):
+        """ Fold the transfer rate of a downloaded result into its node's bandwidth
+        """
+        
+        rate = msg.attributes.get(utils.transfer_rate)
+        machine = self.machines.get(msg.attributes.get(utils.node_uuid))
+        
+        if not rate or machine is None: return
+        
+        if machine.bandwidth > 0.0:
+            machine.bandwidth += render.BANDWIDTH_EWMA * (rate - machine.bandwidth)
+        else:
+            machine.bandwidth = rate
+            
     def contact_server(self, sess_uuid, msg):
         
         """
@@ -2289,12 +3111,12 @@ class CRClientServerManager:
                 
             hello_msg.attributes[utils.message_uuid] = str(uuid.uuid4())
                 
-            self.cip_ssp_pubsub.send_string(json.dumps(hello_msg.serialize(), 
+            utils.send_msg_string(self.cip_ssp_pubsub, json.dumps(hello_msg.serialize(), 
                             cls = utils.BTEncoder))
             
             try:
             
-                response = ssp_cip_pubsub.recv_string(zmq.NOBLOCK)
+                response = utils.recv_msg_string(ssp_cip_pubsub, zmq.NOBLOCK)
                 
                 self.logger.info("CRClientServerManager.server_connect" +\
                     l_sep +\
@@ -2362,7 +3184,11 @@ class CRClientServerManager:
                                 )
             check_top_hash_msg.attributes[utils.message_uuid] = str(uuid.uuid4())
             
-            self.cip_ssp_pubsub.send_string(json.dumps(check_top_hash_msg.serialize(), 
+            # let the new node, and those already connected, fetch session files
+            # from each other
+            self.send_swarm_peers()
+            
+            utils.send_msg_string(self.cip_ssp_pubsub, json.dumps(check_top_hash_msg.serialize(), 
                                 cls = utils.BTEncoder))
             
             #Since we've just connected to another machine, we need to update the 
@@ -2576,7 +3402,7 @@ class CRClientServerManager:
                 
                 load_msg.attributes[utils.message_uuid] = str(uuid.uuid4())
                 
-                self.cip_ssp_pubsub.send_string( json.dumps(
+                utils.send_msg_string(self.cip_ssp_pubsub,  json.dumps(
                                 load_msg.serialize(), 
                             cls = utils.BTEncoder))
         
@@ -2641,7 +3467,9 @@ class CRClientServerManager:
                 self.file_request_sock_addr,
                 self.network_timeout,
                 local_public_key = self.client_key_pub,
-                local_sec_key = self.client_key_secret
+                local_sec_key = self.client_key_secret,
+                compression = read_config_file(
+                    [config.file_compression])[config.file_compression]
                 )
             
 
@@ -2718,7 +3546,7 @@ class CRClientServerManager:
 
                 load_msg.attributes[utils.message_uuid] = str(uuid.uuid4())
                 
-                self.cip_ssp_pubsub.send_string( json.dumps(
+                utils.send_msg_string(self.cip_ssp_pubsub,  json.dumps(
                                 load_msg.serialize(), 
                             cls = utils.BTEncoder))
 
@@ -3511,13 +4339,13 @@ class CRClientServerManager:
         Description:
             This method is part of the feedback loop during img file downloads that 
             reports the progress of the download of images from a node on a 0-100% scale. 
-            
+            The msg is coalesced with other updates for the same node and forwarded
+            by self.progress at the configured rate.
                                 
         """
         
-        
-        self.cli_cip_router.send_multipart([msg.t_uuid, bytes(
-            json.dumps(msg.serialize()),'utf-8')])           
+        self.progress.add(msg.t_uuid, msg.attributes.get(utils.node_uuid), msg,
+                          self.cli_cip_router)
     
     def handle_signal(self, signum, frame):
         """ handle a signal so shutdown can close all associated ssp's
@@ -3548,7 +4376,7 @@ class CRClientServerManager:
         
         #This is a shutdown msg to all attached nodes.
         
-        self.cip_ssp_pubsub.send_string(
+        utils.send_msg_string(self.cip_ssp_pubsub, 
                     json.dumps(close_command,
                     cls = utils.BTEncoder))
         
@@ -3632,19 +4460,19 @@ class CRClientServerManager:
     def handle_unit_tests(self, msg):
         
         msg.attributes[utils.message_uuid] = str(uuid.uuid4())
-        self.cip_ssp_pubsub.send_string(utils.run_unit_tests)
+        utils.send_msg_string(self.cip_ssp_pubsub, utils.run_unit_tests)
         
     def fwd_nodes_by_uuid_rqst(self, sess_uuid, msg):
 
         msg.attributes[utils.message_uuid] = str(uuid.uuid4())
         msg.s_uuid = sess_uuid
-        self.cip_ssp_pubsub.send_string(json.dumps(msg.serialize(), 
+        utils.send_msg_string(self.cip_ssp_pubsub, json.dumps(msg.serialize(), 
                             cls = utils.BTEncoder))
         
     def fwd_node_attrib_hashes(self, sess_uuid, msg):
         msg.attributes[utils.message_uuid] = str(uuid.uuid4())
         msg.s_uuid = sess_uuid
-        self.cip_ssp_pubsub.send_string(json.dumps(msg.serialize(), 
+        utils.send_msg_string(self.cip_ssp_pubsub, json.dumps(msg.serialize(), 
                                         cls= utils.BTEncoder))
          
     def update_timeout_prefs(self, msg):
@@ -28,15 +28,23 @@ top_level_pckg = __package__.split(".")[0]
 
 crowdrender_mod = sys.modules.get(top_level_pckg)
 
+chunk_store_size = 'chunk_store_size'
 cr_token = 'cr_token'
 cr_version = 'cr_version'
 network_timeout = 'network_timeout'
 node_perf_data = 'node_perf_data'
 documentation = 'documentation'
+file_compression = 'file_compression'
+frame_batch_size = 'frame_batch_size'
 port_range = 'port_range'
+progress_rate = 'progress_rate'
+render_workers = 'render_workers'
+screen_layout = 'screen_layout'
 show_analytics_notification = 'show_analytics_notification'
 show_req_notification ='show_req_notification'
+speculate_stragglers = 'speculate_stragglers'
 start_port = 'start_port'
+tiles_per_node = 'tiles_per_node'
 upload_analytics_data = 'upload_analytics_data'
 url_api = 'url_api'
 url_api_reporting = 'url_api_reporting'
@@ -109,7 +117,15 @@ config_defaults = {
             cr_version:crowdrender_mod.bl_info['version'],
             start_port:9669,
             port_range:10,
+            progress_rate:10.0, # progress msgs per second forwarded to blender
             cr_token:'',
+            chunk_store_size:2048, # MB of chunks render nodes keep for reuse
+            file_compression:'auto', # 'auto', 'none', 'zstd', 'lz4', 'zlib' or 'lzma'
+            render_workers:True, # keep blender loaded between renders of a session
+            frame_batch_size:1, # frames a node reserves at once when rendering by frame
+            screen_layout:'tiles', # 'tiles' or 'strips', how a frame is divided between nodes
+            tiles_per_node:8, # tiles per node when nodes take tiles from a queue
+            speculate_stragglers:True, # give regions of slow nodes to idle nodes too
             network_timeout:30.0,
             node_perf_data:{},
             url_api:"https://discovery.crowd-render.com/api/v02/graph",
@@ -43,7 +43,7 @@ import bpy, time, zmq, sys, json, shutil, os, faulthandler, platform, inspect
 from tempfile import TemporaryDirectory
 
 from . import utils, ui_panels, render, rules
-from . utils import MsgWrapper, handle_generic_except, setup_logging
+from . utils import MsgWrapper, handle_generic_except, setup_logging, timed_out
 from . utils import write_report_data_file
 from statistics import mean
 from math import floor
@@ -73,6 +73,7 @@ temp_dir_obj = None#temporary directory used to store render results from nodes
 # CONSTANTS
 
 CHANNEL_IDS = 1 # #used in indexing to get the channels of render passes
+REDRAW_INTERVAL = 1.0 / 30.0 # secs, properties panels are redrawn at most this often
 NAME = 0 #used in indexing to get the name of render passes
 CH_IDS = 0
 CH_TYPE = 1
@@ -315,16 +316,14 @@ class CrenderEngine(bpy.types.RenderEngine):
         node_state = msg.attributes.get(utils.status, None)
         dwnld_prog = msg.attributes.get(utils.percent_complete, None)
         
-        #get ref to node
-        cr_nodes = {node.node_uuid:node for node in scene.cr_nodes}
-        
         node_uuid = msg.attributes.get(utils.node_uuid, None)
         
         try:
         
             if node_uuid is not None:
         
-                node = cr_nodes[node_uuid]
+                #get ref to node
+                node = self.get_cr_node(scene, node_uuid)
             
                 if node_state is not None and dwnld_prog is not None:
             
@@ -333,11 +332,8 @@ class CrenderEngine(bpy.types.RenderEngine):
                     node.node_state = node_state
                     node.node_result_progress = floor(dwnld_prog)
                 
-                    #get ref to properties area if it exists and tag it for a redraw
-                    for window in bpy.context.window_manager.windows:
-                        for area in window.screen.areas:
-                            if area.type == 'PROPERTIES': 
-                                area.tag_redraw()
+                    # the redraw is done from the render loop, once per frame at most
+                    self.redraw_pending = True
                 
                 else:
                     self.report({'WARNING'},"Node: " + str(node.name) +\
@@ -357,6 +353,43 @@ class CrenderEngine(bpy.types.RenderEngine):
         return True
             
         
+    def get_cr_node(self, scene, node_uuid):
+        """ Return the render node with node_uuid, raises KeyError if there isn't one
+        
+        The lookup of nodes by uuid is cached for the render, it's only rebuilt if
+        a node can't be found, in case the list of nodes changed.
+        """
+        
+        cr_nodes = getattr(self, "cr_nodes_by_uuid", {})
+        
+        if not node_uuid in cr_nodes:
+            
+            cr_nodes = {node.node_uuid:node for node in scene.cr_nodes}
+            cr_nodes.update({'local':scene.crowd_render.local_node})
+            self.cr_nodes_by_uuid = cr_nodes
+            
+        return cr_nodes[node_uuid]
+        
+    def redraw_props_areas(self):
+        """ Tag properties areas for a redraw if any were requested since the last
+        
+        Called each pass of the render loop, progress and stats handlers set 
+        self.redraw_pending rather than tagging areas themselves, so that a burst 
+        of msgs only causes one redraw per REDRAW_INTERVAL.
+        """
+        
+        if not self.redraw_pending or not timed_out(self.last_redraw, REDRAW_INTERVAL):
+            return
+        
+        #get ref to properties area if it exists and tag it for a redraw
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'PROPERTIES': 
+                    area.tag_redraw()
+        
+        self.redraw_pending = False
+        self.last_redraw = time.perf_counter()
+        
     def get_samples(self, scene):
         """ gets the number of per pixel samples associated with the render
         """
@@ -407,25 +440,17 @@ class CrenderEngine(bpy.types.RenderEngine):
     def update_st_prog(self, scene, msg):
         """ Upates the stats and progress bar during a render"""
         
-        prop_area = None
-        
         stats = msg.attributes[utils.render_stats]
         node_name = msg.attributes[utils.node_name]
         machine_uuid = msg.attributes[utils.machine_uuid]
         node_state = msg.attributes[utils.state]
         
-        cr_nodes = {node.node_uuid:node for node in scene.cr_nodes}
-        cr_nodes.update({'local':self.local_node})
-        values = cr_nodes.values
-        
-        node = cr_nodes.get(machine_uuid)
-        
+        try:
+            node = self.get_cr_node(scene, machine_uuid)
+        except KeyError:
+            node = None
         
-        #get ref to properties area if it exists and tag it for a redraw
-        for window in bpy.context.window_manager.windows:
-            for area in window.screen.areas:
-                if area.type == 'PROPERTIES':
-                    prop_area = area
+        values = self.cr_nodes_by_uuid.values
         
         if not node is None:
             
@@ -463,8 +488,7 @@ class CrenderEngine(bpy.types.RenderEngine):
             
                     #TODO: CR-347 - restore progress per node to be visible by the user
             
-                    if prop_area is not None:
-                        prop_area.tag_redraw()
+                    self.redraw_pending = True
         
                     rendering = True
             
@@ -524,6 +548,33 @@ class CrenderEngine(bpy.types.RenderEngine):
                      )
                     
         
+    def count_result_channels(self, S):
+        """ Return the number of channels a node's result will have
+        
+        Used by the load balancer to estimate how long results take to download.
+        """
+        
+        channels = 0
+        
+        for view_layer in S.view_layers:
+            
+            if not view_layer.use: continue
+            
+            try:
+                
+                if S.crowd_render.render_engine == 'BLENDER_EEVEE':
+                    passes = self.list_eevee_passes(S, view_layer)
+                else:
+                    passes = self.list_render_passes(S, view_layer)
+                    
+                channels += sum(len(r_pass[CHANNEL_IDS]) for r_pass in passes)
+                
+            except:
+                # only the combined pass then
+                channels += 4
+                
+        return max(channels, 4)
+        
     def render_command(self, S, temp_blend_file):
         """ Sends a command to the CIP to request a render from all nodes
         """
@@ -549,7 +600,8 @@ class CrenderEngine(bpy.types.RenderEngine):
                     utils.compute_device:node.compute_device,
                     utils.tile_x:node.node_tile_x,
                     utils.tile_y:node.node_tile_y,
-                    utils.process_threads:node.process_threads
+                    utils.process_threads:node.process_threads,
+                    utils.render_slots:node.render_slots
                      }\
                  for node in render_nodes if node.node_render_active
                  }
@@ -578,6 +630,11 @@ class CrenderEngine(bpy.types.RenderEngine):
                     S.frame_start, 
                     S.frame_end),
                 utils.is_animation:self.is_animation,
+                utils.frame_step:S.frame_step,
+                utils.frame_distribution:S.crowd_render.frame_distribution,
+                utils.dynamic_tiles:S.crowd_render.dynamic_tiles,
+                utils.result_channels:self.count_result_channels(S),
+                utils.color_depth:S.render.image_settings.color_depth,
                 utils.img_output_fmt:img_output_fmt,
                 utils.user_engine:S.crowd_render.render_engine,
                 utils.eng_samples:self.get_samples(S),
@@ -620,6 +677,15 @@ class CrenderEngine(bpy.types.RenderEngine):
         self.report({'INFO'}, "Finished frame: " + str(self.current_frame))
         print("Finished frame: ", self.current_frame)
         
+        # regions of slow nodes that were rendered on other nodes as well
+        launches = msg.attributes.get(utils.speculative_launches, 0)
+        
+        if launches:
+            self.report({'INFO'}, "Re-rendered " + str(launches) +\
+                " regions of slow nodes on idle nodes, " +\
+                str(msg.attributes.get(utils.speculative_wins, 0)) +\
+                " finished first")
+        
         ret = False
         
         return ret
@@ -808,6 +874,11 @@ class CrenderEngine(bpy.types.RenderEngine):
             self.add_eevee_passes(scene, depsgraph.view_layer_eval)
         
         self.current_frame = scene.frame_current
+        
+        # node lookups and panel redraws are batched for the duration of the render
+        self.cr_nodes_by_uuid = {}
+        self.redraw_pending = False
+        self.last_redraw = 0.0
             
         rendering = True
         
@@ -828,6 +899,8 @@ class CrenderEngine(bpy.types.RenderEngine):
                     
                     if not handler is None:
                         rendering = handler(scene, msg)
+                
+                self.redraw_props_areas()
                                 
                 if self.test_break():
                         
@@ -931,19 +1004,31 @@ class CrenderEngine(bpy.types.RenderEngine):
         ### CALCULATE THE COORDINATES FOR THE IMAGE TILE###     
         
             
+        # tiles overlap their neighbours by x_buffer pixels on every inner edge,
+        # half of the overlap is trimmed from each side of the edge
         if tile_coords[0] == 0.0:
             x_0 = 0
         else:
             x_0 = int(floor((tile_coords[0] + x_buffer / (2 * self.size_x)) *\
                 self.size_x)) 
                  
-        y_0 = int(floor(tile_coords[2] * self.size_y))
-            
+        if tile_coords[2] == 0.0:
+            y_0 = 0
+        else:
+            y_0 = int(floor((tile_coords[2] + x_buffer / (2 * self.size_y)) *\
+                self.size_y))
             
-        x_1 = int(floor((tile_coords[1] - x_buffer / (2 * self.size_x)) *\
-            self.size_x)) # overlap pixel for covering ourselves!
+        if tile_coords[1] == 1.0:
+            x_1 = self.size_x
+        else:
+            x_1 = int(floor((tile_coords[1] - x_buffer / (2 * self.size_x)) *\
+                self.size_x)) # overlap pixel for covering ourselves!
                  
-        y_1 = int(floor(tile_coords[3] * self.size_y))
+        if tile_coords[3] == 1.0:
+            y_1 = self.size_y
+        else:
+            y_1 = int(floor((tile_coords[3] - x_buffer / (2 * self.size_y)) *\
+                self.size_y))
             
         w = x_1 - x_0
         h = y_1 - y_0
@@ -55,15 +55,34 @@ Functions Exported
 """
 
 #Std Library imports
-import threading, os, zmq, json, time, atexit, uuid, pickle, tempfile, shutil
-import sys
+import threading, os, zmq, json, time, atexit, uuid, pickle, shutil, mmap
+import sys, struct, zlib, lzma, random, socket, queue, base64
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import algorithms_guaranteed
 from statistics import mean, stdev
-from math import exp, ceil
+from math import exp, ceil, log2
+
+# numpy comes with blender, without it delta transfers fall back to fixed size chunks
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    
+# faster codecs for file chunks, used when both ends of a transfer have them
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+    
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 #Crowdrender imports
 from . import utils
-from . utils import timed_out, MsgWrapper
+from . utils import timed_out, MsgWrapper, CRDeadlines
 from . utils import address, public_key, handle_generic_except
 from . logging import l_sep
 
@@ -78,16 +97,68 @@ ERROR = b'ERROR'
 PIPELINE = 32
 TIMEOUT_RETRIES = 4# at the default timeout of 30 secs gives enough 
 # time to recover from tcp zero windows
+IDLE_POLL_MAX = 1000 # millisecs, longest a thread sleeps in poll with no deadlines
+HELLO_INTERVAL = 0.25 # secs between HELLO? msgs when waiting for a peer to respond
+HELLO_MIN_INTERVAL = 0.01 # secs, shortest backoff between HELLO? msgs to a peer
+PROGRESS_INTERVAL = 0.1 # min secs between progress msgs for a single transfer
+WINDOW_MIN = 2 # fewest chunk requests a transfer may have in flight
+WINDOW_MAX = 256 # most chunk requests a transfer may have in flight
+WINDOW_INITIAL = PIPELINE # the window starts in slow start at the old fixed pipeline
+CHUNK_MULT_MAX = 16 # largest chunk requested, as a multiple of CHUNK_SIZE
+WINDOW_TARGET = 32 # chunks in flight we aim for when sizing chunks to the BDP
+QUEUE_DELAY_FACTOR = 2.0 # smoothed rtt above min rtt by this means a queue is building
+RTO_INITIAL = 1.0 # secs, retransmit timeout used until we have an rtt sample
+RTO_MIN = 0.2 # secs, the shortest retransmit timeout
+CDC_MIN = 2048 # smallest content defined chunk used for delta transfers, bytes
+CDC_MAX = 65536 # largest content defined chunk, bytes
+CDC_MASK = (1 << 13) - 1 # 13 bits gives an average chunk of about 8KB
+CDC_WINDOW = 13 # bytes that affect the masked bits of the gear hash
+CDC_BLOCK = 16 * 1024 * 1024 # bytes hashed at once, limits memory use for big files
+SIG_DIGEST_SIZE = 16 # bytes, blake2b digest size for content defined chunks
+CHUNK_STORE_PACK = '.pack' # extension of chunk store files holding chunk data
+CHUNK_STORE_INDEX = '.idx' # extension of chunk store files listing a pack's chunks
+CHUNK_STORE_ENTRY = struct.Struct('<QI') # offset and length of a chunk in a pack
+CHUNK_STORE_TMP = '.tmp' # added to the name of a pack or index while it's written
+CHUNK_STORE_LOCK = 'evict.lock' # file held by the process trimming the chunk store
+CHUNK_STORE_GRACE = 600.0 # seconds before a part written pack is taken as abandoned
+CHUNK_STORE_LOCK_TIMEOUT = 5.0 # seconds to wait for the lock before skipping eviction
+CHUNK_STORE_LOCK_STALE = 60.0 # seconds after which a lock is left by a dead process
+SIGS = b'SIGS' # asks the file server to include signatures in its FILE_INFO reply
+PIECES = b'PIECES' # asks for a digest of each CHUNK_SIZE chunk in the FILE_INFO reply
+FILE_HAVE = b'FILE_HAVE' # asks a swarm peer which chunks of a file it has
+NO_DATA = b'NO_DATA' # reply from a swarm peer asked for a chunk it doesn't have
+SWARM_HAVE_INTERVAL = 1.0 # secs between asking swarm peers which chunks they have
+CODECS_OFFERED = b'CODECS=' # FILE_INFO flag prefix, codecs the requester can decode
+COMPRESS_WORKERS = min(4, os.cpu_count() or 1) # threads compressing chunks to send
+ENTROPY_MAX = 7.5 # bits per byte, chunks with a higher sampled entropy are sent raw
+PROBE_SIZE = 4096 # bytes of a chunk sampled to estimate its entropy
+PROBE_SLICES = 4 # the sample is taken from this many places spread over the chunk
+RESUME_SAVE_INTERVAL = 5.0 # secs between saves of a resumable transfer's progress
+RESUME_STATE = '.state' # extension of the file a transfer's progress is saved in
+RESUME_PART = '.part' # extension of a partly received file
+TRANSFER_BUDGET = 32 * 1024 * 1024 # most bytes a requester has in flight, all transfers
+PRIORITY_INTERACTIVE = 0 # render results the user is waiting to see
+PRIORITY_SYNC = 1 # session files a node needs before it can render
+PRIORITY_PREFETCH = 2 # files that will be wanted later
+FILE_STREAM_IDLE = 2.0 # secs a served file stays mapped after its last request. Keep
+# this short, windows won't let a file that's mapped be overwritten.
+FILE_DIGEST_CACHE = 16 # files whose signatures are kept after their view is closed
 
 action = 'action'
-all_offsets = 'all_offsets'
 cancel = 'cancel'
+bytes_on_wire = 'bytes_on_wire'
+bytes_reused = 'bytes_reused'
+chunk_map = 'chunk_map'
+delta_base = 'delta_base'
+have_sent_time = 'have_sent_time'
 chunk_request_timeout = 'chunk_request_timeout'
 chunks_rcvd = 'chunks_rcvd'
+codec = 'codec'
 complete = 'complete'
 data = 'data'
 duration = 'duration'
 fail_timeout = 'fail_timeout'
+file_hash = 'file_hash'
 file_id = 'file_id'
 file_total_rcvd = 'file_total_rcvd'
 func = 'func'
@@ -100,17 +171,30 @@ info_request_timeout = 'info_request_timeout'
 in_buffer = 'in_buffer'
 max_to_duration = 'max_to_duration'
 msg_attribs = 'msg_attribs'
-offsets = 'offsets'
+peer_haves = 'peer_haves'
 peer_id = 'peer_id'
+peer_windows = 'peer_windows'
+pieces = 'pieces'
+resume_state = 'resume_state'
+prog_sent_time = 'prog_sent_time'
+priority = 'priority'
 req_start_time = 'req_start_time'
 req_to_duration = 'req_to_duration'
 round_trip_time = 'round_trip_time'
+rcvd_time = 'rcvd_time'
+signatures = 'signatures'
 session_id = 'session_id'
 start_time = 'start_time'
+swarm_cursor = 'swarm_cursor'
+swarm_id = 'swarm_id'
+swarm_order = 'swarm_order'
 task_id  = 'task_id'
 temp_file = 'temp_file'
 time_outs = 'time_outs'
 timeout_retries ='timeout_retries'
+use_chunk_store = 'use_chunk_store'
+use_swarm = 'use_swarm'
+window = 'window'
 
 SEEK_SET = 0 # start of the stream (the default); offset should be zero or positive
 SEEK_CUR = 1 # current stream position; offset may be negative
@@ -124,524 +208,2370 @@ if not 'blake2b' in algorithms_guaranteed:
 else:
     from hashlib import blake2b as hash_algorithm
 
-class CRFileServer(threading.Thread):
-    """ Multi client file server """
+## Content Defined Chunking
+# A gear table gives each byte value a fixed pseudo random number, derived from the 
+# hash algorithm so every node builds the same table.
+GEAR = [int.from_bytes(hash_algorithm(bytes([i]), digest_size = 2).digest(), 'little')
+            for i in range(256)]
+
+def cdc_boundaries(buf):
+    """ Return the end offsets of the content defined chunks of buf
     
-    running = False
+    Arguments:
+        buf:        bytes like  - the data to chunk, for example a mmap
+    Returns:
+        cuts:       list        - ascending offsets where each chunk ends, the last
+                                    is len(buf)
+    Side Effects:
+        None
+    Exceptions:
+        None
+    Description:
+        Uses a gear hash, h = (h << 1) + GEAR[byte], and cuts where the low bits of
+        h are zero. The masked bits only depend on the last CDC_WINDOW bytes, so 
+        chunk boundaries move with the content. Inserting or deleting data in a 
+        file only changes the chunks around the edit, the rest have the same 
+        signatures even though their offsets have shifted.
+        
+        The hash is calculated with numpy, a CDC_BLOCK at a time. Without numpy 
+        chunks are a fixed size, which still finds data that hasn't moved.
+    """
     
-    def __init__(self, mode, logger, zmq_context, inproc_address, 
-                    machine_uuid, start_port, port_range, network_timeout,
-                    local_addresses =[],
-                    local_public_key = b'',
-                    local_sec_key = b''):
-                 
-        """ start a fileserver, creates a new thread
+    size = len(buf)
+    cuts = []
+    
+    if numpy is None:
         
-        mode: str: either 'client_node' or 'server_node', determines whether the server 
-            should bind or connect its socket used for data xfr.
-        logger: logging.logger object: Used by the calling process to log events
-        zmq_context: zmq.Context obj: Used for creating sockets
-        local_addresses: list('ip_addr:port') : A list of endpoints to bind to 
-            (if mode = 'server_node')
-        inproc_address: string :the address of the inproc socket used to communicate 
-            between the calling process and this file server.
-        machine_uuid: string: The uuid of this computer, used, hmmmm where is that used?
-        start_port: int: the starting port used to offset from when binding (used when
-            mode = 'render_node' only)
-        port_range: int: the number of ports to use starting with the start_port.
+        cuts = list(range(CDC_MAX, size, CDC_MAX))
         
-        """
+        if size: cuts.append(size)
         
+        return cuts
+    
+    gear = numpy.array(GEAR, dtype = numpy.uint16)
+    last = 0
+    
+    for start in range(0, size, CDC_BLOCK):
         
+        end = min(start + CDC_BLOCK, size)
         
-        threading.Thread.__init__(self, daemon= True)
+        # include the bytes before this block that affect its first hashes
+        lo = max(start - CDC_WINDOW + 1, 0)
         
-        atexit.register(self.close)
+        g = gear[numpy.frombuffer(buf, dtype = numpy.uint8, count = end - lo,
+            offset = lo)]
+        h = g.copy()
         
-        self.handlers = {utils.connect_node:self.connect_node,
-                        utils.exit:self.close,
-                        utils.update_timeout_prefs:self.update_timeout_prefs,
-                        utils.disconnect:self.disconnect_node}
-                        
+        for k in range(1, CDC_WINDOW):
+            h[k:] += g[:-k] << numpy.uint16(k)
+            
+        # a zero hash at position p makes a cut after it, at p + 1
+        candidates = numpy.flatnonzero(
+            (h[start - lo:] & numpy.uint16(CDC_MASK)) == 0) + (start + 1)
         
-        self.render_node_eps = list()
+        while True:
+            
+            i = candidates.searchsorted(last + CDC_MIN)
+            
+            if i < len(candidates) and candidates[i] - last <= CDC_MAX:
+                
+                last = int(candidates[i])
+                
+            elif last + CDC_MAX <= end:
+                
+                last += CDC_MAX
+                
+            else:
+                # the next cut is in the next block
+                break
+                
+            cuts.append(last)
+            
+    if last < size:
+        cuts.append(size)
         
-        self.logger = logger
-        self.network_timeout = network_timeout
-        self.endpoints = list()
-        self.machine_uuid = machine_uuid
-        self.local_public_key = local_public_key
-        self.local_sec_key = local_sec_key
+    return cuts
+    
+def cdc_signatures(buf):
+    """ Return [(offset, length, digest), ...] for the content defined chunks of buf """
+    
+    sigs = []
+    offset = 0
+    
+    for cut in cdc_boundaries(buf):
         
-        self.zmq_c = zmq_context
+        sigs.append((offset, cut - offset, hash_algorithm(
+            buf[offset:cut], digest_size = SIG_DIGEST_SIZE).digest()))
         
-        ####### CONNECT INPROC SOCKET (CONTROL CHANNEL) ######### 
+        offset = cut
         
-        self.inproc = self.zmq_c.socket(zmq.PAIR)
-        self.inproc.connect("inproc://" + inproc_address)
+    return sigs
+    
+def pack_signatures(sigs):
+    """ Pack signatures into bytes, the chunk lengths followed by the digests """
+    
+    lengths = struct.pack('<%iI' % len(sigs), *[sig[1] for sig in sigs])
+    
+    return lengths + b''.join([sig[2] for sig in sigs])
+    
+def unpack_signatures(packed):
+    """ Unpack bytes made by pack_signatures to [(offset, length, digest), ...] """
+    
+    count = len(packed) // (4 + SIG_DIGEST_SIZE)
+    lengths = struct.unpack_from('<%iI' % count, packed)
+    digests = packed[4 * count:]
+    
+    sigs = []
+    offset = 0
+    
+    for i, length in enumerate(lengths):
         
+        sigs.append((offset, length, 
+            digests[i * SIG_DIGEST_SIZE:(i + 1) * SIG_DIGEST_SIZE]))
         
-        #Create the socket we'll use to send/recv data
+        offset += length
         
-        self.router = self.zmq_c.socket(zmq.ROUTER)
-        self.router.curve_secretkey = self.local_sec_key
-        self.router.curve_publickey = self.local_public_key
-        self.router.set(zmq.IDENTITY, bytes(machine_uuid, 'utf-8'))
-        self.router.setsockopt(zmq.TCP_KEEPALIVE, 1)
-        self.router.setsockopt(zmq.TCP_KEEPALIVE_IDLE, 20)
-        self.router_id = self.router.IDENTITY
+    return sigs
+    
+## Positioned Writes
+# chunks are written where they go in the file without seeking, received files 
+# are opened unbuffered so each chunk is a single write to the OS.
+
+def write_at(file, buf, offset):
+    """ Write all of buf to the unbuffered file at offset """
+    
+    view = memoryview(buf)
+    
+    if hasattr(os, 'pwrite'):
         
+        fd = file.fileno()
         
-        if mode == 'client_node':
+        while view:
+            
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+            
+    else:
+        # windows has no pwrite
+        file.seek(offset, SEEK_SET)
         
-            pass
-                                                
+        while view:
+            view = view[file.write(view):]
             
+def preallocate(file, size):
+    """ Reserve size bytes of disk for file, so chunks can be written in any order
+    without the file growing, or fragmenting, as they arrive """
+    
+    if hasattr(os, 'posix_fallocate'):
         
-        elif mode == 'server_node':
+        try:
             
-            self.router_ports = {}
-            self.router.curve_server = True
+            os.posix_fallocate(file.fileno(), 0, size)
             
-                                                
-
+            return
             
-            self.router_ports = self.router.bind_to_random_port(
-                "tcp://*",
-                min_port = start_port + 15,
-                max_port = start_port + 15 + port_range)
-                                                
-            self.logger.info("CRFileServer.__init__ " + l_sep +\
-                "File server bound its router socket to :" + \
-                str(self.router.LAST_ENDPOINT) + ":" +\
-                str(self.router_ports))
+        except OSError:
+            # not supported by every file system
+            pass
             
-            # rather than returning all the endpoints bound to, we just return the
-            # last one, endpoints are not actually used by the client, only the 
-            # port number since the client will only attempt a connect on the 
-            # ip it originally contacted the server on.
+    file.truncate(size)
+    
+def replace_file(src, dst):
+    """ Move src over dst in one step, so dst is never partly written """
+    
+    try:
+        
+        os.replace(src, dst)
+        
+    except OSError:
+        # on another file system, or windows won't replace a file that's open
+        shutil.copy2(src, dst)
+        os.remove(src)
+        
+## Chunk Compression
+# codec name: (compress, decompress). The codecs must release the GIL so chunks can
+# be compressed on a thread pool. Preference is fastest first, lzma is only used if
+# it's asked for.
+CODECS = {
+    b'zlib':(lambda buf: zlib.compress(buf, 1), zlib.decompress),
+    b'lzma':(lambda buf: lzma.compress(buf, preset = 0), lzma.decompress)
+    }
+    
+CODEC_PREFERENCE = [b'zstd', b'lz4', b'zlib']
+
+if zstandard is not None:
+    # compressor objects aren't thread safe, so each call makes its own
+    CODECS[b'zstd'] = (
+        lambda buf: zstandard.ZstdCompressor(level = 3).compress(buf),
+        lambda buf: zstandard.ZstdDecompressor().decompress(buf))
+        
+if lz4 is not None:
+    CODECS[b'lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+    
+def codecs_for(compression):
+    """ Return the codecs a requester offers for the compression preference
+    
+    compression is 'auto' for all the fast codecs available, 'none', or the name 
+    of a codec in CODECS. Codecs are returned in order of preference.
+    """
+    
+    if compression == 'auto':
+        return [codec for codec in CODEC_PREFERENCE if codec in CODECS]
+        
+    codec = bytes(compression, 'utf-8')
+    
+    return [codec] if codec in CODECS else []
+    
+def chunk_entropy(buf):
+    """ Estimate the entropy of buf in bits per byte from a sample of it
+    
+    PROBE_SLICES slices adding up to PROBE_SIZE bytes are taken from across buf, 
+    data that's already compressed, like most of an EXR, has an entropy close to 
+    8 and isn't worth compressing again.
+    """
+    
+    size = len(buf)
+    
+    if size <= PROBE_SIZE:
+        sample = bytes(buf)
+        
+    else:
+        step = size // PROBE_SLICES
+        length = PROBE_SIZE // PROBE_SLICES
+        sample = b''.join([bytes(buf[i * step:i * step + length]) 
+            for i in range(PROBE_SLICES)])
             
-            self.endpoints.append(
-                (str(self.router.LAST_ENDPOINT), self.router_ports))
+    if not sample: return 0.0
+    
+    if numpy is not None:
         
+        counts = numpy.bincount(numpy.frombuffer(sample, dtype = numpy.uint8))
+        p = counts[counts > 0] / len(sample)
         
+        return float(-(p * numpy.log2(p)).sum())
         
-        ###########################################
+    n = len(sample)
+    
+    return -sum([c / n * log2(c / n) for c in Counter(sample).values()])
+    
+def encode_chunk(buf, codec):
+    """ Return (payload, digest, codec used) for a chunk of a file
+    
+    Arguments:
+        buf:        bytes like  - the chunk
+        codec:      bytes       - name of the codec in CODECS to compress with
+    Returns:
+        payload:    bytes like  - the compressed chunk, or buf if compressing 
+                                    doesn't make it smaller
+        digest:     bytes       - the hash of buf, so the requester can check the 
+                                    chunk once it's decompressed
+        codec:      bytes       - codec that compressed payload, b'' if it's raw
+    Side Effects:
+        None
+    Exceptions:
+        None
+    Description:
+        Runs on the file server's compression threads. Chunks that the entropy 
+        probe says won't compress are sent as they are, without trying.
+    """
+    
+    digest = hash_algorithm(buf).digest()
+    
+    if chunk_entropy(buf) > ENTROPY_MAX:
+        return buf, digest, b''
         
+    payload = CODECS[codec][0](buf)
+    
+    if len(payload) >= len(buf):
+        return buf, digest, b''
         
-        self.poller = zmq.Poller()
+    return payload, digest, codec
+    
+
+class CRChunkStore:
+    """ Content addressed store of file chunks shared by every session on a node
+    
+    Arguments:
+        path:       string  - directory to keep the store in, created if needed
+        max_size:   int     - bytes, the store is trimmed to this size after each add
+    
+    Description:
+        Chunks are addressed by the blake2b digest of their content defined chunk 
+        signature (see cdc_signatures), so a chunk that appears in files from 
+        different sessions, for example when a project is branched, only needs to
+        be transferred to the node once.
+        
+        Storing each chunk as its own file would create tens of thousands of tiny
+        files for a single .blend, so the new chunks from each received file are 
+        written to one pack file, with an index file listing the digest, offset 
+        and length of each chunk in it. The index of every pack is held in memory.
+        
+        Whole packs are evicted, least recently used first, when the store grows 
+        past max_size. A pack counts as used when chunks are copied from it.
+        
+        Every session process on the node opens the same store. Packs and their 
+        indexes are written under temporary names and renamed into place, and the
+        process evicting holds a lock file while it counts and removes packs, 
+        including the ones other processes have added since it loaded the store.
+    """
+    
+    def __init__(self, path, max_size):
         
-        self.poller.register(self.router, zmq.POLLIN)
-        self.poller.register(self.inproc, zmq.POLLIN)
+        self.path = path
+        self.max_size = max_size
         
-        self.file_streams = {}
-        self.file_st_buffer = PIPELINE * CHUNK_SIZE
+        self.index = {} # {digest:(pack name, offset, length)}
+        self.packs = {} # {pack name:[last used, size, [digests]]}
         
-        self.send_progress = {}
+        os.makedirs(path, exist_ok = True)
         
-        self.start()
+        self.load()
         
-    def run(self):
+    @property
+    def size(self):
+        """ Total size of the packs in the store in bytes """
         
-        self.running = True
+        return sum([pack[1] for pack in self.packs.values()])
         
-        while self.running:
+    def pack_path(self, name):
+        
+        return os.path.join(self.path, name + CHUNK_STORE_PACK)
+        
+    def index_path(self, name):
+        
+        return os.path.join(self.path, name + CHUNK_STORE_INDEX)
+        
+    def load(self):
+        """ Read the index of each pack in the store that isn't loaded yet """
+        
+        entry_size = CHUNK_STORE_ENTRY.size + SIG_DIGEST_SIZE
+        now = time.time()
+        
+        for entry in os.scandir(self.path):
             
-            try:
-                
-                events = dict(self.poller.poll(16))
+            name, ext = os.path.splitext(entry.name)
+            
+            # a pack without its index, or a temporary file, is left over from an
+            # interrupted write, unless it's new and another process is writing it
+            if ext == CHUNK_STORE_TMP or (ext == CHUNK_STORE_PACK and\
+                not os.path.exists(self.index_path(name))):
                 
-                if self.inproc in events:
-                    
-                 
-                    json_msg = self.inproc.recv_json(zmq.NOBLOCK)
-                    
-                    msg = MsgWrapper.deserialize(json_msg)
-                    
-                    if msg.command in self.handlers:
-                        
-                        self.handlers[msg.command](msg)
-                     
-                     
-                if self.router in events:
-                    #handle router msgs
-                    keep_receiving = PIPELINE
-                    
-                    while keep_receiving:
-                        
-                       
-                        msg = self.router.recv_multipart(zmq.NOBLOCK)
-                        
-                        keep_receiving -= 1
-                        
-                        if msg[1] == b'HELLO?':
-                            
-                            self.router.send_multipart([msg[0], b'HELLO!'])
-                        #we don't want to react to b'HELLO' msgs
-                        elif msg[1] == b'HELLO!':
-                            pass
-                        else:
-                            self.file_rqst_handler(msg)
-                            
+                try:
+                    abandoned = now - entry.stat().st_mtime > CHUNK_STORE_GRACE
+                except OSError:
+                    continue
                     
+                if abandoned and ext == CHUNK_STORE_TMP:
                     
-                open_streams = self.file_streams.copy()
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
                         
-                for stream_name, fstream in open_streams.items():
+                elif abandoned:
+                    self.remove_pack(name)
                     
-                    fstream.close()
-                    self.file_streams.pop(stream_name, None)
-                    
-                
+                continue
                 
+            if not ext == CHUNK_STORE_INDEX or name in self.packs: continue
+            
+            try:
                 
-            except zmq.ZMQError as e:
-                
-                if e.errno == zmq.EAGAIN:
-                                
-                    pass
+                pack_stat = os.stat(self.pack_path(name))
                 
-                elif e.errno == zmq.ETERM:
-                    break
+                with open(entry.path, 'rb') as index_file:
+                    packed = index_file.read()
                     
-                else:
-                    location = "CRFileServer.run"
+            except OSError:
+                # the pack's gone, so the index is no use
+                self.remove_pack(name)
+                continue
                 
-                    log_string = " unexpected zmq error encountered" +\
-                                " whilst polling."
-                  
+            digests = []
+            
+            for pos in range(0, len(packed) - entry_size + 1, entry_size):
                 
-                    handle_generic_except(
-                        location= location, log_string=log_string, logger=self.logger)
+                offset, length = CHUNK_STORE_ENTRY.unpack_from(packed, pos)
+                digest = packed[pos + CHUNK_STORE_ENTRY.size:pos + entry_size]
                 
-                    
-                    
-            except:
+                self.index[digest] = (name, offset, length)
+                digests.append(digest)
                 
-                location = "CRFileServer.run"
+            self.packs[name] = [pack_stat.st_mtime, pack_stat.st_size, digests]
+            
+    def __contains__(self, digest):
+        
+        return digest in self.index
+        
+    def copy_chunks(self, matches, file):
+        """ Copy chunks from the store into file
+        
+        Arguments:
+            matches:    list    - [(offset in file, length, digest), ...]
+            file:       file    - open for writing
+        Returns:
+            copied:     list    - [(offset, length), ...] ranges of file written
+        Side Effects:
+            Marks the packs read from as recently used
+        Exceptions:
+            None
+        Description:
+            Chunks are read a pack at a time so each pack is opened once. Each 
+            chunk is checked against its digest before it's written, a pack that
+            can't be read or has bad data is removed from the store and its chunks
+            are left to be transferred.
+        """
+        
+        by_pack = {}
+        copied = []
+        
+        for offset, length, digest in matches:
+            
+            entry = self.index.get(digest)
+            
+            if entry is not None and entry[2] == length:
+                by_pack.setdefault(entry[0], []).append((offset, entry[1], length, 
+                    digest))
                 
-                log_string = " unknown error encountered" +\
-                                " whilst polling."
-                  
+        for name, chunks in by_pack.items():
+            
+            try:
                 
-                handle_generic_except(
-                    location= location, log_string=log_string, logger=self.logger)
+                with open(self.pack_path(name), 'rb') as pack:
+                    
+                    for offset, pack_offset, length, digest in chunks:
+                        
+                        pack.seek(pack_offset, SEEK_SET)
+                        chunk_data = pack.read(length)
+                        
+                        if not hash_algorithm(chunk_data, 
+                            digest_size = SIG_DIGEST_SIZE).digest() == digest:
+                            
+                            raise ValueError("chunk failed hash check")
+                            
+                        write_at(file, chunk_data, offset)
+                        
+                        copied.append((offset, length))
+                        
+                os.utime(self.pack_path(name))
+                self.packs[name][0] = time.time()
                 
+            except (OSError, ValueError):
                 
+                self.remove_pack(name)
                 
-        #clean up
-         
-        #unregister and close all sockets
-        self.poller.unregister(self.router)
-        self.poller.unregister(self.inproc)    
+        copied.sort()
         
-        #close
-        self.router.close(linger = 0)
-        self.inproc.close(linger = 0)
+        return copied
         
+    def add_chunks(self, sigs, buf):
+        """ Add the chunks of buf that aren't in the store as a new pack
         
-        #close all file streams
-        for files in self.file_streams.values():
+        Arguments:
+            sigs:       list        - [(offset, length, digest), ...] the signatures
+                                        of buf
+            buf:        bytes like  - the data the signatures were made from
+        Returns:
+            added:      int         - bytes added to the store
+        Side Effects:
+            Writes a pack and its index, evicts old packs if the store is too big
+        Exceptions:
+            OSError:    if the pack can't be written
+        """
         
-            files.close()   
+        name = uuid.uuid4().hex
+        pack_tmp = self.pack_path(name) + CHUNK_STORE_TMP
+        index_tmp = self.index_path(name) + CHUNK_STORE_TMP
+        index_entries = []
+        digests = []
+        seen = set()
+        pack_offset = 0
+        
+        with open(pack_tmp, 'wb') as pack:
+        
+            for offset, length, digest in sigs:
+                
+                if digest in self.index or digest in seen: continue
+                
+                pack.write(buf[offset:offset + length])
+                
+                index_entries.append(CHUNK_STORE_ENTRY.pack(pack_offset, length) +\
+                    digest)
+                digests.append(digest)
+                seen.add(digest)
+                
+                pack_offset += length
             
-        self.logger.info("CRFileServer.run:" +l_sep+\
-            "shutdown..")
+        if not digests:
             
+            os.remove(pack_tmp)
             
-    def file_rqst_handler(self, msg):
+            return 0
+            
+        with open(index_tmp, 'wb') as index_file:
+            index_file.write(b''.join(index_entries))
+            
+        # each file appears whole, the index last since a pack without an index
+        # is ignored
+        os.replace(pack_tmp, self.pack_path(name))
+        os.replace(index_tmp, self.index_path(name))
+            
+        for entry, digest in zip(index_entries, digests):
+            
+            self.index[digest] = (name,) + CHUNK_STORE_ENTRY.unpack_from(entry)
+            
+        self.packs[name] = [time.time(), pack_offset, digests]
         
-        """ handle request for a chunk of a file
+        self.evict(keep = name)
         
-        expected format of msgs
-        msg[0] = identity
-        msg[1] = request type - b'HELLO?', b'HELLO!', b'FILE_INFO', b'FILE_DATA'
-        msg[2] = FID (file ID)
-        msg[3] = offsets = (offset, chunk size)
-        msg[4] = request uuid
+        return pack_offset
         
-        """
+    def evict(self, keep = None):
+        """ Remove the least recently used packs until the store fits max_size 
         
-        #identity = msg[0]
-        fid = msg[2].decode('utf-8')
-        filesize = os.path.getsize(fid)
-        dumps = pickle.dumps
-        send_multipart = self.router.send_multipart
+        The packs other processes have added, used or removed since are read from
+        the disk first, so the whole store is kept to max_size. If the lock can't
+        be had in time the store is left to be trimmed after a later add.
+        """
         
+        if not self.lock(): return
         
-        if not fid in self.file_streams:
+        try:
             
-            try:
+            self.load()
             
-                self.file_streams[fid] = open(
-                    fid, 'rb', buffering=self.file_st_buffer)
+            for name in list(self.packs):
                 
+                try:
+                    self.packs[name][0] = os.stat(self.pack_path(name)).st_mtime
+                except OSError:
+                    self.remove_pack(name)
+            
+            size = self.size
+            
+            for name in sorted(self.packs, key = lambda n: self.packs[n][0]):
                 
-            except OSError as e:
+                if size <= self.max_size: break
                 
-                #fail message
-                rep = [msg[0], ERROR, msg[2], [b''], msg[4]]
+                if name == keep: continue
                 
-                send_multipart(rep)
+                size -= self.packs[name][1]
                 
-                self.logger.warning(
-                    "OSError: " + e.strerror +\
-                    " : This happened " +\
-                    "whilst handling a request for " + str(msg[1]))
+                self.remove_pack(name)
+                
+        finally:
+            self.unlock()
+            
+    def lock(self):
+        """ Take the lock file shared with the node's other processes
         
-        read = self.file_streams[fid].read
-        seek = self.file_streams[fid].seek
+        Returns:
+            boolean - True once the lock is held, False if it couldn't be had 
+                        within CHUNK_STORE_LOCK_TIMEOUT
+        """
         
-        if msg[1] == b"FILE_INFO":
+        path = os.path.join(self.path, CHUNK_STORE_LOCK)
+        start = time.perf_counter()
+        
+        while True:
             
-            rep = [msg[0], msg[1], msg[2], 
-                filesize.to_bytes(
-                    (filesize.bit_length() // 8) + 1, byteorder='big'),
-                        msg[4]]
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except (FileExistsError, PermissionError):
+                pass
+            except OSError:
+                return False
+                
+            # a process that died while evicting leaves its lock behind
+            try:
+                if time.time() - os.stat(path).st_mtime > CHUNK_STORE_LOCK_STALE:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+                
+            if timed_out(start, CHUNK_STORE_LOCK_TIMEOUT): return False
             
-            self.logger.info(
-                "Crowdrender: Responding to request for file info for: " +\
-                 str(fid))
+            time.sleep(0.05)
             
-            send_multipart(rep)
+    def unlock(self):
         
-        elif msg[1] == b'FILE_DATA':
-            
-            offsets = pickle.loads(msg[3])
-            
+        try:
+            os.remove(os.path.join(self.path, CHUNK_STORE_LOCK))
+        except OSError:
+            pass
             
-            for offset_data in offsets:
-                
-                seek(offset_data[0], os.SEEK_SET)
-                data = read(offset_data[1])
-                hash_digest = hash_algorithm(data).digest()
-                
-                send_multipart(
-                    [msg[0],
-                     msg[1],
-                     msg[2],
-                     dumps(offset_data[0]),
-                     msg[4],
-                     data,
-                     hash_digest]
-                            )
-
-
-    def update_timeout_prefs(self, msg):
+    def remove_pack(self, name):
+        """ Remove a pack, its index and its chunks from the store """
         
-        self.network_timeout = msg.attributes[utils.timeout]
+        pack = self.packs.pop(name, None)
         
-        self.logger.info("CRFileServer.update_timeout_prefs:" +l_sep+\
-            " updated the network timeout value to :" +\
-            str(self.network_timeout) + " seconds")
+        if pack is not None:
             
-    def close(self, msg=None):
+            for digest in pack[2]:
+                
+                if self.index.get(digest, (None,))[0] == name:
+                    self.index.pop(digest)
+                    
+        for path in (self.index_path(name), self.pack_path(name)):
+            
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            
+            
+class CRSwarmFiles:
+    """ Files a node is receiving, or has received, that it can serve to peers
     
-        self.logger.info("CRFileServer.close:" +l_sep+\
-            " shutting down..")
-        self.running = False
+    Shared between a node's CRFileRequest, which receives files and publishes the 
+    chunks it has verified, and its CRFileServer, which serves those chunks to other 
+    render nodes in the swarm. Files are keyed by their swarm id, a digest of the 
+    chunk digests sent by the client, so peers only ever exchange chunks of exactly 
+    the same version of a file.
+    """
+    
+    def __init__(self):
         
-    def disconnect_node(self, msg):
-        """ Disconnects a requesting node from the file server.
+        self.lock = threading.Lock()
+        self.files = {} # {swarm_id:(path, chunk states)}
         
-        """
+    def publish(self, swarm_id, path, states):
+        """ Publish the chunk states of a file, states must be flushed to disk """
         
-        node_endpoints = msg.attributes[utils.server_endpoint]
+        with self.lock:
+            self.files[swarm_id] = (path, bytes(states))
+            
+    def get(self, swarm_id):
+        """ Return (path, chunk states) for swarm_id, or None """
         
+        with self.lock:
+            return self.files.get(swarm_id)
+            
+    def remove(self, swarm_id):
         
-        for endpoint in node_endpoints:
+        with self.lock:
+            self.files.pop(swarm_id, None)
             
-            try:
-                self.router.disconnect(endpoint[address])
-                if endpoint in self.render_node_eps:
-                    self.render_node_eps.remove(endpoint)
-                self.logger.info("CRFileServer.disconnect_node:" +l_sep+\
-                    " is disconnected from: " + endpoint[address])
-            except zmq.ZMQError as e:
-                if e.errno == 2:
-                    self.logger.info("CRFileServer.disconnect_node:" +l_sep+\
-                    " was disconnected from: " + endpoint[address] +\
-                    " with an exception, seems the disconnect failed with " +\
-                    e.strerror)
-                    
-        #CLOSE EXISTING ROUTER SOCKET            
-        self.poller.unregister(self.router)
-        self.router.close(linger=0)
+    def remove_path(self, path):
+        """ Stop serving any file stored at path, e.g. when its about to be replaced """
         
-        ## CREATE NEW ROUTER SOCKET
-        # done so that peer tables are reset and the any new connection to 
-        # a node that failed on connect will work, otherwise router - router
-        # sockets suffer corrupt peer tables and msgs are dropped silently
-        self.router = self.zmq_c.socket(zmq.ROUTER)
-        self.router.curve_secretkey = self.local_sec_key
-        self.router.curve_publickey = self.local_public_key
-        self.router.setsockopt(zmq.IDENTITY, bytes(self.machine_uuid, 'utf-8'))
-        self.router.setsockopt(zmq.LINGER, 0)
-        self.router.setsockopt(zmq.TCP_KEEPALIVE, 1)
-        self.router.setsockopt(zmq.TCP_KEEPALIVE_IDLE, 20)
-        self.poller.register(self.router, zmq.POLLIN)
+        with self.lock:
+            
+            for key in [k for k, f in self.files.items() if f[0] == path]:
+                self.files.pop(key)
+            
+            
+class CRTransferState:
+    """ The progress of a file transfer, saved so it can resume after a failure
+    
+    Arguments:
+        directory:  string  - where the state and the partly received file are kept,
+                                usually in the session directory so they survive 
+                                the requester's process restarting
+        peer:       string  - router id of the node the file comes from
+        fid:        string  - path of the file on that node
+        
+    Description:
+        The state is a json file naming the partly received file, with the size and
+        hash of the file being received and the states of its chunks. The hash is 
+        of the file's chunk digests, so a file that's changed since the transfer
+        started won't match and the transfer starts again from scratch.
+        
+        Only chunks that were written and flushed to disk before the state was 
+        saved are recorded as received.
+    """
+    
+    def __init__(self, directory, peer, fid):
         
-        for endpoint in self.render_node_eps:
-            self.router.curve_serverkey = bytes(endpoint[public_key], 'utf-8')
-            self.router.connect(endpoint[address])
-                
+        key = hash_algorithm(bytes(peer + '\n' + fid, 'utf-8'), 
+            digest_size = SIG_DIGEST_SIZE).hexdigest()
         
-    def connect_node(self, msg):
-        """ connects the file server to a render node
-        this method connects the file server to a render node using the address given
-        in the msg argument. The msg argument needs to be a utils.MsgWrapper object
-        with an attribute called utils.server_endpoint which stores the endpoint that
-        the files server connects to as a string in the following format:
+        self.directory = directory
+        self.path = os.path.join(directory, key + RESUME_STATE)
+        self.part_path = os.path.join(directory, key + RESUME_PART)
+        self.saved_time = 0.0
         
-            '0.0.0.0:00000' 
+    def load(self, file_size, file_hash):
+        """ Return the saved chunk states if the transfer can resume, otherwise None
+        """
+        
+        try:
             
-        This is then used to connect to the render node. The zmq socket that is 
-        used is of the ROUTER type and is connected to multiple render nodes, each 
-        endpoint is stored in a list.
+            with open(self.path, 'r') as state_file:
+                state = json.load(state_file)
+                
+            if not (state['size'] == file_size and state['hash'] == file_hash):
+                return None
+                
+            if not os.path.getsize(state['part']) == file_size:
+                return None
+                
+            saved = zlib.decompress(base64.b64decode(state['states']))
+            
+        except (OSError, ValueError, KeyError, TypeError, zlib.error):
+            
+            return None
+            
+        if not len(saved) == ceil(file_size / CHUNK_SIZE):
+            return None
+            
+        self.part_path = state['part']
+        
+        return saved
+        
+    def save(self, file, file_size, file_hash, states):
+        """ Save the progress of the transfer, file is the open partly received file
         
+        Exceptions:
+            OSError if the state can't be written
         """
         
-        node_endpoints = msg.attributes[utils.server_endpoint]
-        node_router_id = msg.attributes[utils.requesting_id]
-        node_name = msg.attributes[utils.node_name]
+        # chunks recorded as received must be on disk first
+        file.flush()
+        os.fsync(file.fileno())
         
-        for endpoint in node_endpoints:
-            
-            #this is just a check to alert us to the fact we're attempting to connect
-            # to a node we've already connected to. nothing more, nothing less :D
+        # chunks in flight are saved as missing
+        received = bytes(states).replace(
+            bytes([CRChunkMap.IN_FLIGHT]), bytes([CRChunkMap.MISSING]))
+        
+        state = {'size':file_size, 
+                'hash':file_hash, 
+                'part':self.part_path,
+                'states':base64.b64encode(zlib.compress(received)).decode('ascii')}
+                
+        temp_path = self.path + '.tmp'
+        
+        with open(temp_path, 'w') as state_file:
+            json.dump(state, state_file)
             
-            if endpoint in self.render_node_eps:
-                self.logger.info("CRFileServer.connect_node:" +l_sep+\
-                    " already connected to this node: " +\
-                         str(endpoint[address]))
-                         
-               
-            self.router.curve_serverkey = bytes(endpoint[public_key], 'utf-8')
-            self.router.connect(endpoint[address])
+        os.replace(temp_path, self.path)
+        
+        self.saved_time = time.perf_counter()
+        
+    def remove(self):
+        """ Remove the saved state and the partly received file """
+        
+        for path in (self.path, self.part_path):
             
-            # see if the node is actually listening now.
-            if self.challenge_resp(node_router_id, msg, endpoint[address]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+                
+
+class CRFileView:
+    """ A read only, memory mapped view of a file being served to peers
+    
+    Chunks are returned as memoryview slices of the mapping so they can be hashed 
+    and sent without being copied into new bytes objects. The identity of the file
+    (device, inode, size and modification time) is recorded when the view is 
+    created so the server can tell when the file has been replaced, for example when
+    the blend file is saved again for a resync.
+    """
+    
+    def __init__(self, path):
         
-                self.render_node_eps.append(endpoint)
-                self.logger.info("CRFileServer.connect_node:" +l_sep+\
-                    " connected to: " + str(endpoint[address]))
+        self.path = path
+        self.file = open(path, 'rb')
+        
+        try:
         
+            self.identity = self.get_identity(os.fstat(self.file.fileno()))
+            self.size = self.identity[2]
+            
+            # zero length files can't be mapped, there's nothing to serve anyway
+            if self.size > 0:
+                self.mmap = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+                self.view = memoryview(self.mmap)
             else:
-                # if we timeout we just disconnect from the endpoint and assume
-                # its dead. 
-                
-                disconnect_msg = MsgWrapper(command = utils.disconnect,
-                    attributes = {utils.server_endpoint:[endpoint[address]]}) 
-                    
-                self.disconnect_node(disconnect_msg) 
+                self.mmap = None
+                self.view = memoryview(b'')
         
-                self.logger.warning("CRFileServer.connect_node:" +l_sep+\
-                    " could not establish comms for : " +\
-                            str(endpoint[address]) + " so it was disconnected")
-                conn_failed = MsgWrapper(message = utils.connect_failed,
-                    s_uuid = msg.s_uuid,
-                    attributes = {utils.node_name:msg.attributes[utils.node_name],
-                                utils.node_address:endpoint[address].split(":")[0]})
-                    
-                self.inproc.send_json(conn_failed.serialize())
-                #TODO - what if the challenge times out, what do we do then?
+        except:
             
-    def challenge_resp(self, router_id, ch_msg, endpoint):
+            self.file.close()
+            raise
+        
+        self.last_used = time.perf_counter()
+        self.packed_sigs = None
+        self.packed_pieces = None
+        self.pending = 0 # FILE_INFO replies being made on the worker threads
     
-        #wait for router sockets to come up
-        start_time = time.perf_counter()
+    @staticmethod
+    def get_identity(stat_result):
         
-        time_left = self.network_timeout
+        return (stat_result.st_dev, stat_result.st_ino, 
+                stat_result.st_size, stat_result.st_mtime_ns)
         
-        waiting_for_server = True
+    def is_current(self, in_place = False):
+        """ Return True if the file on disk is still the one that is mapped 
         
-        exp_backoff = 0.0
+        A file being written in place, as the file a swarm peer is still receiving
+        is, changes its modification time with every chunk, so only its device,
+        inode and size are compared.
+        """
         
-        while waiting_for_server:
+        compared = 3 if in_place else 4
+        
+        try:
+            return self.get_identity(os.stat(self.path))[:compared] ==\
+                self.identity[:compared]
+        
+        except OSError:
+            return False
             
-            if time_left <= 0.0:
-                
-                #outta here!
-                fail_msg = MsgWrapper(message = utils.connect_failed,
-                    s_uuid = ch_msg.s_uuid,
-                    attributes = {
-                        utils.node_name:ch_msg.attributes[utils.node_name],
-                        utils.node_address:endpoint})
-                
-                self.inproc.send_json(fail_msg.serialize())
-                
-                waiting_for_server = False
-                
-                self.logger.error("CRFileServer.challenge_resp:" +l_sep+\
-                    " Could not connect to :" + router_id)
-                
-                ret_value = 0
-                
-                break
+    def chunk(self, offset, size):
+        """ Return a memoryview of size bytes from offset, shorter at the end """
+        
+        self.last_used = time.perf_counter()
+        
+        return self.view[offset:offset + size]
+        
+    def signatures(self):
+        """ Return the packed content defined chunk signatures of the file
+        
+        Signatures are calculated the first time they're asked for and kept for as
+        long as the view is, so a resent FILE_INFO request doesn't pay for them twice.
+        """
+        
+        self.last_used = time.perf_counter()
+        
+        if self.packed_sigs is None:
+            self.packed_sigs = pack_signatures(cdc_signatures(self.view))
             
-            self.router.send_multipart([bytes(router_id, 'utf-8'), b'HELLO?'])
+        return self.packed_sigs
+        
+    def pieces(self):
+        """ Return the digests of each CHUNK_SIZE chunk of the file, concatenated
+        
+        Render nodes use these to check chunks they get from each other in swarm 
+        mode, since a peer's own hash only shows the data wasn't damaged in transit.
+        """
+        
+        self.last_used = time.perf_counter()
+        
+        if self.packed_pieces is None:
+            
+            self.packed_pieces = b''.join([hash_algorithm(
+                self.view[offset:offset + CHUNK_SIZE], 
+                digest_size = SIG_DIGEST_SIZE).digest() 
+                    for offset in range(0, self.size, CHUNK_SIZE)])
+                    
+        return self.packed_pieces
+        
+    def close(self):
+        """ Unmap and close the file, returns False if the mapping is still in use
+        
+        zmq may still hold chunks from this view when sending without copying, in 
+        which case the mapping can't be closed yet and the caller should try again 
+        later.
+        """
+        
+        self.view.release()
+        
+        if self.mmap is not None:
             
             try:
+                self.mmap.close()
+            
+            except BufferError:
+                return False
                 
-                msg = self.router.recv_multipart(zmq.NOBLOCK)
-                
-                # pass file chunk requests to appropriate handler
-                # if we get them whilst calling up another node
-                
-                if not msg[0] == bytes(router_id, 'utf-8'):
-                    
-                    
-                    if msg[1] == b"fetch": 
-                        self.file_rqst_handler(msg)
-                    
-                    continue
-                    
-                #only finalise if the hello resp came from the node we're 
-                # interested in
-                elif msg[1] == b'HELLO!':
-                    
-                    waiting_for_server = False
-                    self.logger.info("CRFileServer.challenge_resp:" +l_sep+\
-                        "File Requester responded, "+\
-                        " starting file server")
-                    ret_value = 1
+        self.file.close()
+        
+        return True
+        
+        
+class CRFileServer(threading.Thread):
+    """ Multi client file server """
+    
+    running = False
+    
+    def __init__(self, mode, logger, zmq_context, inproc_address, 
+                    machine_uuid, start_port, port_range, network_timeout,
+                    local_addresses =[],
+                    local_public_key = b'',
+                    local_sec_key = b'',
+                    swarm_files = None):
+                 
+        """ start a fileserver, creates a new thread
+        
+        mode: str: either 'client_node' or 'server_node', determines whether the server 
+            should bind or connect its socket used for data xfr.
+        logger: logging.logger object: Used by the calling process to log events
+        zmq_context: zmq.Context obj: Used for creating sockets
+        local_addresses: list('ip_addr:port') : A list of endpoints to bind to 
+            (if mode = 'server_node')
+        inproc_address: string :the address of the inproc socket used to communicate 
+            between the calling process and this file server.
+        machine_uuid: string: The uuid of this computer, used, hmmmm where is that used?
+        start_port: int: the starting port used to offset from when binding (used when
+            mode = 'render_node' only)
+        port_range: int: the number of ports to use starting with the start_port.
+        swarm_files: CRSwarmFiles: optional, files received by this node that can be
+            served to other render nodes.
+        
+        """
+        
+        
+        
+        threading.Thread.__init__(self, daemon= True)
+        
+        atexit.register(self.close)
+        
+        self.handlers = {utils.connect_node:self.connect_node,
+                        utils.exit:self.close,
+                        utils.update_timeout_prefs:self.update_timeout_prefs,
+                        utils.disconnect:self.disconnect_node}
+                        
+        
+        self.render_node_eps = list()
+        self.handshakes = {}
+        self.deadlines = CRDeadlines()
+        self.swarm_files = swarm_files
+        
+        self.logger = logger
+        self.network_timeout = network_timeout
+        self.endpoints = list()
+        self.machine_uuid = machine_uuid
+        self.local_public_key = local_public_key
+        self.local_sec_key = local_sec_key
+        
+        self.zmq_c = zmq_context
+        
+        ####### CONNECT INPROC SOCKET (CONTROL CHANNEL) ######### 
+        
+        self.inproc = self.zmq_c.socket(zmq.PAIR)
+        self.inproc.connect("inproc://" + inproc_address)
+        
+        
+        #Create the socket we'll use to send/recv data
+        
+        self.router = self.zmq_c.socket(zmq.ROUTER)
+        self.router.curve_secretkey = self.local_sec_key
+        self.router.curve_publickey = self.local_public_key
+        self.router.set(zmq.IDENTITY, bytes(machine_uuid, 'utf-8'))
+        self.router.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        self.router.setsockopt(zmq.TCP_KEEPALIVE_IDLE, 20)
+        self.router_id = self.router.IDENTITY
+        
+        
+        if mode == 'client_node':
+        
+            pass
+                                                
+            
+        
+        elif mode == 'server_node':
+            
+            self.router_ports = {}
+            self.router.curve_server = True
+            
+                                                
+
+            
+            self.router_ports = self.router.bind_to_random_port(
+                "tcp://*",
+                min_port = start_port + 15,
+                max_port = start_port + 15 + port_range)
+                                                
+            self.logger.info("CRFileServer.__init__ " + l_sep +\
+                "File server bound its router socket to :" + \
+                str(self.router.LAST_ENDPOINT) + ":" +\
+                str(self.router_ports))
+            
+            # rather than returning all the endpoints bound to, we just return the
+            # last one, endpoints are not actually used by the client, only the 
+            # port number since the client will only attempt a connect on the 
+            # ip it originally contacted the server on.
+            
+            self.endpoints.append(
+                (str(self.router.LAST_ENDPOINT), self.router_ports))
+        
+        
+        
+        ###########################################
+        
+        
+        self.poller = zmq.Poller()
+        
+        self.poller.register(self.router, zmq.POLLIN)
+        self.poller.register(self.inproc, zmq.POLLIN)
+        
+        self.file_streams = {}
+        self.closing_streams = []
+        # {path:(identity, packed signatures, packed pieces)} of recently served 
+        # files, so a node that connects after the view is closed doesn't wait 
+        # for them to be made again
+        self.file_digests = {}
+        
+        self.send_progress = {}
+        
+        # compressed chunks come back from the worker threads on self.encoded, the 
+        # socket pair wakes this thread from poll when one is ready to send
+        self.compressor = None
+        self.encoded = queue.Queue()
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+        self.poller.register(self.wake_recv, zmq.POLLIN)
+        
+        self.start()
+        
+    def run(self):
+        
+        self.running = True
+        
+        while self.running:
+            
+            try:
+                
+                # wake early if a handshake needs attention
+                events = dict(self.poller.poll(self.deadlines.poll_timeout(16)))
+                
+                if self.inproc in events:
+                    
+                 
+                    json_msg = self.inproc.recv_json(zmq.NOBLOCK)
+                    
+                    msg = MsgWrapper.deserialize(json_msg)
+                    
+                    if msg.command in self.handlers:
+                        
+                        self.handlers[msg.command](msg)
+                
+                # done before reading the router, which exits via EAGAIN
+                self.process_handshakes()
+                
+                if self.wake_recv in events:
+                    self.send_encoded_chunks()
+                     
+                if self.router in events:
+                    #handle router msgs
+                    keep_receiving = PIPELINE
+                    
+                    while keep_receiving:
+                        
+                       
+                        msg = self.router.recv_multipart(zmq.NOBLOCK)
+                        
+                        keep_receiving -= 1
+                        
+                        if msg[1] == b'HELLO?':
+                            
+                            self.router.send_multipart([msg[0], b'HELLO!'])
+                        # a peer answered our challenge
+                        elif msg[1] == b'HELLO!':
+                            self.handshake_complete(msg[0])
+                        else:
+                            self.file_rqst_handler(msg)
+                            
+                    
+                    
+                self.close_idle_streams()
+                    
+                
+                
+                
+            except zmq.ZMQError as e:
+                
+                if e.errno == zmq.EAGAIN:
+                                
+                    pass
+                
+                elif e.errno == zmq.ETERM:
+                    break
                     
                 else:
-                    #highly inprobably we'd get here, but not impossible, so
-                    # cover the case where a node could be getting requests
-                    # for chunks before the server is ready. This is supposed
-                    # to be blocked by the file requester waiting until the 
-                    # file server is connected, but you never know :0
+                    location = "CRFileServer.run"
+                
+                    log_string = " unexpected zmq error encountered" +\
+                                " whilst polling."
+                  
+                
+                    handle_generic_except(
+                        location= location, log_string=log_string, logger=self.logger)
+                
                     
-                    if msg[1] == b"fetch": 
-                        self.file_rqst_handler(msg)
+                    
+            except:
+                
+                location = "CRFileServer.run"
+                
+                log_string = " unknown error encountered" +\
+                                " whilst polling."
+                  
+                
+                handle_generic_except(
+                    location= location, log_string=log_string, logger=self.logger)
+                
+                
+                
+        #clean up
+         
+        #unregister and close all sockets
+        self.poller.unregister(self.router)
+        self.poller.unregister(self.inproc)    
+        self.poller.unregister(self.wake_recv)
+        
+        if self.compressor is not None:
+            self.compressor.shutdown(wait = True)
+        
+        #close
+        self.router.close(linger = 0)
+        self.inproc.close(linger = 0)
+        self.wake_recv.close()
+        self.wake_send.close()
+        
+        
+        #close all file streams
+        for files in list(self.file_streams.values()) + self.closing_streams:
+        
+            files.close()   
+            
+        self.logger.info("CRFileServer.run:" +l_sep+\
+            "shutdown..")
+            
+            
+    def file_rqst_handler(self, msg):
+        
+        """ handle request for a chunk of a file
+        
+        expected format of msgs
+        msg[0] = identity
+        msg[1] = request type - b'HELLO?', b'HELLO!', b'FILE_INFO', b'FILE_DATA'
+        msg[2] = FID (file ID)
+        msg[3] = offsets = (offset, chunk size) for FILE_DATA, a comma separated 
+                list of b'SIGS', b'PIECES' and b'CODECS=' followed by the codecs 
+                the requester can decode separated by b'|', or b'' for FILE_INFO
+        msg[4] = request uuid
+        msg[5] = optional, the codec to compress FILE_DATA chunks with
+        
+        FILE_INFO replies have a sixth frame with the file's packed signatures and a
+        seventh with its chunk digests when either was asked for, and an eighth 
+        with the codec chosen from those offered. FILE_DATA replies to requests 
+        that give a codec have an eighth frame with the codec the chunk was 
+        compressed with, b'' if it wasn't.
+        
+        In swarm mode FILE_HAVE and FILE_DATA requests from other render nodes give
+        a swarm id for the FID, see CRSwarmFiles.
+        
+        """
+        
+        #identity = msg[0]
+        fid = msg[2].decode('utf-8')
+        dumps = pickle.dumps
+        send_multipart = self.router.send_multipart
+        have = None
+        
+        ## SWARM REQUESTS FROM OTHER RENDER NODES
+        # these use a swarm id in place of the file path
+        if self.swarm_files is not None and msg[1] in (FILE_HAVE, b'FILE_DATA'):
+            
+            shared = self.swarm_files.get(fid)
+            
+            if msg[1] == FILE_HAVE:
+                
+                states = b'' if shared is None else shared[1]
+                
+                send_multipart([msg[0], msg[1], msg[2], zlib.compress(states, 1), 
+                    msg[4]])
+                
+                return
+                
+            elif shared is not None:
+                
+                fid, have = shared
+                
+            elif not os.path.isfile(fid):
+                
+                # not a file we're receiving, or one we've stopped sharing
+                for offset_data in pickle.loads(msg[3]):
+                    send_multipart([msg[0], NO_DATA, msg[2], dumps(offset_data[0]),
+                        msg[4], b'', b''])
+                        
+                return
+        
+        file_view = self.get_file_view(fid, msg[1], in_place = have is not None)
+        
+        # the requester will time out and report the failure
+        if file_view is None: return
+        
+        filesize = file_view.size
+        chunk = file_view.chunk
+        
+        if msg[1] == b"FILE_INFO":
+            
+            rep = [msg[0], msg[1], msg[2], 
+                filesize.to_bytes(
+                    (filesize.bit_length() // 8) + 1, byteorder='big'),
+                        msg[4]]
+                        
+            # the requester has an older copy and wants to reuse what it can, or
+            # is in a swarm and needs to check chunks it gets from peers
+            flags = msg[3].split(b',')
+            
+            offered = [flag[len(CODECS_OFFERED):].split(b'|') for flag in flags\
+                if flag.startswith(CODECS_OFFERED)]
+            
+            # use the requester's favourite codec that we also have
+            codec = [next((codec for codec in offered[0] if codec in CODECS), 
+                b'')] if offered else []
+            
+            self.logger.info(
+                "Crowdrender: Responding to request for file info for: " +\
+                 str(fid))
+            
+            if SIGS in flags or PIECES in flags or offered:
+                
+                self.send_file_info(rep, file_view, SIGS in flags, 
+                    PIECES in flags, codec)
+                    
+            else:
+                send_multipart(rep)
+        
+        elif msg[1] == b'FILE_DATA':
+            
+            offsets = pickle.loads(msg[3])
+            codec = msg[5] if len(msg) > 5 else b''
+            
+            
+            for offset_data in offsets:
+                
+                # a swarm peer can only serve chunks it has verified, every one 
+                # the request covers
+                if have is not None:
+                    
+                    first = offset_data[0] // CHUNK_SIZE
+                    last = max(first + 1, 
+                        ceil((offset_data[0] + offset_data[1]) / CHUNK_SIZE))
+                    
+                    verified = have[first:last].count(CRChunkMap.RECEIVED) ==\
+                        last - first
+                else:
+                    verified = True
+                    
+                if not verified:
+                    
+                    send_multipart([msg[0], NO_DATA, msg[2], dumps(offset_data[0]),
+                        msg[4], b'', b''])
+                        
+                    continue
+                
+                data = chunk(offset_data[0], offset_data[1])
+                
+                # compressing is left to the worker threads, the reply is sent 
+                # by send_encoded_chunks once it's done
+                if codec in CODECS:
+                    
+                    self.encode_chunk(
+                        [msg[0], msg[1], msg[2], dumps(offset_data[0]), msg[4]],
+                        data, codec)
+                        
+                    continue
+                
+                hash_digest = hash_algorithm(data).digest()
+                
+                send_multipart(
+                    [msg[0],
+                     msg[1],
+                     msg[2],
+                     dumps(offset_data[0]),
+                     msg[4],
+                     data,
+                     hash_digest],
+                     copy = False
+                            )
+                            
+    def encode_chunk(self, header, data, codec):
+        """ Compress a chunk for a FILE_DATA reply on the compression threads
+        
+        Arguments:
+            header:     list        - the first five frames of the reply
+            data:       bytes like  - the chunk
+            codec:      bytes       - name of the codec in CODECS the requester asked 
+                                        for
+        Returns:
+            nothing
+        Side Effects:
+            Starts the compression threads if they're not running
+        Exceptions:
+            None
+        Description:
+            zmq sockets can't be used from more than one thread, so when a chunk
+            is done the worker queues the reply and wakes the router thread with
+            a byte on self.wake_send.
+        """
+        
+        if self.compressor is None:
+            self.compressor = ThreadPoolExecutor(max_workers = COMPRESS_WORKERS)
+            
+        def chunk_encoded(future):
+            
+            self.encoded.put((header, future, None))
+            
+            try:
+                self.wake_send.send(b'\x00')
+            except OSError:
+                # buffer's full, the router thread already has a wake up waiting
+                pass
+            
+        self.compressor.submit(encode_chunk, data, codec).add_done_callback(
+            chunk_encoded)
+            
+    def send_file_info(self, rep, file_view, sigs, pieces, codec):
+        """ Send a FILE_INFO reply with the file's signatures and chunk digests
+        
+        Arguments:
+            rep:        list        - the first five frames of the reply
+            file_view:  CRFileView  - view of the requested file
+            sigs:       boolean     - True to include the file's signatures
+            pieces:     boolean     - True to include the digest of each chunk
+            codec:      list        - the codec chosen for the requester, empty if
+                                        it didn't offer any
+        Returns:
+            nothing
+        Side Effects:
+            Starts the worker threads if they're not running
+        Exceptions:
+            None
+        Description:
+            Hashing a multi GB blend file takes seconds, which would hold up every
+            other transfer if done on the router thread. Unless they're already 
+            known, the signatures and digests are made on the worker threads and 
+            the reply is sent by send_encoded_chunks. The view isn't closed while
+            they're being made.
+        """
+        
+        def describe():
+            
+            return (file_view.signatures() if sigs else b'',
+                    file_view.pieces() if pieces else b'') + tuple(codec)
+                    
+        if (not sigs or file_view.packed_sigs is not None) and\
+            (not pieces or file_view.packed_pieces is not None):
+            
+            self.router.send_multipart(rep + list(describe()))
+            
+            return
+            
+        if self.compressor is None:
+            self.compressor = ThreadPoolExecutor(max_workers = COMPRESS_WORKERS)
+            
+        file_view.pending += 1
+        
+        def described():
+            # called on the router thread once the reply is ready
+            file_view.pending -= 1
+            
+            self.file_digests.pop(file_view.path, None)
+            self.file_digests[file_view.path] = (file_view.identity, 
+                file_view.packed_sigs, file_view.packed_pieces)
+                
+            while len(self.file_digests) > FILE_DIGEST_CACHE:
+                self.file_digests.pop(next(iter(self.file_digests)))
+            
+        def info_ready(future):
+            
+            self.encoded.put((rep, future, described))
+            
+            try:
+                self.wake_send.send(b'\x00')
+            except OSError:
+                pass
+                
+        self.compressor.submit(describe).add_done_callback(info_ready)
+        
+    def send_encoded_chunks(self):
+        """ Send the replies the worker threads have finished making
+        
+        These are FILE_DATA replies with compressed chunks and FILE_INFO replies 
+        with signatures, see encode_chunk and send_file_info.
+        """
+        
+        try:
+            while self.wake_recv.recv(4096): pass
+        except OSError:
+            pass
+            
+        while True:
+            
+            try:
+                header, future, done = self.encoded.get_nowait()
+            except queue.Empty:
+                break
+                
+            try:
+                
+                frames = future.result()
+                
+            except Exception as e:
+                # the requester will ask again
+                self.logger.warning("CRFileServer.send_encoded_chunks:" + l_sep +\
+                    "Could not make reply : " + str(e))
+                    
+                if done is not None: done()
+                    
+                continue
+                
+            if done is not None: done()
+                
+            self.router.send_multipart(header + list(frames), copy = False)
+                
+    def get_file_view(self, fid, request_type, in_place = False):
+        """ Return the CRFileView for fid, opening it if needed, None on failure
+        
+        Arguments:
+            fid:            string  - path of the requested file
+            request_type:   bytes   - the type of request, used for logging
+            in_place:       boolean - True if the file is being written in place,
+                                        see CRFileView.is_current
+        Returns:
+            file_view:      CRFileView or None if the file couldn't be opened
+        Side Effects:
+            Opens, or replaces, the view for fid in self.file_streams
+        Exceptions:
+            None
+        Description:
+            Views are kept open between requests and closed by close_idle_streams
+            once they're no longer being used. If the file has changed on disk 
+            since it was opened, the old view is closed and a new one opened.
+        """
+        
+        file_view = self.file_streams.get(fid)
+        
+        if file_view is not None and not file_view.is_current(in_place):
+            
+            self.file_streams.pop(fid)
+            self.close_stream(file_view)
+            
+            file_view = None
+            
+        if file_view is None:
+            
+            try:
+            
+                file_view = CRFileView(fid)
+                
+                self.file_streams[fid] = file_view
+                
+                digests = self.file_digests.get(fid)
+                
+                if digests is not None and digests[0] == file_view.identity:
+                    file_view.packed_sigs, file_view.packed_pieces = digests[1:]
+                
+            except (OSError, ValueError) as e:
+                
+                self.logger.warning("CRFileServer.get_file_view:" + l_sep +\
+                    str(e) + " : This happened " +\
+                    "whilst handling a request for " + str(request_type))
+        
+        return file_view
+        
+    def close_stream(self, file_view):
+        """ Close file_view or, if its still in use, retry on the next pass """
+        
+        if not file_view.close():
+            
+            self.closing_streams.append(file_view)
+            
+    def close_idle_streams(self):
+        """ Close the views of files that haven't been requested for a while """
+        
+        if self.closing_streams:
+            
+            closing = self.closing_streams
+            self.closing_streams = []
+            
+            for file_view in closing:
+                self.close_stream(file_view)
+        
+        for fid, file_view in list(self.file_streams.items()):
+            
+            if timed_out(file_view.last_used, FILE_STREAM_IDLE) and\
+                not file_view.pending:
+                
+                self.file_streams.pop(fid)
+                self.close_stream(file_view)
+
+
+    def update_timeout_prefs(self, msg):
+        
+        self.network_timeout = msg.attributes[utils.timeout]
+        
+        self.logger.info("CRFileServer.update_timeout_prefs:" +l_sep+\
+            " updated the network timeout value to :" +\
+            str(self.network_timeout) + " seconds")
+            
+    def close(self, msg=None):
+    
+        self.logger.info("CRFileServer.close:" +l_sep+\
+            " shutting down..")
+        self.running = False
+        
+    def disconnect_node(self, msg):
+        """ Disconnects a requesting node from the file server.
+        
+        """
+        
+        node_endpoints = msg.attributes[utils.server_endpoint]
+        
+        
+        for endpoint in node_endpoints:
+            
+            try:
+                self.router.disconnect(endpoint[address])
+                if endpoint in self.render_node_eps:
+                    self.render_node_eps.remove(endpoint)
+                self.logger.info("CRFileServer.disconnect_node:" +l_sep+\
+                    " is disconnected from: " + endpoint[address])
+            except zmq.ZMQError as e:
+                if e.errno == 2:
+                    self.logger.info("CRFileServer.disconnect_node:" +l_sep+\
+                    " was disconnected from: " + endpoint[address] +\
+                    " with an exception, seems the disconnect failed with " +\
+                    e.strerror)
+                    
+        #CLOSE EXISTING ROUTER SOCKET            
+        self.poller.unregister(self.router)
+        self.router.close(linger=0)
+        
+        ## CREATE NEW ROUTER SOCKET
+        # done so that peer tables are reset and the any new connection to 
+        # a node that failed on connect will work, otherwise router - router
+        # sockets suffer corrupt peer tables and msgs are dropped silently
+        self.router = self.zmq_c.socket(zmq.ROUTER)
+        self.router.curve_secretkey = self.local_sec_key
+        self.router.curve_publickey = self.local_public_key
+        self.router.setsockopt(zmq.IDENTITY, bytes(self.machine_uuid, 'utf-8'))
+        self.router.setsockopt(zmq.LINGER, 0)
+        self.router.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        self.router.setsockopt(zmq.TCP_KEEPALIVE_IDLE, 20)
+        self.poller.register(self.router, zmq.POLLIN)
+        
+        # reconnect to endpoints that are connected or still being challenged
+        pending_eps = [hs['endpoint'] for hs in self.handshakes.values()]
+        
+        for endpoint in self.render_node_eps + pending_eps:
+            self.router.curve_serverkey = bytes(endpoint[public_key], 'utf-8')
+            self.router.connect(endpoint[address])
+                
+        
+    def connect_node(self, msg):
+        """ connects the file server to a render node
+        this method connects the file server to a render node using the address given
+        in the msg argument. The msg argument needs to be a utils.MsgWrapper object
+        with an attribute called utils.server_endpoint which stores the endpoint that
+        the files server connects to as a string in the following format:
+        
+            '0.0.0.0:00000' 
+            
+        This is then used to connect to the render node. The zmq socket that is 
+        used is of the ROUTER type and is connected to multiple render nodes, each 
+        endpoint is stored in a list.
+        
+        The connection is confirmed by a challenge/response handshake, which is 
+        started here and then run asynchronously from the main loop by 
+        process_handshakes, so that connecting to many nodes, or to a node that 
+        is dead, doesn't stop this thread from serving file chunks.
+        
+        """
+        
+        node_endpoints = msg.attributes[utils.server_endpoint]
+        node_router_id = msg.attributes[utils.requesting_id]
+        
+        for endpoint in node_endpoints:
+            
+            hs_id = (node_router_id, endpoint[address])
+            
+            # nothing to do for a node we're already connected to, or are still 
+            # waiting to hear from
+            if endpoint in self.render_node_eps:
+                self.logger.info("CRFileServer.connect_node:" +l_sep+\
+                    " already connected to this node: " +\
+                         str(endpoint[address]))
+                         
+                continue
+                
+            elif hs_id in self.handshakes:
+                self.logger.info("CRFileServer.connect_node:" +l_sep+\
+                    " already waiting for this node: " +\
+                         str(endpoint[address]))
+                         
+                continue
+               
+            self.router.curve_serverkey = bytes(endpoint[public_key], 'utf-8')
+            self.router.connect(endpoint[address])
+            
+            # see if the node is actually listening now, the first HELLO? is sent
+            # straight away by process_handshakes.
+            self.handshakes[hs_id] = {
+                peer_id         :node_router_id,
+                'endpoint'      :endpoint,
+                'connect_msg'   :msg,
+                start_time      :time.perf_counter()
+                }
+            
+            self.deadlines.schedule(hs_id, 0.0)
+            
+    def process_handshakes(self):
+        """ Send HELLO? msgs for pending handshakes that are due and expire old ones
+        
+        Arguments:
+            None
+        Returns:
+            Nothing
+        Side Effects:
+            Sends HELLO? msgs to peers, calls handshake_failed for handshakes that 
+            have run out of time.
+        Exceptions:
+            None
+        Description:
+            Each handshake has its own deadline in self.deadlines. When it expires
+            either the handshake has run out of time, or its time to ask the peer
+            again. The interval between HELLO? msgs backs off exponentially, 
+            reaching a maximum of 2 seconds.
+        """
+        
+        for hs_id in self.deadlines.pop_expired():
+            
+            handshake = self.handshakes.get(hs_id)
+            
+            # already answered
+            if handshake is None: continue
+            
+            elapsed = time.perf_counter() - handshake[start_time]
+            time_left = float(self.network_timeout) - elapsed
+            
+            if time_left <= 0.0:
+                
+                self.handshake_failed(hs_id)
+                
+                continue
+            
+            self.router.send_multipart([bytes(handshake[peer_id], 'utf-8'), 
+                                        b'HELLO?'])
+            
+            # formula :   Max_t * exp ( R_t / elapsed_time)
+            # Max_t = max interval between sent msgs
+            # R_t coefficient that governs how fast the backoff reaches Max_t,
+            # a value of zero will make exp_backoff equal to Max_t at all times,
+            # values that are very small but not zero make exp_backoff reach 
+            # Max_t very very quickly, larger values, more slowly.
+            exp_backoff = 2.0 * exp(-1.0 / max(elapsed, 0.01))
+            
+            self.deadlines.schedule(hs_id, 
+                min(max(exp_backoff, HELLO_MIN_INTERVAL), time_left))
+            
+    def handshake_complete(self, router_id):
+        """ Complete any pending handshakes with the peer that has router_id
+        
+        Arguments:
+            router_id:  bytes   - zmq identity of the peer that sent HELLO!
+        Returns:
+            Nothing
+        Side Effects:
+            Adds the endpoints of the peer to the list of connected endpoints
+        Exceptions:
+            None
+        """
+        
+        completed = [hs_id for hs_id, handshake in self.handshakes.items()\
+                        if bytes(handshake[peer_id], 'utf-8') == router_id]
+        
+        for hs_id in completed:
+            
+            handshake = self.handshakes.pop(hs_id)
+            self.deadlines.cancel(hs_id)
+            
+            if not handshake['endpoint'] in self.render_node_eps:
+                self.render_node_eps.append(handshake['endpoint'])
+            
+            self.logger.info("CRFileServer.handshake_complete:" +l_sep+\
+                "File Requester responded, connected to: " +\
+                 str(handshake['endpoint'][address]))
+                
+    def handshake_failed(self, hs_id):
+        """ Disconnect from an endpoint that never answered and notify the caller
+        
+        Arguments:
+            hs_id:      tuple   - (router_id, endpoint address) of the handshake
+        Returns:
+            Nothing
+        Side Effects:
+            Disconnects the endpoint and sends a connect_failed msg 
+        Exceptions:
+            None
+        """
+        
+        handshake = self.handshakes.pop(hs_id)
+        endpoint = handshake['endpoint']
+        ch_msg = handshake['connect_msg']
+        
+        self.logger.error("CRFileServer.handshake_failed:" +l_sep+\
+                    " Could not connect to :" + handshake[peer_id])
+        
+        # if we timeout we just disconnect from the endpoint and assume
+        # its dead. 
+        disconnect_msg = MsgWrapper(command = utils.disconnect,
+            attributes = {utils.server_endpoint:[endpoint]}) 
+            
+        self.disconnect_node(disconnect_msg) 
+
+        self.logger.warning("CRFileServer.handshake_failed:" +l_sep+\
+            " could not establish comms for : " +\
+                    str(endpoint[address]) + " so it was disconnected")
+        
+        conn_failed = MsgWrapper(message = utils.connect_failed,
+            s_uuid = ch_msg.s_uuid,
+            attributes = {utils.node_name:ch_msg.attributes[utils.node_name],
+                        utils.node_address:endpoint[address].split(":")[0]})
+            
+        self.inproc.send_json(conn_failed.serialize())
+        
+        
+class CRChunkMap:
+    """ Tracks which chunks of a file have been requested and received
+    
+    Arguments:
+        file_size:      int     - size of the file in bytes
+    
+    Description:
+        Holds one state byte per CHUNK_SIZE chunk of the file, MISSING, IN_FLIGHT
+        or RECEIVED, in a bytearray. About 65k bytes for a 4GB file. Marking and
+        testing a chunk is O(1). The next chunk to request is found with 
+        bytearray.find from a cursor that only moves back when a request is lost,
+        so finding missing chunks runs in C rather than in a python loop. The 
+        count of received chunks is kept as chunks are marked, so progress doesn't
+        need a scan.
+        
+        Outstanding requests are kept in a dict {offset:[time requested, size, 
+        resent, source]} in the order they were sent. A request may cover several
+        contiguous chunks. resent is True if the offset had been requested before,
+        copies of such chunks give no useful round trip time (Karn's algorithm).
+        source is the router id of the peer the request was sent to. Since requests
+        are added as they're sent, the oldest request to each source comes first, 
+        so finding timed out requests stops once every source has an outstanding
+        request that hasn't timed out. The bytes outstanding and the number of 
+        requests outstanding to each source are counted as requests are added and
+        removed.
+    """
+    
+    MISSING = 0
+    IN_FLIGHT = 1
+    RECEIVED = 2
+    
+    def __init__(self, file_size):
+        
+        self.file_size = file_size
+        self.n_chunks = ceil(file_size / CHUNK_SIZE)
+        self.states = bytearray(self.n_chunks)
+        self.received = 0
+        self.in_flight = {}
+        self.in_flight_bytes = 0 # bytes requested and not yet received
+        self.in_flight_count = {} # {source:requests outstanding}
+        self.resent = set()
+        self.cursor = 0 # no chunk before this is MISSING
+        
+    @property
+    def complete(self):
+        
+        return self.received == self.n_chunks
+        
+    @property
+    def remaining(self):
+        """ The number of chunks not yet received """
+        
+        return self.n_chunks - self.received
+        
+    def progress(self):
+        """ Return the percentage of the file received """
+        
+        if not self.n_chunks: return 100.0
+        
+        return self.received / self.n_chunks * 100
+        
+    def chunk_range(self, offset, size):
+        """ Return the range of chunk indices covered by size bytes from offset """
+        
+        return range(offset // CHUNK_SIZE, 
+                     min(ceil((offset + size) / CHUNK_SIZE), self.n_chunks))
+        
+    def add_request(self, offset, req):
+        """ Add req, [time requested, size, resent, source], to the outstanding requests """
+        
+        # a request for an offset that's still outstanding replaces it, and moves 
+        # to the end so the dict stays in the order requests were sent
+        self.remove_request(offset)
+        
+        self.in_flight[offset] = req
+        self.in_flight_bytes += req[1]
+        self.in_flight_count[req[3]] = self.in_flight_count.get(req[3], 0) + 1
+        
+    def remove_request(self, offset):
+        """ Remove the outstanding request for offset, returns it or None """
+        
+        req = self.in_flight.pop(offset, None)
+        
+        if req is not None:
+            
+            self.in_flight_bytes -= req[1]
+            self.in_flight_count[req[3]] -= 1
+            
+            if not self.in_flight_count[req[3]]:
+                del self.in_flight_count[req[3]]
+                
+        return req
+        
+    def release(self, offset, size):
+        """ Mark the chunks of a lost request that haven't arrived as MISSING """
+        
+        states = self.states
+        
+        for index in self.chunk_range(offset, size):
+            if states[index] == self.IN_FLIGHT:
+                states[index] = self.MISSING
+                
+        self.cursor = min(self.cursor, offset // CHUNK_SIZE)
+        self.resent.add(offset)
+        
+    def next_requests(self, credit, chunk_mult, now, source = None):
+        """ Return up to credit [offset, size] requests and mark them in flight
+        
+        Arguments:
+            credit      - int       - the most requests to return
+            chunk_mult  - int       - most CHUNK_SIZE chunks to cover with a request
+            now         - float     - time the requests will be sent
+            source      - string    - router id of the peer the requests go to
+        Returns:
+            requests    - list      - [[offset, size], ...]
+        Side Effects:   
+            Marks the requested chunks as IN_FLIGHT and adds them to self.in_flight
+        Exceptions:
+            None        
+        Description:
+            Runs of contiguous missing chunks are merged into a single request 
+            of up to chunk_mult * CHUNK_SIZE bytes.
+        """
+        
+        states = self.states
+        find = states.find
+        missing = bytes([self.MISSING])
+        requests = []
+        
+        index = find(missing, self.cursor)
+        
+        if index == -1: index = self.n_chunks
+        
+        self.cursor = index
+        
+        while index < self.n_chunks and len(requests) < credit:
+            
+            run_end = index + 1
+            limit = min(index + chunk_mult, self.n_chunks)
+            
+            while run_end < limit and states[run_end] == self.MISSING:
+                run_end += 1
+                
+            for i in range(index, run_end):
+                states[i] = self.IN_FLIGHT
+                
+            offset = index * CHUNK_SIZE
+            size = (run_end - index) * CHUNK_SIZE
+            
+            self.add_request(offset, [now, size, offset in self.resent, source])
+            requests.append([offset, size])
+            
+            index = find(missing, run_end)
+            
+            if index == -1: index = self.n_chunks
+            
+        return requests
+        
+    def request_chunk(self, index, now, source):
+        """ Mark the single chunk at index as requested from source, returns offset """
+        
+        offset = index * CHUNK_SIZE
+        
+        self.states[index] = self.IN_FLIGHT
+        self.add_request(offset, [now, CHUNK_SIZE, offset in self.resent, source])
+        
+        return offset
+        
+    def expire(self, now, rto_of):
+        """ Release requests that have timed out
+        
+        Arguments:
+            now         - float     - the current time
+            rto_of      - function  - returns the retransmit timeout in secs for 
+                                        requests sent to the source given to it
+        Returns:
+            expired     - list      - [(offset, request), ...] the requests released
+        Description:
+            Requests are looked at oldest first, once a request to a source hasn't 
+            timed out none of the later ones to that source have either, so the 
+            search ends when that's true of every source.
+        """
+        
+        expired = []
+        waiting = set() # sources with a request that hasn't timed out
+        n_sources = len(self.in_flight_count)
+        
+        for offset, req in self.in_flight.items():
+            
+            if req[3] in waiting: continue
+            
+            if now - req[0] > rto_of(req[3]):
+                
+                expired.append((offset, req))
+                
+            else:
+                
+                waiting.add(req[3])
+                
+                if len(waiting) == n_sources: break
+                
+        for offset, req in expired:
+            
+            self.remove_request(offset)
+            self.release(offset, req[1])
+            
+        return expired
+        
+    def next_timeout(self, rto_of):
+        """ Return the time the first outstanding request times out, or None
+        
+        Arguments:
+            rto_of      - function  - returns the retransmit timeout in secs for 
+                                        requests sent to the source given to it
+        Returns:
+            due         - float     - time the first request will time out
+        Description:
+            Only the oldest request to each source needs looking at.
+        """
+        
+        due = None
+        seen = set()
+        n_sources = len(self.in_flight_count)
+        
+        for req in self.in_flight.values():
+            
+            if req[3] in seen: continue
+            
+            seen.add(req[3])
+            
+            timeout = req[0] + rto_of(req[3])
+            
+            if due is None or timeout < due: due = timeout
+            
+            if len(seen) == n_sources: break
+            
+        return due
+        
+    def mark_failed(self, offset):
+        """ A chunk failed its hash check, make it available to request again """
+        
+        req = self.remove_request(offset)
+        
+        if req is not None:
+            self.release(offset, req[1])
+            
+        return req
+        
+    def mark_local(self, ranges):
+        """ Mark chunks filled from a local copy of the file as received
+        
+        Arguments:
+            ranges      - list      - [(offset, size), ...] ascending byte ranges of
+                                        the file that were copied locally
+        Returns:
+            count       - int       - number of chunks that no longer need requesting
+        Description:
+            Only chunks entirely covered by the ranges are marked, the rest are 
+            requested in full, overwriting the local data with the same bytes.
+        """
+        
+        states = self.states
+        count = 0
+        
+        # merge adjacent ranges so chunks spanning several of them are found
+        merged = []
+        
+        for offset, size in ranges:
+            
+            if merged and merged[-1][1] == offset:
+                merged[-1][1] = offset + size
+            else:
+                merged.append([offset, offset + size])
+                
+        for start, end in merged:
+            
+            first = ceil(start / CHUNK_SIZE)
+            # the last chunk of the file is short, so the end of the file counts
+            last = self.n_chunks if end >= self.file_size else end // CHUNK_SIZE
+            
+            for index in range(first, last):
+                
+                if states[index] == self.MISSING:
+                    states[index] = self.RECEIVED
+                    count += 1
+                    
+        self.received += count
+        
+        return count
+        
+    def restore(self, saved):
+        """ Mark the chunks received by an earlier attempt at this transfer
+        
+        Arguments:
+            saved       - bytes     - chunk states saved by CRTransferState, they 
+                                        must be for a file of the same size
+        Returns:
+            count       - int       - number of chunks that no longer need requesting
+        """
+        
+        count = 0
+        
+        for index in range(self.n_chunks):
+            
+            if saved[index] == self.RECEIVED and self.states[index] == self.MISSING:
+                
+                self.states[index] = self.RECEIVED
+                count += 1
+                
+        self.received += count
+        
+        return count
+        
+    def mark_received(self, offset, size):
+        """ Mark the chunks covered by size bytes from offset as received
+        
+        Arguments:
+            offset      - int       - offset of the data received
+            size        - int       - number of bytes received
+        Returns:
+            rtt_start   - float     - the time the request for this data was sent, 
+                                        None if it wasn't outstanding or had been 
+                                        resent.
+            doubles     - list      - offsets of chunks that had already arrived
+        """
+        
+        states = self.states
+        doubles = []
+        
+        for index in self.chunk_range(offset, size):
+            
+            if states[index] == self.RECEIVED:
+                doubles.append(index * CHUNK_SIZE)
+                
+            else:
+                states[index] = self.RECEIVED
+                self.received += 1
+                
+        req = self.remove_request(offset)
+        
+        self.resent.discard(offset)
+        
+        if req is None or req[2]:
+            rtt_start = None
+        else:
+            rtt_start = req[0]
+            
+        return rtt_start, doubles
+        
+        
+class CRTransferWindow:
+    """ Congestion controller for the chunk requests of a single file transfer
+    
+    Arguments:
+        max_rto:        float   - secs, the longest the retransmit timeout may grow to
+        initial_rtt:    float   - secs, optional rtt measured before the transfer 
+                                    started, for example by the file info request.
+    
+    Description:
+        Decides how many chunk requests a transfer may have outstanding (cwnd) and
+        how large each chunk should be. The window follows the AIMD scheme used by 
+        TCP. In slow start it grows by one request for every chunk that arrives, 
+        doubling each round trip, then by one request per round trip once it passes 
+        ssthresh. It stops growing when the smoothed round trip time rises well above
+        the lowest seen, since that means a queue is building somewhere between us
+        and the peer and more requests would only add delay.
+        
+        A timed out request collapses the window to WINDOW_MIN and backs off the 
+        retransmit timeout, a chunk that fails its hash check halves the window and
+        the chunk size, so less data is resent if the link keeps corrupting data.
+        
+        Chunk size is a multiple of CHUNK_SIZE chosen from the bandwidth delay 
+        product (goodput * min rtt) so that about WINDOW_TARGET chunks fill the pipe.
+        Fast, high latency links get larger chunks and fewer msgs per byte, LANs 
+        stay at CHUNK_SIZE. Timeouts use the RFC 6298 estimator, srtt + 4 * rttvar.
+    """
+    
+    def __init__(self, max_rto, initial_rtt = None):
+        
+        self.cwnd = float(WINDOW_INITIAL)
+        self.ssthresh = float(WINDOW_MAX)
+        self.chunk_mult = 1
+        
+        self.srtt = None
+        self.rttvar = 0.0
+        self.min_rtt = None
+        self.max_rto = max_rto
+        self.rto = min(RTO_INITIAL, max_rto)
+        
+        # goodput is measured over rounds of roughly one rtt each
+        self.goodput = 0.0 # bytes/sec, smoothed
+        self.max_goodput = 0.0
+        self.round_start = time.perf_counter()
+        self.round_bytes = 0
+        
+        self.timeouts = 0
+        self.bad_hashes = 0
+        
+        if initial_rtt:
+            self.add_rtt_sample(initial_rtt)
+        
+    @property
+    def chunk_size(self):
+        """ Size in bytes of each chunk request """
+        
+        return self.chunk_mult * CHUNK_SIZE
+        
+    def credit(self, in_flight):
+        """ Return how many more chunk requests can be sent now """
+        
+        return max(int(self.cwnd) - in_flight, 0)
+        
+    def add_rtt_sample(self, rtt):
+        """ Update the smoothed rtt and the retransmit timeout from a new sample """
+        
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+            self.min_rtt = rtt
+            
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.min_rtt = min(self.min_rtt, rtt)
+            
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MIN), self.max_rto)
+        
+    def on_chunk(self, nbytes, rtt = None):
+        """ A requested chunk arrived intact
+        
+        Arguments:
+            nbytes:     int     - size of the chunk received
+            rtt:        float   - secs, time since the chunk was requested, None if
+                                    the chunk was a late copy of a re-requested chunk 
+                                    and so has no meaningful rtt.
+        """
+        
+        if rtt is not None:
+            self.add_rtt_sample(rtt)
+            
+        self.round_bytes += nbytes
+        
+        queue_building = self.srtt is not None and\
+            self.srtt > self.min_rtt * QUEUE_DELAY_FACTOR
+            
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1.0
+            
+        elif not queue_building:
+            self.cwnd += 1.0 / self.cwnd
+            
+        self.cwnd = min(self.cwnd, WINDOW_MAX)
+        
+        self.end_round()
+        
+    def end_round(self):
+        """ Sample goodput once a round trip has passed and resize chunks """
+        
+        now = time.perf_counter()
+        elapsed = now - self.round_start
+        
+        if self.srtt is None or elapsed < self.srtt or elapsed <= 0.0:
+            return
+            
+        sample = self.round_bytes / elapsed
+        
+        self.goodput = sample if not self.goodput else\
+            0.75 * self.goodput + 0.25 * sample
+        # let old peaks fade so the chunk size can follow a link that slows down
+        self.max_goodput = max(self.max_goodput * 0.9, sample)
+        
+        self.round_start = now
+        self.round_bytes = 0
+        
+        # step towards the chunk size that fills the pipe with WINDOW_TARGET chunks,
+        # one step per round so a single noisy sample can't swing it far.
+        bdp = self.max_goodput * self.min_rtt
+        target = min(max(ceil(bdp / (WINDOW_TARGET * CHUNK_SIZE)), 1), CHUNK_MULT_MAX)
+        
+        if target > self.chunk_mult:
+            self.chunk_mult *= 2
+            # keep the bytes in flight the same
+            self.cwnd = max(self.cwnd / 2, WINDOW_MIN)
+            self.ssthresh = max(self.ssthresh / 2, WINDOW_MIN)
+            
+        elif target < self.chunk_mult // 2:
+            self.chunk_mult //= 2
+            self.cwnd = min(self.cwnd * 2, WINDOW_MAX)
+            
+        self.chunk_mult = min(self.chunk_mult, CHUNK_MULT_MAX)
+        
+    def on_timeout(self):
+        """ Requests timed out, assume loss and collapse the window """
+        
+        self.timeouts += 1
+        
+        self.ssthresh = max(self.cwnd / 2, WINDOW_MIN)
+        self.cwnd = float(WINDOW_MIN)
+        self.rto = min(self.rto * 2, self.max_rto)
+        
+    def on_bad_hash(self):
+        """ A chunk failed its hash check, halve the window and chunk size """
+        
+        self.bad_hashes += 1
+        
+        self.ssthresh = max(self.cwnd / 2, WINDOW_MIN)
+        self.cwnd = self.ssthresh
+        self.chunk_mult = max(self.chunk_mult // 2, 1)
+        
+    def stats(self):
+        """ Return a string summarising the state of the window for logging """
+        
+        return ("window: %.1f, chunk size: %i, srtt: %s, min rtt: %s, goodput: "
+                "%.0f bytes/s, timeouts: %i, bad hashes: %i" %
+                (self.cwnd, self.chunk_size, self.srtt, self.min_rtt, 
+                 self.goodput, self.timeouts, self.bad_hashes))
+        
+        
+class CRTransferScheduler:
+    """ Shares a budget of bytes in flight between the file transfers of a requester
+    
+    Arguments:
+        budget:     int     - most bytes that may be requested and not yet received, 
+                                over all transfers
+    
+    Description:
+        Each transfer has a priority class, PRIORITY_INTERACTIVE, PRIORITY_SYNC or
+        PRIORITY_PREFETCH. A transfer's CRTransferWindow decides how many chunks it
+        could have in flight, the scheduler decides how many of those it gets.
+        
+        Classes are served strictly in order. Budget that a higher class has in 
+        flight or is waiting for is held back from lower classes, so as the chunks 
+        of a big upload arrive, the budget they free goes to waiting tile downloads
+        first.
+        
+        Within a class the budget is split evenly between peers, and a peer's share
+        between its transfers, so one node with many files can't crowd out the 
+        others. Shares are only enforced while another transfer in the class is
+        waiting, budget nobody else wants can be used by anyone.
+        
+        A transfer with nothing in flight may always send one request, so no 
+        transfer is starved for long enough to time out.
+    """
+    
+    def __init__(self, budget):
+        
+        self.budget = budget
+        
+        # req_uuid: [priority, peer, bytes in flight, bytes waiting for budget]
+        self.transfers = {}
+        
+    def add(self, req_uuid, priority, peer):
+        
+        self.transfers[req_uuid] = [priority, peer, 0, 0]
+        
+    def remove(self, req_uuid):
+        
+        self.transfers.pop(req_uuid, None)
+        
+    def retain(self, live):
+        """ Forget the transfers whose req_uuid isn't in live """
+        
+        for req_uuid in [r for r in self.transfers if not r in live]:
+            del self.transfers[req_uuid]
+        
+    def order(self, req_uuids):
+        """ Return req_uuids sorted highest priority first """
+        
+        transfers = self.transfers
+        
+        return sorted(req_uuids, key = lambda req_uuid: 
+            transfers.get(req_uuid, (PRIORITY_SYNC,))[0])
+            
+    def credit(self, req_uuid, credit, chunk_bytes, in_flight):
+        """ Return how many chunk requests the transfer for req_uuid may send now
+        
+        Arguments:
+            req_uuid    - bytes     - the request id of the transfer
+            credit      - int       - chunk requests the transfer's window allows
+            chunk_bytes - int       - size of each chunk request
+            in_flight   - int       - bytes the transfer has requested and not 
+                                        received
+        Returns:
+            credit      - int       - chunk requests the transfer may send
+        """
+        
+        transfer = self.transfers.get(req_uuid)
+        
+        if transfer is None or not credit: return credit
+        
+        priority, peer = transfer[0], transfer[1]
+        transfer[2] = in_flight
+        wanted = credit * chunk_bytes
+        
+        total = 0
+        higher = 0
+        peers = {}
+        contended = False
+        
+        for other_uuid, (p, other_peer, flight, waiting) in self.transfers.items():
+            
+            total += flight
+            
+            if p < priority:
+                
+                higher += flight + waiting
                 
-            except zmq.ZMQError as e:
+                # only waiting is held back, what's in flight is already in total
+                total += waiting
                 
-                if e.errno == zmq.EAGAIN:
-                    
-                    pass
+            elif p == priority:
                 
-            except AssertionError:
+                peers[other_peer] = peers.get(other_peer, 0) + 1
                 
-                raise
-            
-            elapsed = time.perf_counter() - start_time
-            time_left = float(self.network_timeout) - (elapsed)
-            # formula :   Max_t * exp ( R_t / elapsed_time)
-            # Max_t = max interval between sent msgs
-            # R_t coefficient that governs how fast the backoff reaches Max_t,
-            # a value of zero will make exp_backoff equal to Max_t at all times,
-            # values that are very small but not zero make exp_backoff reach 
-            # Max_t very very quickly, larger values, more slowly.
-            exp_backoff = 2.0 * exp(-1.0 / elapsed)
-            time.sleep(exp_backoff)
+                if waiting and not other_uuid == req_uuid:
+                    contended = True
+                    
+        allowed = min(wanted, self.budget - total)
         
-        return ret_value
+        if contended:
+            
+            share = max(self.budget - higher, 0) / len(peers) / peers[peer]
+            
+            allowed = min(allowed, share - in_flight)
+            
+        granted = max(int(allowed // chunk_bytes), 0)
         
+        if not granted and not in_flight:
+            granted = 1
             
+        granted = min(granted, credit)
+        
+        # counted as in flight now, so transfers later in this pass see them
+        transfer[2] = in_flight + granted * chunk_bytes
+        transfer[3] = max(wanted - granted * chunk_bytes, 0)
         
+        return granted
         
+
 class CRFileRequest(threading.Thread):
     """ A file server that serves multiple requesters simultaneously.
         The file server runs in a separate thread and can serve the same file to 
@@ -664,6 +2594,14 @@ class CRFileRequest(threading.Thread):
         local_addresses: list(string)): A list containing the addresses of the 
             network interfaces on this machine, used only when mode = 'server_node' and
             ensures that all nics are used by the file requester.
+        chunk_store_path: string: optional, directory of a CRChunkStore used to 
+            assemble files from chunks already on this machine.
+        chunk_store_size: int: size limit of the chunk store in bytes.
+        swarm_files: CRSwarmFiles: optional, shared with this node's file server so 
+            files being received can be fetched from, and served to, other render
+            nodes in the session.
+        compression: string: 'auto', 'none' or the name of a codec in CODECS, the 
+            codecs offered to file servers for compressing chunks.
             
             
     """
@@ -683,14 +2621,14 @@ class CRFileRequest(threading.Thread):
                 start_port = 0,
                 port_range = 0,
                 local_public_key = b'',
-                local_sec_key = b''):
+                local_sec_key = b'',
+                chunk_store_path = '',
+                chunk_store_size = 0,
+                swarm_files = None,
+                compression = 'auto'):
         
         threading.Thread.__init__(self, daemon= True)
         
-        # temporary directory for storing all transferring files, 
-        # keeps uploading/downloading files separate from files in use by the system.
-        self.temp_dir = tempfile.TemporaryDirectory() 
-        
         atexit.register(self.close)
         
         self.handlers = {utils.update_timeout_prefs:self.update_timeout_prefs,
@@ -698,6 +2636,7 @@ class CRFileRequest(threading.Thread):
                     utils.file_transf_req:self.file_transf_req,
                     utils.connect_node:self.connect_node,
                     utils.disconnect:self.disconnect_node,
+                    utils.swarm_peers:self.connect_swarm_peers,
                     utils.cancel:self.cancel_all_tasks} 
                     
         self.render_node_eps = list()
@@ -712,6 +2651,34 @@ class CRFileRequest(threading.Thread):
         self.local_sec_key = local_sec_key
         self.file_server_ready = False  
         self.recv_tasks = {}
+        self.deadlines = CRDeadlines()
+        self.chunk_store = None
+        self.swarm_files = swarm_files
+        self.swarm_peers = {} # {(addresses of a peer's file server):machine_uuid}
+        self.codecs = codecs_for(compression)
+        self.scheduler = CRTransferScheduler(TRANSFER_BUDGET)
+        
+        # older copies of files are searched for reusable chunks on the worker 
+        # threads, the results come back on self.copied and the socket pair wakes
+        # this thread from poll when one is ready
+        self.workers = None
+        self.delta_copies = set() # req_uuids of the copies still wanted
+        self.copied = queue.Queue()
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+        
+        if chunk_store_path:
+            
+            try:
+                
+                self.chunk_store = CRChunkStore(chunk_store_path, chunk_store_size)
+                
+            except OSError as e:
+                
+                self.logger.warning("CRFileRequest.__init__:" + l_sep +\
+                    "Could not open the chunk store at " + chunk_store_path +\
+                    ", files will be transferred in full : " + str(e))
         
         ####### CONNECT INPROC SOCKET (CONTROL CHANNEL) #########
         
@@ -721,6 +2688,7 @@ class CRFileRequest(threading.Thread):
         self.poller = zmq.Poller()
         
         self.poller.register(self.inproc, zmq.POLLIN)
+        self.poller.register(self.wake_recv, zmq.POLLIN)
 
         self.logger.info("CRFileRequest.__init__:" +l_sep+\
             "File Requester connected its inproc channel")
@@ -902,6 +2870,12 @@ class CRFileRequest(threading.Thread):
                 raise
             
             time_left = self.timeout - (time.time() - start_time)  
+            
+            # block until the peer answers, or it's time to ask again, instead
+            # of spinning on the socket.
+            if waiting_for_server:
+                self.router.poll(timeout = int(
+                    min(HELLO_INTERVAL, max(time_left, 0.0)) * 1000))
         
         return ret
         
@@ -963,6 +2937,9 @@ class CRFileRequest(threading.Thread):
         task[start_time] = time.perf_counter()
         
         self.recv_tasks[req_uuid] = task
+        
+        # due immediately so the task's action runs on the next pass
+        self.deadlines.schedule_at(req_uuid, task[start_time])
         # self.logger.debug("CRMain.add_async_task: " + l_sep +\
 #             " A new task was added to the internal async tasks list : " +\
 #             str(t_uuid))
@@ -986,21 +2963,78 @@ class CRFileRequest(threading.Thread):
             process received file data. It also checks for timed out requests and runs
             the task's timedout handler if they've run out of time.
             
+            A task's action is only run when it has received data or when its 
+            deadline in self.deadlines has expired, otherwise there is nothing for
+            it to do. After running, the task's next deadline is registered so the
+            run loop can sleep in poll until then.
+            
+            Tasks run highest priority first, so they get the first call on the
+            budget freed by the chunks received since the last pass.
+            
         """ 
         
-        tasks = self.recv_tasks.copy() # use a copy so we can remove tasks without 
-                                       # raising exceptions.
-                                       
-        for req_uuid, task in tasks.items():
+        # tasks can be removed by their own handlers, or cancelled
+        self.scheduler.retain(self.recv_tasks)
         
-            # call the timeout task if time's up
-                                                
-            #check if task has incoming data and process
-            if task[in_buffer]:
-                task[handle_recv_data](req_uuid, task) # may call task complete. 
+        expired = self.scheduler.order(self.deadlines.pop_expired())
+        
+        for req_uuid in expired:
             
-            # otherwise continue to run the task
-            task[action](req_uuid, task)
+            task = self.recv_tasks.get(req_uuid)
+            
+            # tasks with data waiting are handled below
+            if task is not None and not task[in_buffer]:
+                
+                task[action](req_uuid, task)
+                
+                self.schedule_task(req_uuid)
+        
+        # use a list of keys so we can remove tasks without raising exceptions.
+        for req_uuid in self.scheduler.order(
+            [r for r, t in self.recv_tasks.items() if t[in_buffer]]):
+        
+            task = self.recv_tasks.get(req_uuid)
+            
+            # a cancel may have removed this task during the pass
+            if task is None: continue
+            
+            task[handle_recv_data](req_uuid, task) # may call task complete. 
+            
+            # continue to run the task if it wasn't completed
+            if req_uuid in self.recv_tasks:
+                task[action](req_uuid, task)
+            
+            self.schedule_task(req_uuid)
+            
+    def schedule_task(self, req_uuid):
+        """ Register when the task for req_uuid next needs its action run
+        
+        Arguments: 
+            req_uuid    - string    - the unique request id associated with this request
+        Returns: 
+            Nothing:
+        Side Effects:
+            Sets or cancels the deadline for req_uuid in self.deadlines
+        Exceptions:
+            None
+        Description:
+            A task needs attention again when its current request times out, or
+            when its overall time out expires, whichever comes first. Tasks that
+            have been removed have their deadline cancelled.
+        """
+        
+        task = self.recv_tasks.get(req_uuid)
+        
+        if task is None:
+            
+            self.deadlines.cancel(req_uuid)
+            
+        else:
+            
+            task_data = task[data]
+            
+            self.deadlines.schedule_at(req_uuid, task_data[req_start_time] +\
+                min(task_data[req_to_duration], task_data[max_to_duration]))
             
                 
     def run(self):
@@ -1019,7 +3053,9 @@ class CRFileRequest(threading.Thread):
                 
                 #__________ Check the zmq mailbox! _____________________________________#
                 
-                events = dict(self.poller.poll(timeout = 5))
+                # sleep until there's a msg or the next task deadline is due
+                events = dict(self.poller.poll(
+                    timeout = self.deadlines.poll_timeout(IDLE_POLL_MAX)))
                 
                 # if we've got commands from the main thread, process them
                 if self.inproc in events:
@@ -1033,6 +3069,8 @@ class CRFileRequest(threading.Thread):
                         
                         self.handlers[msg.command](msg)
                         
+                if self.wake_recv in events:
+                    self.finish_delta_copies()
                         
                 # if we have msgs from the client's file server, like data chunks
                 # or a challenge resp msg, process them            
@@ -1111,7 +3149,13 @@ class CRFileRequest(threading.Thread):
         self.inproc.close(linger = 0)
         self.poller.unregister(self.router)
         self.poller.unregister(self.inproc) 
-        self.temp_dir.cleanup()
+        self.poller.unregister(self.wake_recv)
+        
+        if self.workers is not None:
+            self.workers.shutdown(wait = True)
+            
+        self.wake_recv.close()
+        self.wake_send.close()
         
         self.logger.info("CRFileRequest.run:" +l_sep+\
             "file requester shutting down..")
@@ -1201,6 +3245,83 @@ class CRFileRequest(threading.Thread):
                 self.inproc.send_json(conn_failed.serialize())
                 #TODO - what if the challenge times out, what do we do then?
     
+    def connect_swarm_peers(self, msg):
+        """ Connects to the file servers of the other render nodes in the session
+        
+        Arguments:
+            msg:        utils.MsgWrapper - CR message object with the attribute 
+                utils.swarm_nodes: list - [[machine_uuid, endpoints]] for each render
+                                        node the client is connected to.
+        Returns:
+            nothing
+        Side Effects:
+            connects the router socket to each new peer's file server, disconnects
+            from peers that are no longer in the list and forgets what they have
+        Exceptions:
+            None
+        Description:
+            Peers are connected without a challenge/response, a peer that isn't up 
+            yet simply won't answer FILE_HAVE requests and so won't be asked for any
+            chunks. 
+            
+            The list is the client's whole set of nodes. Peers are kept by their 
+            endpoints, since a node that reconnects runs a new session process on 
+            a new port and must be connected to again.
+        """
+        
+        if self.swarm_files is None: return
+        
+        nodes = {tuple([endpoint[address] for endpoint in node_endpoints]):
+                    (machine_uuid, node_endpoints)
+                    for machine_uuid, node_endpoints in msg.attributes[utils.swarm_nodes]
+                    if not machine_uuid == self.machine_uuid}
+        
+        ## PEERS THAT HAVE LEFT OR MOVED
+        for peer_addresses, machine_uuid in list(self.swarm_peers.items()):
+            
+            if peer_addresses in nodes: continue
+            
+            for peer_address in peer_addresses:
+                
+                try:
+                    self.router.disconnect(peer_address)
+                except zmq.ZMQError:
+                    pass
+                    
+            self.swarm_peers.pop(peer_addresses)
+            self.drop_swarm_peer(machine_uuid)
+            
+            self.logger.info("CRFileRequest.connect_swarm_peers:" +l_sep+\
+                "disconnected from swarm peer : " + machine_uuid)
+        
+        ## NEW PEERS
+        for peer_addresses, (machine_uuid, node_endpoints) in nodes.items():
+            
+            if peer_addresses in self.swarm_peers: continue
+            
+            for endpoint in node_endpoints:
+                
+                self.router.curve_serverkey = bytes(endpoint[public_key], 'utf-8')
+                self.router.connect(endpoint[address])
+                
+            self.swarm_peers[peer_addresses] = machine_uuid
+            
+            self.logger.info("CRFileRequest.connect_swarm_peers:" +l_sep+\
+                "connected to swarm peer : " + machine_uuid)
+                
+    def drop_swarm_peer(self, machine_uuid):
+        """ Stop asking a peer that has left for chunks of the files being received
+        """
+        
+        for task in self.recv_tasks.values():
+            
+            haves = task[data].get(peer_haves)
+            
+            if haves is None or haves.pop(machine_uuid, None) is None: continue
+            
+            task[data][peer_windows].pop(machine_uuid, None)
+            task[data][swarm_order] = None
+        
     def file_transf_req(self, msg):
         
         """ Create a new request to get file info and then get the file
@@ -1217,6 +3338,19 @@ class CRFileRequest(threading.Thread):
                     func            string      - what handler to run after complete
                     msg_attributes  dictionary  - arguments for the handler if any
                     router_id       bytes       - zmq identity of the peer to request from
+                    delta_base      string      - Optional, path of an older copy of
+                                                the file, chunks it has in common with
+                                                the requested file aren't transferred
+                    use_chunk_store bool        - Optional, take chunks from and add 
+                                                chunks to the chunk store
+                    use_swarm       bool        - Optional, fetch chunks from other 
+                                                render nodes receiving the same file
+                    resume_path     string      - Optional, directory to keep the
+                                                progress of the transfer in, so it 
+                                                can be resumed if it fails
+                    priority        int         - Optional, PRIORITY_INTERACTIVE, 
+                                                PRIORITY_SYNC (the default) or 
+                                                PRIORITY_PREFETCH
                     } 
             
         Returns:
@@ -1238,6 +3372,13 @@ class CRFileRequest(threading.Thread):
         func = msg.attributes[utils.command]
         msg_attributes = msg.attributes
         router_id = msg.attributes[utils.node_uuid]
+        base_path = msg.attributes.get(utils.delta_base)
+        use_store = self.chunk_store is not None and\
+            msg.attributes.get(utils.use_chunk_store, False)
+        swarm = self.swarm_files is not None and\
+            msg.attributes.get(utils.use_swarm, False)
+        resume_dir = msg.attributes.get(utils.resume_path)
+        transfer_priority = msg.attributes.get(utils.priority, PRIORITY_SYNC)
         t_uuid = msg.t_uuid    
         s_uuid = msg.s_uuid
         
@@ -1249,8 +3390,16 @@ class CRFileRequest(threading.Thread):
         
         file_req_data = {   
             file_id                 :fid,
-            all_offsets             :[],
-            offsets                 :[],
+            chunk_map               :None,
+            delta_base              :base_path,
+            use_chunk_store         :use_store,
+            signatures              :None,
+            use_swarm               :swarm,
+            pieces                  :None,
+            codec                   :b'',
+            resume_state            :CRTransferState(resume_dir, router_id, fid)\
+                                        if resume_dir else None,
+            priority                :transfer_priority,
             f_write_to              :file_path,
             msg_attribs             :msg.attributes,
             peer_id                 :router_id,
@@ -1263,17 +3412,13 @@ class CRFileRequest(threading.Thread):
             req_start_time          :0.0,
             req_to_duration         :5.0,
             max_to_duration         :30,
-            temp_file               :os.path.join(self.temp_dir.name, 
-                                                s_uuid.decode('utf-8') +\
-                                                 "_" +\
-                                                os.path.basename(file_path)
-                                                )
+            temp_file               :file_path + "." + s_uuid.decode('utf-8') +\
+                                                RESUME_PART
                                     
-                                                # temp_file will be a temp location, 
-                                                # consisting of a folder in the OS's 
-                                                # temp dir with name of the sess_uuid
-                                                # and the file name desired to be written
-                                                # to. Kinda avoids trouble this way.
+                                                # temp_file is next to where the file
+                                                # is going, named with the sess_uuid,
+                                                # so once it's complete it can be
+                                                # renamed into place without a copy.
                         
                         
                         }
@@ -1314,6 +3459,10 @@ class CRFileRequest(threading.Thread):
             
             tsk[cancel](req_uuid, tsk)
             
+        # transfers still copying from an older file are dropped once the copy
+        # is done, see finish_delta_copies
+        self.delta_copies.clear()
+            
         self.logger.debug("CRFileRequest.cancel_all_tasks" + l_sep +\
             "Cancelled all tasks")      
 
@@ -1349,29 +3498,38 @@ class CRFileRequest(threading.Thread):
         
         ## CHECK TIMEOUTS AND SEND REQ IF REQURED
         
+        # ask for signatures if we have an older copy or the chunk store to take 
+        # chunks from, and for chunk digests if swarm peers might send us chunks
+        flags = []
+        
+        if task[data][use_chunk_store] or\
+            (task[data][delta_base] and os.path.exists(task[data][delta_base])):
+            flags.append(SIGS)
+            
+        # resuming also needs the digests, to tell if the file has changed
+        if task[data][use_swarm] or task[data][resume_state] is not None:
+            flags.append(PIECES)
+            
+        if self.codecs:
+            flags.append(CODECS_OFFERED + b'|'.join(self.codecs))
+            
+        info_type = b','.join(flags)
+        
+        info_request = [bytes(task[data][peer_id], 'utf-8'),
+                        b"FILE_INFO",
+                        bytes(task[data][file_id], 'utf-8'),
+                        info_type,
+                        req_uuid
+                        ]
+        
         if task[data][req_start_time] == 0.0:
             task[data][req_start_time] = task[start_time]
             
             #send request for file info
-            info_request = [bytes(task[data][peer_id], 'utf-8'),
-                            b"FILE_INFO",
-                            bytes(task[data][file_id], 'utf-8'),
-                            b'',
-                            req_uuid
-                            ]
-                        
-        
             self.router.send_multipart(info_request)
             
         elif timed_out(task[data][req_start_time], task[data][req_to_duration]):  
             
-            info_request = [bytes(task[data][peer_id], 'utf-8'),
-                            b"FILE_INFO",
-                            bytes(task[data][file_id], 'utf-8'),
-                            b'',
-                            req_uuid
-                            ]
-                            
             self.router.send_multipart(info_request)
             
             task[data][req_start_time] = time.perf_counter()
@@ -1427,6 +3585,15 @@ class CRFileRequest(threading.Thread):
             
             file_size = int.from_bytes(msg[3], byteorder='big', signed=False)
             
+            if len(msg) > 5 and msg[5]:
+                task[data][signatures] = msg[5]
+                
+            if len(msg) > 6 and msg[6]:
+                task[data][pieces] = msg[6]
+                
+            if len(msg) > 7 and msg[7] in CODECS:
+                task[data][codec] = msg[7]
+            
             continue
             
         # if we did get the file_size data, then complete this task
@@ -1436,91 +3603,358 @@ class CRFileRequest(threading.Thread):
                 time.perf_counter() - task[data][req_start_time]
                                                 )
             task[data][req_start_time] = time.perf_counter()
-            task[data][all_offsets] = [i * CHUNK_SIZE \
-                for i in range(0, ceil(file_size / CHUNK_SIZE)) ]
+            task[data][chunk_map] = CRChunkMap(file_size)
+            
+            task[data][f_size] = file_size
+            task[complete](req_uuid, task)
+            
+            self.logger.info("CRFileRequest.handle_rcvd_file_info; "+\
+                                "file size on server is : " +\
+                                str(file_size) + " for " +\
+                                task[data][file_id])
+            
+        else:
+            
+            recv_fail_msg = MsgWrapper(message = utils.recv_fail,
+            t_uuid = task[data][task_id],
+            s_uuid = task[data][session_id],
+            attributes = {utils.file_path:task[data][f_write_to]})
+                
+            self.inproc.send_json(recv_fail_msg.serialize())
+            
+            self.logger.warning("CRFileRequest.handle_rcvd_file_info; "+\
+                                "No file size data received for : " +\
+                                task[data][file_id])
+        
+        
+    def file_info_recv_complete(self, req_uuid, task):
+        """ Completes and removes a request for file info, creates a new file request
+        """
+        
+        ## CREATE FILE TRANSFER REQUEST
+        dynamic_timeout_max = 30.0 # start with 30s, if we get timeouts, increase
+        
+        # nodes receiving the same file get the same chunk digests, so a hash of 
+        # them identifies the file, to the swarm and to a resumed transfer
+        if task[data][pieces]:
+            file_hash = hash_algorithm(task[data][pieces], 
+                digest_size = SIG_DIGEST_SIZE).hexdigest()
+        else:
+            file_hash = None
+            
+        swarm = file_hash if task[data][use_swarm] else None
+        
+        ## RESUME AN EARLIER ATTEMPT
+        # without a hash we can't tell if the file has changed, so can't resume
+        resume = task[data][resume_state] if file_hash else None
+        saved = None
+        
+        if resume is not None:
+            
+            saved = resume.load(task[data][f_size], file_hash)
+            
+            # the file has changed, or this is the first attempt
+            if saved is None:
+                resume.remove()
+                
+            task[data][temp_file] = resume.part_path
+        
+        # stop serving an earlier copy of this file to swarm peers before removing it
+        if self.swarm_files is not None:
+            self.swarm_files.remove_path(task[data][temp_file])
+            
+        if saved is not None:
+            
+            file = open(task[data][temp_file], "r+b", buffering = 0)
+            
+            restored = task[data][chunk_map].restore(saved)
+            
+            self.logger.info("CRFileRequest.file_info_recv_complete:" + l_sep +\
+                "Resuming transfer of " + task[data][file_id] + ", " +\
+                str(restored) + " of " + str(task[data][chunk_map].n_chunks) +\
+                " chunks were received by an earlier attempt")
+            
+        else:
+            
+            if (os.path.exists(task[data][temp_file])) :
+                os.remove(task[data][temp_file])#TODO: Will cause winerr 32 for 
+                                            # multiple file requests of the same file 
+                                            # (user button bashes the "resync" button
+                                                
+                msg_str = ("CRFileRequest.file_info_recv_complete:" + l_sep + \
+                    "Deleting file : " + task[data][f_write_to])
+                self.logger.info(msg_str)
+                
+            os.makedirs(os.path.dirname(task[data][temp_file]), exist_ok = True)
+            
+             #NOTE: open mode must not have 'a' in its string as this mode
+                # will ignore seeks on windows, possibly unix as well.    
+            file = open(task[data][temp_file], "wb", buffering = 0)
+            
+            # a resumed transfer also checks the partly received file is full size
+            preallocate(file, task[data][f_size])
+        
+        file_req_data = {   
+            file_id                 :task[data][file_id],
+            chunk_map               :task[data][chunk_map],
+            f_write_to              :task[data][f_write_to],
+            msg_attribs             :task[data][msg_attribs],
+            peer_id                 :task[data][peer_id],
+            task_id                 :task[data][task_id],
+            session_id              :task[data][session_id],
+            f_handle                :file,
+            f_size                  :task[data][f_size],
+            round_trip_time         :task[data][round_trip_time],
+            file_total_rcvd         :0,
+            chunks_rcvd             :0,
+            req_start_time          :0.0,
+            req_to_duration         :30.0,
+            max_to_duration         :30.0,
+            rcvd_time               :0.0,
+            temp_file               :task[data][temp_file],
+            'doubles'               :{},
+            'bad_hash_chunks'       :{},
+            timeout_retries         :TIMEOUT_RETRIES,
+            prog_sent_time          :0.0,
+            signatures              :task[data][signatures],
+            use_chunk_store         :task[data][use_chunk_store],
+            bytes_reused            :0,
+            window                  :CRTransferWindow(30.0,
+                                        initial_rtt = max(
+                                            task[data][round_trip_time], 
+                                            default = None)),
+            swarm_id                :swarm,
+            pieces                  :task[data][pieces] if swarm else None,
+            resume_state            :resume,
+            file_hash               :file_hash,
+            peer_haves              :{},
+            peer_windows            :{},
+            have_sent_time          :0.0,
+            swarm_order             :None,
+            swarm_cursor            :0,
+            codec                   :task[data][codec],
+            bytes_on_wire           :0,
+            priority                :task[data][priority]
+            
+            }
+            
+        self.recv_tasks.pop(req_uuid)
+        
+        ## REUSE CHUNKS WE ALREADY HAVE
+        # finding the chunks of an older copy of the file means hashing all of it, 
+        # which takes seconds for a large file, so that's done on the worker threads
+        base_path = task[data][delta_base]
+        
+        if task[data][signatures] and base_path and os.path.exists(base_path):
+            
+            self.start_delta_copy(req_uuid, file_req_data, base_path)
+            
+        else:
+            
+            self.start_file_data(file_req_data, [])
+            
+    def start_file_data(self, task_data, reused):
+        """ Add the task that requests the chunks of a file we don't have yet
+        
+        Arguments:
+            task_data   - dict      - the data of the file data task
+            reused      - list      - [(offset, length), ...] ranges of the file
+                                        already copied from an older copy of it
+        Returns:
+            nothing
+        Side Effects:   
+            Copies chunks from the chunk store, publishes the file to swarm peers 
+            and adds the file data task to self.recv_tasks
+        Exceptions:
+            None        
+        """
+        
+        if task_data[signatures]:
+            task_data[bytes_reused] = self.copy_local_chunks(task_data, reused)
+            
+        if task_data[swarm_id]:
+            
+            task_data[f_handle].flush()
+            self.swarm_files.publish(task_data[swarm_id], task_data[temp_file], 
+                task_data[chunk_map].states)
+                            
+        
+        ## CREATE THE FILE REQUEST TASK STRUCTURE
+        
+        task = {
+            action                  :self.request_file_data,
+            handle_recv_data        :self.handle_rcvd_data,
+            complete                :self.file_recv_complete,
+            cancel                  :self.cancel_file_recv,
+            data                    :task_data,
+            in_buffer               :[]
+            
+            }
+            
+        ## ADD THE FILE REQUEST TASK 
+        self.scheduler.add(self.add_recv_task(task), task_data[priority], 
+            task_data[peer_id])
+        
+    def start_delta_copy(self, req_uuid, task_data, base_path):
+        """ Copy the chunks of an older copy of the file on the worker threads
+        
+        Arguments:
+            req_uuid    - string    - the id of the file info request
+            task_data   - dict      - the data of the file data task
+            base_path   - string    - path of the older copy of the file
+        Returns:
+            nothing
+        Side Effects:   
+            Starts the worker threads if they're not running
+        Exceptions:
+            None        
+        Description:
+            Nothing else touches the file being received until the copy is done,
+            finish_delta_copies then starts the transfer from this thread.
+        """
+        
+        if self.workers is None:
+            self.workers = ThreadPoolExecutor(max_workers = COMPRESS_WORKERS)
+            
+        self.delta_copies.add(req_uuid)
+        
+        def copy_done(future):
+            
+            self.copied.put((req_uuid, task_data, future))
+            
+            try:
+                self.wake_send.send(b'\x00')
+            except OSError:
+                # buffer's full, this thread already has a wake up waiting
+                pass
+                
+        self.workers.submit(self.copy_from_delta_base, base_path, 
+            unpack_signatures(task_data[signatures]), 
+            task_data[f_handle]).add_done_callback(copy_done)
+            
+    def finish_delta_copies(self):
+        """ Start the transfers whose copies from an older file are done """
+        
+        try:
+            while self.wake_recv.recv(4096): pass
+        except OSError:
+            pass
+            
+        while True:
+            
+            try:
+                req_uuid, task_data, future = self.copied.get_nowait()
+            except queue.Empty:
+                break
+                
+            # cancelled while the copy was being made
+            if not req_uuid in self.delta_copies:
+                
+                task_data[f_handle].close()
+                
+                continue
+                
+            self.delta_copies.discard(req_uuid)
+            
+            try:
+                
+                reused = future.result()
+                
+            except Exception as e:
+                # whatever was written is requested again
+                self.logger.warning("CRFileRequest.finish_delta_copies:" + l_sep +\
+                    "Could not reuse the chunks of an older copy of " +\
+                    task_data[file_id] + " : " + str(e))
+                    
+                reused = []
+                
+            self.start_file_data(task_data, reused)
+        
+    def copy_local_chunks(self, task_data, reused):
+        """ Mark the chunks of the requested file we already have as received
+        
+        Arguments:
+            task_data   - dict      - the data of a file data task for a file 
+                                        whose signatures were received
+            reused      - list      - [(offset, length), ...] ranges of the file
+                                        already copied from an older copy of it
+        Returns:
+            reused      - int       - number of bytes copied
+        Side Effects:   
+            Writes data to task_data[f_handle] and marks the chunks that no longer 
+            need to be requested in task_data[chunk_map].
+        Exceptions:
+            None        
+        Description:
+            Chunks are taken from the older copy of the file first, see 
+            copy_from_delta_base, then from the chunk store. Matching chunks are 
+            copied into place locally, so only the parts of the file that have 
+            changed are transferred. The blake2b digests of the chunks confirm 
+            the data is the same, a chunk that is copied but doesn't cover a whole 
+            CHUNK_SIZE chunk is still requested.
+        """
+        
+        if task_data[use_chunk_store]:
             
-            task[data][f_size] = file_size
-            task[complete](req_uuid, task)
+            remote_sigs = unpack_signatures(task_data[signatures])
+            copied = set([r[0] for r in reused])
             
-            self.logger.info("CRFileRequest.handle_rcvd_file_info; "+\
-                                "file size on server is : " +\
-                                str(file_size) + " for " +\
-                                task[data][file_id])
+            reused.extend(self.chunk_store.copy_chunks(
+                [sig for sig in remote_sigs if not sig[0] in copied], 
+                task_data[f_handle]))
             
-        else:
+            reused.sort()
             
-            recv_fail_msg = MsgWrapper(message = utils.recv_fail,
-            t_uuid = task[data][task_id],
-            s_uuid = task[data][session_id],
-            attributes = {utils.file_path:task[data][f_write_to]})
-                
-            self.inproc.send_json(recv_fail_msg.serialize())
+        chunks = task_data[chunk_map].mark_local(reused)
+        reused_bytes = sum([r[1] for r in reused])
+        
+        self.logger.info("CRFileRequest.copy_local_chunks:" + l_sep +\
+            "Reused " + str(reused_bytes) + " bytes, " + str(chunks) + " of " +\
+            str(task_data[chunk_map].n_chunks) + " chunks won't be transferred")
             
-            self.logger.warning("CRFileRequest.handle_rcvd_file_info; "+\
-                                "No file size data received for : " +\
-                                task[data][file_id])
+        return reused_bytes
         
+    def copy_from_delta_base(self, base_path, remote_sigs, file):
+        """ Copy chunks that match remote_sigs from the file at base_path into file
         
-    def file_info_recv_complete(self, req_uuid, task):
-        """ Completes and removes a request for file info, creates a new file request
+        Returns [(offset, length), ...] the ranges of file that were written. Runs 
+        on the worker threads, see start_delta_copy. Signatures for the older copy
+        are calculated here and matched with those sent by the file server.
         """
         
-        ## CREATE FILE TRANSFER REQUEST
-        dynamic_timeout_max = 30.0 # start with 30s, if we get timeouts, increase
-        if (os.path.exists(task[data][temp_file])) :
-            os.remove(task[data][temp_file])#TODO: Will cause winerr 32 for multiple
-                                            # file requests of the same file (user button
-                                            # bashes the "resync" button
-                                            
-            msg_str = ("CRFileRequest.file_info_recv_complete:" + l_sep + \
-                "Deleting file : " + task[data][f_write_to])
-            self.logger.info(msg_str)
-            
-         #NOTE: open mode must not have 'a' in its string as this mode
-            # will ignore seeks on windows, possibly unix as well.    
-        file = open(task[data][temp_file], "wb")
+        reused = []
         
-        file_req_data = {   
-            file_id                 :task[data][file_id],
-            all_offsets             :task[data][all_offsets],
-            offsets                 :[],
-            f_write_to              :task[data][f_write_to],
-            msg_attribs             :task[data][msg_attribs],
-            peer_id                 :task[data][peer_id],
-            task_id                 :task[data][task_id],
-            session_id              :task[data][session_id],
-            f_handle                :file,
-            f_size                  :task[data][f_size],
-            round_trip_time         :task[data][round_trip_time],
-            file_total_rcvd         :0,
-            chunks_rcvd             :0,
-            req_start_time          :0.0,
-            req_to_duration         :30.0,
-            max_to_duration         :30.0,
-            temp_file               :task[data][temp_file],
-            'doubles'               :{},
-            'bad_hash_chunks'       :{},
-            timeout_retries         :TIMEOUT_RETRIES
+        try:
             
-            }
-                            
-        
-        ## CREATE THE FILE REQUEST TASK STRUCTURE
+            base_view = CRFileView(base_path)
+            
+        except (OSError, ValueError) as e:
         
-        task = {
-            action                  :self.request_file_data,
-            handle_recv_data        :self.handle_rcvd_data,
-            complete                :self.file_recv_complete,
-            cancel                  :self.cancel_file_recv,
-            data                    :file_req_data,
-            in_buffer               :[]
+            self.logger.warning("CRFileRequest.copy_from_delta_base:" + l_sep +\
+                "Could not open " + str(base_path) + ", its chunks won't be "+\
+                "reused : " + str(e))
+                
+            return reused
             
-            }
+        try:
             
-        ## ADD THE FILE REQUEST TASK 
-        self.add_recv_task(task)
-        
-        self.recv_tasks.pop(req_uuid)
+            local_chunks = {sig[2]:sig for sig in cdc_signatures(base_view.view)}
+            
+            for offset, length, digest in remote_sigs:
+                
+                local = local_chunks.get(digest)
+                
+                if local is not None and local[1] == length:
+                    
+                    write_at(file, base_view.chunk(local[0], length), offset)
+                    
+                    reused.append((offset, length))
+                    
+        finally:
+            
+            base_view.close()
+            
+        return reused
         
     def cancel_file_info_req(self, req_uuid, task):
         """ Cancels a request to get file info
@@ -1548,142 +3982,334 @@ class CRFileRequest(threading.Thread):
             Makes a file request and sends it to the peer identified in the data section
             of the task object. 
             
+            Chunk requests are sent whenever the task's CRTransferWindow has credit,
+            rather than in fixed batches, so the peer is kept busy while earlier 
+            chunks are still arriving. Requests outstanding for longer than the 
+            window's retransmit timeout are assumed lost and are requested again.
+            
+            The state of each chunk and the requests in flight are kept in the
+            task's CRChunkMap, a request can cover several contiguous chunks when
+            the window has grown the chunk size.
+            
             """                
         
-        offs_append = task[data][offsets].append
-        offs_reverse= task[data][offsets].reverse
-        offs_copy = task[data][offsets].copy
-        
-        new_offs_req = []
-        new_offs_req_app = new_offs_req.append
-        
+        task_data = task[data]
+        c_map = task_data[chunk_map]
+        wnd = task_data[window]
+        now = time.perf_counter()
         
-        file = task[data][f_handle]
+        # everything may have come from an older copy of the file
+        if c_map.complete:
+            
+            task[complete](req_uuid, task)
+            
+            return
         
+        if task_data[rcvd_time] == 0.0:
+            task_data[rcvd_time] = now
+            
         ## CHECK OUTSTANDING OFFSETS
-        # If there are outstanding offsets, then exit early and wait for them 
-        # to arrives
+        # Requests that have been waiting longer than the retransmit timeout are
+        # dropped so they'll be requested again below. All the requests to a peer 
+        # that expire in a pass count as one loss event for that peer's window.
         
-        if task[data][req_start_time] == 0.0:
-            task[data][req_start_time] = task[start_time]
+        rto_of = lambda source: self.transfer_window(task_data, source).rto
+        expired = c_map.expire(now, rto_of)
         
-        if not task[data][offsets] or\
-            timed_out(task[data][req_start_time], task[data][req_to_duration]):
-           
-            all_offs_pop = task[data][all_offsets].pop
-            router_id = task[data][peer_id]
-            fid = task[data][file_id]
-            s_uuid = task[data][session_id]
-            r_trip_time = task[data][round_trip_time]
-            offsets_requested = []
-            offsets_requested_append = offsets_requested.append
-            
-            credit = min(PIPELINE, len(task[data][all_offsets]))
+        for source in set([req[3] for offset, req in expired]):
             
-            while credit > 0:
-                
-                offset = all_offs_pop()
-                
-                # append both the required offset and chunk size
-                # Add to the list we'll actually send, we do re-request 
-                # offsets that are already in [data][offsets] just
-                # in case their packet got dropped. Not doing this
-                # risks that the offset would never be re-requested and the
-                # file transfer could never finish.
-                offsets_requested_append([offset, CHUNK_SIZE])
-                
-                # Add to the list of offsets we've requested just for this
-                # request
-                new_offs_req_app(offset)
-                
-                #don't add offsets to the list we're currently requesting, if 
-                # they are already on it. It makes the list grow and we 
-                # request more data than we need to, in extreme cases the 
-                # file transfer progress can go backwards.
-                if not offset in task[data][offsets]:
-                
-                    # Add to the list of offsets we're tracking as requested
-                    offs_append(offset)
-                
-                
-                credit -= 1
-            
-            request = [
-                bytes(router_id, 'utf-8'),
-                b'FILE_DATA',
-                bytes(fid, 'utf-8'),                
-                pickle.dumps(offsets_requested),
-                req_uuid,
-                ]
+            self.transfer_window(task_data, source).on_timeout()
             
-            self.router.send_multipart(request)
+        ## REQUEST MORE CHUNKS
+        
+        if task_data[swarm_id]:
             
+            self.request_swarm_chunks(req_uuid, task_data, now)
             
-            ## PUT REQUESTED CHUNKS TO END OF LIST
-            # This gives any delayed chunks a chance to arrive later on 
-            # without requesting them repeatedly extending our timeout
+        else:
             
-            new_offs_req.reverse()
-            temp_offsets = new_offs_req.copy()
-            temp_offsets.extend(task[data][all_offsets])
-            task[data][all_offsets] = temp_offsets.copy()
+            credit = self.scheduler.credit(req_uuid, wnd.credit(len(c_map.in_flight)),
+                wnd.chunk_size, c_map.in_flight_bytes)
             
-            #set timeout durations for this task
-            if len(r_trip_time) > 2:
-                
-                # Set the timeout to the mean plus 2 stdevs to cover 97% of 
-                # round trip times
-                dynamic_timeout =  mean(r_trip_time) + 6 * stdev(r_trip_time)
-                
-                task[data][req_to_duration] = dynamic_timeout
+            if credit:
                 
-            elif r_trip_time:
-            
-                dynamic_timeout =  10#5 * max(r_trip_time) 
+                offsets_requested = c_map.next_requests(
+                    credit, wnd.chunk_mult, now, task_data[peer_id])
                 
-                task[data][req_to_duration] = dynamic_timeout
+                if offsets_requested:
                 
-            else:
+                    request = [
+                        bytes(task_data[peer_id], 'utf-8'),
+                        b'FILE_DATA',
+                        bytes(task_data[file_id], 'utf-8'),                
+                        pickle.dumps(offsets_requested),
+                        req_uuid,
+                        ]
+                        
+                    if task_data[codec]:
+                        request.append(task_data[codec])
+                    
+                    self.router.send_multipart(request)
+                    
+        # the task is due again when its first request times out, or when its time
+        # to ask swarm peers what they have.
+        first_timeout = c_map.next_timeout(rto_of)
+        due = [] if first_timeout is None else [first_timeout]
+        
+        if task_data[swarm_id]:
+            due.append(task_data[have_sent_time] + SWARM_HAVE_INTERVAL)
             
-                task[data][req_start_time] = task[start_time]
-                 
+        task_data[req_start_time] = now
+        task_data[req_to_duration] = max(min(due, default = now + wnd.rto) - now, 0.0)
             
-        if timed_out(task[data][req_start_time], task[data][max_to_duration]):
+        if timed_out(task_data[rcvd_time], task_data[max_to_duration]):
             
             
-            if task[data][timeout_retries]:
-                task[data][timeout_retries] -= 1
+            if task_data[timeout_retries]:
+                task_data[timeout_retries] -= 1
             
-                task[data][req_start_time] = time.perf_counter()
+                task_data[rcvd_time] = time.perf_counter()
                 self.logger.warning("Timed out with " +\
-                    str(task[data][timeout_retries]) + \
+                    str(task_data[timeout_retries]) + \
                     " tries left while receiving "+\
-                    task[data][f_write_to])
+                    task_data[f_write_to])
                 
             else:
             ## REQUEST FAILED, NOTIFY CALLER
                 recv_fail_msg = MsgWrapper(message = utils.recv_fail,
-                    t_uuid = task[data][task_id],
-                    s_uuid = task[data][session_id],
-                    attributes = {utils.file_path:task[data][f_write_to]})
+                    t_uuid = task_data[task_id],
+                    s_uuid = task_data[session_id],
+                    attributes = {utils.file_path:task_data[f_write_to]})
                 
                 self.logger.warning(
                     "Receiving data timed out for " +\
-                    task[data][file_id] +\
-                    ", doubled chunks: " + str(task[data]['doubles']) +\
+                    task_data[file_id] +\
+                    ", doubled chunks: " + str(task_data['doubles']) +\
                     ", chunks not transferred: " +\
-                     str(len(task[data][all_offsets])) +\
-                    " out of " + str(task[data][f_size] / CHUNK_SIZE) ) 
+                     str(c_map.remaining) +\
+                    " out of " + str(c_map.n_chunks) +\
+                    ", " + wnd.stats()) 
                     
                     
                 self.inproc.send_json(recv_fail_msg.serialize())
                 
+                # keep what we've got so the next attempt can carry on from here
+                if task_data[resume_state] is not None:
+                    self.save_transfer_state(task_data)
+                    
+                task_data[f_handle].close()
+                
+                self.discard_part_file(task_data)
+                
                 #remove this task
                 self.recv_tasks.pop(req_uuid)
                 
+    def transfer_window(self, task_data, source):
+        """ Return the CRTransferWindow for requests in task_data sent to source """
+        
+        if source is None or source == task_data[peer_id]:
+            return task_data[window]
+            
+        windows = task_data[peer_windows]
+        
+        if not source in windows:
+            windows[source] = CRTransferWindow(task_data[max_to_duration])
+            
+        return windows[source]
+        
+    def request_swarm_chunks(self, req_uuid, task_data, now):
+        """ Request chunks from the client and from other render nodes, rarest first
+        
+        Arguments:
+            req_uuid    - string    - the unique request id associated with this request
+            task_data   - dict      - the data of a swarm file data task
+            now         - float     - the current time
+        Returns:
+            nothing
+        Side Effects:   
+            Sends FILE_HAVE requests to swarm peers and FILE_DATA requests to peers 
+            and the client.
+        Exceptions:
+            None        
+        Description:
+            Every SWARM_HAVE_INTERVAL each swarm peer is asked which chunks of the 
+            file it has verified, and the missing chunks are sorted by how many 
+            peers have them, rarest first. Ties are broken randomly, so each node 
+            starts on different chunks and has something to trade with the others.
+            
+            A chunk is requested from the peer holding it that has the most credit 
+            in its window. Chunks no peer has yet come from the client, and chunks
+            only held by peers whose windows are full wait for them. The client 
+            then only has to upload each chunk about once, however many nodes there
+            are.
+        """
+        
+        c_map = task_data[chunk_map]
+        states = c_map.states
+        haves = task_data[peer_haves]
+        seed = task_data[peer_id]
+        missing = CRChunkMap.MISSING
+        received = CRChunkMap.RECEIVED
+        
+        ## ASK PEERS WHAT THEY HAVE
+        if timed_out(task_data[have_sent_time], SWARM_HAVE_INTERVAL):
+            
+            for router_id in self.swarm_peers.values():
                 
-        else:
-            pass
+                self.router.send_multipart([bytes(router_id, 'utf-8'), FILE_HAVE,
+                    bytes(task_data[swarm_id], 'utf-8'), b'', req_uuid])
+                    
+            task_data[have_sent_time] = now
+            
+        if task_data[swarm_order] is None:
+            
+            task_data[swarm_order] = self.swarm_chunk_order(c_map, haves)
+            task_data[swarm_cursor] = 0
+            
+        ## CREDIT FOR EACH SOURCE
+        in_flight = c_map.in_flight_count
+        
+        credit = {source:self.transfer_window(task_data, source).credit(
+            in_flight.get(source, 0)) for source in [seed] + list(haves)}
+        
+        ## CHOOSE CHUNKS AND SOURCES
+        order = task_data[swarm_order]
+        cursor = task_data[swarm_cursor]
+        
+        # chunks at the front that are no longer missing needn't be looked at again
+        # until the order is rebuilt.
+        while cursor < len(order) and not states[order[cursor]] == missing:
+            cursor += 1
+            
+        task_data[swarm_cursor] = cursor
+        
+        requests = {}
+        total_credit = self.scheduler.credit(req_uuid, sum(credit.values()), 
+            CHUNK_SIZE, c_map.in_flight_bytes)
+        
+        for index in order[cursor:]:
+            
+            if not total_credit: break
+            
+            if not states[index] == missing: continue
+            
+            holders = [p for p, have in haves.items() if have[index] == received]
+            
+            if holders:
+                
+                source = max(holders, key = credit.get)
+                
+                if not credit[source]: continue
+                
+            elif credit[seed]:
+                source = seed
+                
+            else:
+                continue
+                
+            offset = c_map.request_chunk(index, now, source)
+            
+            requests.setdefault(source, []).append([offset, CHUNK_SIZE])
+            credit[source] -= 1
+            total_credit -= 1
+            
+        for source, offsets_requested in requests.items():
+            
+            fid = task_data[file_id] if source == seed else task_data[swarm_id]
+            
+            request = [
+                bytes(source, 'utf-8'),
+                b'FILE_DATA',
+                bytes(fid, 'utf-8'),
+                pickle.dumps(offsets_requested),
+                req_uuid]
+                
+            if task_data[codec]:
+                request.append(task_data[codec])
+                
+            self.router.send_multipart(request)
+                
+    def swarm_chunk_order(self, c_map, haves):
+        """ Return the indices of missing chunks, rarest first, ties in random order
+        
+        Arguments:
+            c_map       - CRChunkMap- the chunk states of the file being received
+            haves       - dict      - {router_id:bytearray} the chunk states each 
+                                        swarm peer last told us it has
+        Returns:
+            order       - list      - chunk indices
+        """
+        
+        if numpy is not None:
+            
+            states = numpy.frombuffer(bytes(c_map.states), dtype = numpy.uint8)
+            availability = numpy.zeros(c_map.n_chunks)
+            
+            for have in haves.values():
+                availability += numpy.frombuffer(bytes(have), dtype = numpy.uint8) ==\
+                    CRChunkMap.RECEIVED
+                    
+            missing = numpy.flatnonzero(states == CRChunkMap.MISSING)
+            
+            # availability is whole numbers, so adding a random fraction only
+            # reorders chunks that are equally rare.
+            keys = availability[missing] + numpy.random.random_sample(len(missing))
+            
+            return missing[numpy.argsort(keys)].tolist()
+            
+        received = CRChunkMap.RECEIVED
+        
+        order = [(sum([have[i] == received for have in haves.values()]), 
+            random.random(), i) for i, state in enumerate(c_map.states)
+                if state == CRChunkMap.MISSING]
+        
+        order.sort()
+        
+        return [i for availability, tie, i in order]
+        
+    def update_peer_have(self, task_data, source, packed):
+        """ Record which chunks a swarm peer says it has """
+        
+        try:
+            states = zlib.decompress(packed)
+        except zlib.error:
+            return
+            
+        n_chunks = task_data[chunk_map].n_chunks
+        
+        # a peer that hasn't started on this file yet has nothing
+        if not states:
+            states = bytes(n_chunks)
+            
+        if len(states) == n_chunks:
+            
+            task_data[peer_haves][source] = bytearray(states)
+            task_data[swarm_order] = None
+            
+    def drop_peer_chunk(self, haves, source, offset):
+        """ Stop asking source for the chunk at offset until it tells us it has it """
+        
+        have = haves.get(source)
+        
+        if have is not None:
+            have[offset // CHUNK_SIZE] = CRChunkMap.MISSING
+            
+    def check_pieces(self, task_pieces, c_map, offset, f_data):
+        """ Return True if each chunk in f_data matches the digest the client sent """
+        
+        f_view = memoryview(f_data)
+        
+        for index in c_map.chunk_range(offset, len(f_data)):
+            
+            start = index * CHUNK_SIZE - offset
+            
+            if not hash_algorithm(f_view[start:start + CHUNK_SIZE], 
+                digest_size = SIG_DIGEST_SIZE).digest() ==\
+                task_pieces[index * SIG_DIGEST_SIZE:(index + 1) * SIG_DIGEST_SIZE]:
+                
+                return False
+                
+        return True
         
     def handle_rcvd_data(self, req_uuid, task):
         """
@@ -1703,32 +4329,65 @@ class CRFileRequest(threading.Thread):
         perf_counter = time.perf_counter
         
         file = task[data][f_handle]
-        f_seek = file.seek
-        f_write = file.write
         
-        round_trip = []
-        file_size = task[data][f_size]
         r_trip_time_append = task[data][round_trip_time].append
         router_id = task[data][peer_id]
         t_uuid = task[data][task_id]
         s_uuid = task[data][session_id]
         buff_pop = task[in_buffer].pop
         
-        
-        rt_append = round_trip.append
-        off_req_remove = task[data][offsets].remove
-        all_off_req_remove = task[data][all_offsets].remove
+        c_map = task[data][chunk_map]
+        wnd = task[data][window]
+        task_pieces = task[data][pieces]
+        haves = task[data][peer_haves]
+        written = False
         
         
         while task[in_buffer]:
             
             msg = buff_pop()
             
-            identity, command, bfid, boffset, req_uuid, f_data, bhash = msg
+            source = msg[0].decode('utf-8')
+            
+            ## SWARM PEER MSGS
+            if msg[1] == FILE_HAVE:
+                
+                self.update_peer_have(task[data], source, msg[3])
+                
+                continue
+            
+            identity, command, bfid, boffset, req_uuid, f_data, bhash = msg[:7]
             
             rcvd_offset = loads(boffset)
             
-            if not hash_algorithm(f_data).digest() == bhash:
+            if command == NO_DATA:
+                
+                # the peer doesn't have this chunk after all, ask someone else
+                c_map.mark_failed(rcvd_offset)
+                self.drop_peer_chunk(haves, source, rcvd_offset)
+                
+                continue
+                
+            task[data][bytes_on_wire] += len(f_data)
+            
+            # chunks that wouldn't compress are sent raw with an empty codec
+            if len(msg) > 7 and msg[7]:
+                
+                try:
+                    f_data = CODECS[msg[7]][1](f_data)
+                except Exception:
+                    # fails the hash check below and is requested again
+                    f_data = b''
+            
+            # in a swarm, chunks must also match the digests the client sent, 
+            # the sender's own hash only shows the chunk arrived as it was sent
+            if not hash_algorithm(f_data).digest() == bhash or (task_pieces and\
+                not self.check_pieces(task_pieces, c_map, rcvd_offset, f_data)):
+                
+                # make the chunk available to be requested again
+                c_map.mark_failed(rcvd_offset)
+                self.transfer_window(task[data], source).on_bad_hash()
+                self.drop_peer_chunk(haves, source, rcvd_offset)
                 
                 if rcvd_offset in task[data]['bad_hash_chunks']:
                 
@@ -1749,80 +4408,90 @@ class CRFileRequest(threading.Thread):
                 
                 
                 
-                f_seek(rcvd_offset, SEEK_SET)
-                f_write(f_data)
+                write_at(file, f_data, rcvd_offset)
+                written = True
+                
+                size = len(f_data)
+                
+                # a chunk may cover several offsets if the window had grown the
+                # chunk size when it was requested.
+                rtt_start, doubles = c_map.mark_received(rcvd_offset, size)
                 
                 #Where a chunk gets delayed and gets received along with another 
-                # block, there's a risk we might try to remove the associated
-                # offset twice. We mitigate that risk here by checking first.
-                if not rcvd_offset in task[data][all_offsets]:
+                # block, its counted here so we can see how often it happens.
+                for offset in doubles:
                     
-                    if rcvd_offset in task[data]['doubles']:
-                        task[data]['doubles'][rcvd_offset] += 1
+                    if offset in task[data]['doubles']:
+                        task[data]['doubles'][offset] += 1
                     else:
-                        task[data]['doubles'][rcvd_offset] = 1
-                    
-                else:
-                    all_off_req_remove(rcvd_offset)
-                    
-                if not rcvd_offset in task[data][offsets]:
+                        task[data]['doubles'][offset] = 1
+                        
+                # only chunks we requested once give a true round trip time
+                if rtt_start is not None:
                     
-                    pass
+                    rtt = perf_counter() - rtt_start
+                    r_trip_time_append(rtt)
                     
                 else:
-                    # to get the correct round trip time, we need to take the
-                    # time from the request to the first packet that was part
-                    # of that request. Then use this to calculate the right 
-                    # amount of time to wait for the subsequent packets
-                    rt_append(perf_counter() - task[data][req_start_time])
+                    rtt = None
                     
-                    off_req_remove(rcvd_offset)
+                self.transfer_window(task[data], source).on_chunk(size, rtt)
                     
                 task[data][chunks_rcvd] += 1
-                size = len(f_data)
                 task[data][file_total_rcvd] += size
                 
-                task[data][req_start_time] = time.perf_counter()
+                task[data][rcvd_time] = perf_counter()
+                
+        # save progress now and then so the transfer can resume if it fails
+        if written and task[data][resume_state] is not None and\
+            timed_out(task[data][resume_state].saved_time, RESUME_SAVE_INTERVAL):
+            
+            self.save_transfer_state(task[data])
+            
+        # let swarm peers have the chunks we've verified, once they're on disk
+        if written and task[data][swarm_id]:
             
+            file.flush()
+            
+            self.swarm_files.publish(task[data][swarm_id], task[data][temp_file], 
+                c_map.states)
             
-        if round_trip:
-            r_trip_time_append(round_trip[0]) #only care about the first one recvd 
-                                                # the rest aren't really round trips
-                                                # since they're measured from the last
-                                                # received chunk, not the rquest that
-                                                # caused them.
                 
                 #notify the user of the total file progress actually received
-        recv_prog = \
-        max( (1 - len(task[data][all_offsets]) * CHUNK_SIZE / file_size) * 100, 
-                0
-            )
+        recv_prog = c_map.progress()
         
         
-        # update the user on progress using actual bytes received    
-        prog_msg = MsgWrapper(message = utils.progress_update,
-                t_uuid = t_uuid,
-                s_uuid = s_uuid,
-                attributes = {utils.percent_complete:recv_prog,
-                            utils.node_uuid:router_id,
-                            utils.status:utils.downloading_results
-                })
-                
-        #TODO: Really need to have a system for response/status codes coming back from
-        # render nodes. The current system is pretty hap hazard and prone to a lot of
-        # hacks to get it to work properly. In this instance, its incorrect to have the
-        # status set to downloading. This code has no idea why its transferring a file
-        # so it certainly shouldn't be claiming to put the node into this state.
+        # update the user on progress using actual bytes received, but no more 
+        # often than PROGRESS_INTERVAL, the last update is always sent.
+        if c_map.complete or\
+            timed_out(task[data][prog_sent_time], PROGRESS_INTERVAL):
+            
+            prog_msg = MsgWrapper(message = utils.progress_update,
+                    t_uuid = t_uuid,
+                    s_uuid = s_uuid,
+                    attributes = {utils.percent_complete:recv_prog,
+                                utils.node_uuid:router_id,
+                                utils.status:utils.downloading_results
+                    })
                     
-        self.inproc.send_json(prog_msg.serialize())
+            #TODO: Really need to have a system for response/status codes coming back 
+            # from render nodes. The current system is pretty hap hazard and prone to a 
+            # lot of hacks to get it to work properly. In this instance, its incorrect 
+            # to have the status set to downloading. This code has no idea why its 
+            # transferring a file so it certainly shouldn't be claiming to put the node 
+            # into this state.
+                        
+            self.inproc.send_json(prog_msg.serialize())
+            
+            task[data][prog_sent_time] = time.perf_counter()
         
             
-        if not task[data][all_offsets]:
+        if c_map.complete:
             #we're finished then, call complete so we can end this task
             task[complete](req_uuid, task)
             self.logger.info("CRFileRequest.handle_rcvd_data:" + l_sep +\
                 "Blocks with duplicated chunk requests: " +\
-                 str(task[data]['doubles']))
+                 str(task[data]['doubles']) + l_sep + wnd.stats())
             
     def file_recv_complete(self, req_uuid, task):
         """ completes a rcv file task and removes it from the list of tasks
@@ -1870,14 +4539,42 @@ class CRFileRequest(threading.Thread):
         self.logger.info(msg_str)
         self.logger.info(stats)
         
+        # the link carried bytes_on_wire, compression makes the transfer look 
+        # faster than the link by the compression ratio
+        elapsed = max(time.perf_counter() - task[start_time], 1e-6)
+        wire = task[data][bytes_on_wire]
+        
+        self.logger.info("CRFileRequest.file_recv_complete:" + l_sep +\
+            "file " + fid + l_sep + "%.3f MB/s effective throughput, "
+            "%.3f MB/s on the link, compression ratio %.3f using %s" % (
+            total / elapsed / 1e6, wire / elapsed / 1e6, 
+            total / wire if wire else 1.0, 
+            task[data][codec].decode('utf-8') or 'no codec'))
+        
         ## CLOSE FILE HANDLE
         file.close()
         
-        ## COPY TEMP FILE 
-        shutil.copy2(task[data][temp_file], task[data][f_write_to])
+        ## DEDUPLICATION STATS AND CHUNK STORE
+        if task[data][signatures]:
+            self.store_chunks(task[data])
+        
+        ## MOVE THE FILE INTO PLACE
+        # every chunk has passed its hash check, so the file can replace the old
+        # one in a single step
+        replace_file(task[data][temp_file], task[data][f_write_to])
+        
+        # serve swarm peers from where the file is now
+        if task[data][swarm_id]:
+            self.swarm_files.publish(task[data][swarm_id], 
+                task[data][f_write_to], task[data][chunk_map].states)
+                
+        if task[data][resume_state] is not None:
+            task[data][resume_state].remove()
         
         ## SEND FINISHED MSG
         msg_attributes[utils.status]= utils.ready
+        # bytes per second of file delivered, used to predict transfer times
+        msg_attributes[utils.transfer_rate] = total / elapsed
         finish_msg = MsgWrapper(
             command = msg_attributes[utils.command],
             t_uuid = t_uuid,
@@ -1888,6 +4585,81 @@ class CRFileRequest(threading.Thread):
         #task done so remove it from the list
         self.recv_tasks.pop(req_uuid)    
         
+    def discard_part_file(self, task_data):
+        """ Clean up after a transfer that didn't complete
+        
+        The partly received file is no use to swarm peers now, and is removed unless
+        the transfer can be resumed. 
+        """
+        
+        if task_data[swarm_id]:
+            self.swarm_files.remove(task_data[swarm_id])
+            
+        if task_data[resume_state] is None:
+            
+            try:
+                os.remove(task_data[temp_file])
+            except OSError:
+                pass
+                
+    def save_transfer_state(self, task_data):
+        """ Save the progress of a resumable transfer, logging any failure """
+        
+        try:
+            
+            task_data[resume_state].save(task_data[f_handle], task_data[f_size],
+                task_data[file_hash], task_data[chunk_map].states)
+                
+        except (OSError, ValueError) as e:
+            
+            self.logger.warning("CRFileRequest.save_transfer_state:" + l_sep +\
+                "Could not save the progress of " + task_data[file_id] +\
+                ", it won't be resumable : " + str(e))
+                
+    def store_chunks(self, task_data):
+        """ Add a received file's chunks to the chunk store and log dedup stats
+        
+        Arguments:
+            task_data   - dict      - the data of a completed file data task
+        Returns:
+            nothing
+        Side Effects:   
+            Adds chunks to self.chunk_store if the task uses it
+        Exceptions:
+            None        
+        Description:
+            The dedup ratio is the fraction of the file that didn't need to be 
+            transferred because its chunks were already on this machine.
+        """
+        
+        size = task_data[f_size]
+        reused = task_data[bytes_reused]
+        added = 0
+        
+        if task_data[use_chunk_store]:
+        
+            try:
+                
+                file_view = CRFileView(task_data[temp_file])
+                
+                try:
+                    added = self.chunk_store.add_chunks(
+                        unpack_signatures(task_data[signatures]), file_view.view)
+                finally:
+                    file_view.close()
+                    
+            except (OSError, ValueError) as e:
+                
+                self.logger.warning("CRFileRequest.store_chunks:" + l_sep +\
+                    "Could not add " + task_data[temp_file] + " to the chunk "+\
+                    "store : " + str(e))
+        
+        self.logger.info("CRFileRequest.store_chunks:" + l_sep +\
+            "file " + task_data[file_id] + l_sep +\
+            "dedup ratio: %.3f, %i bytes saved, %i bytes transferred, "
+            "%i bytes added to the chunk store" % (reused / size if size else 0.0, 
+            reused, task_data[file_total_rcvd], added))
+        
     def cancel_file_recv(self, req_uuid, task):
         """ Cancels a task to recv a file
         
@@ -1942,8 +4714,13 @@ class CRFileRequest(threading.Thread):
     
         self.inproc.send_json(finish_msg.serialize())                
             
+        if task[data][resume_state] is not None:
+            self.save_transfer_state(task[data])
+            
         file.close() 
         
+        self.discard_part_file(task[data])
+        
         self.recv_tasks.pop(req_uuid)
         
         
@@ -35,11 +35,30 @@ Modules Imported
 
 Classes Exported
     CRRenderThread  - Class for extracting the output of the render process
+    CRLineReader    - Waits on a render process's output a line at a time
+    CRRenderWorker  - A blender process kept loaded between renders of a session
+    CRFrameQueue    - Frames of an animation handed out whole to idle nodes
+    CRTileQueue     - Tiles of a frame handed out one at a time to idle nodes
+    CRPerfStore     - Append only store of the render performance of each node
+    CRSpeculation   - Regions of a frame watched for slow nodes to be given a backup
 
 Exceptions Raised
 
 Functions Exported
+    slot_uuid       - names one of a node's render slots as a render target
+    slot_node       - returns the node a render target belongs to
+    partition_devices - divides a node's devices and CPU cores between its slots
+    bind_cores      - restricts a render process to a set of CPU cores
+    parse_progress  - reads how far through a render is from a line of its output
+    create_render_process - starts a blender process to render one tile
+    render_worker   - returns a warm render worker for the session's blend file
+    perf_store      - returns the render performance store of this process
     screen_divide   - calculates the optimal screen space coordinates for each node 
+    bisect_screen   - divides a rectangle of pixels into near square tiles by share
+    tile_coords     - converts a tile's pixel bounds to screen coordinates
+    split_screen    - divides the screen into a number of equal tiles
+    result_bytes_per_pixel - estimates the size of a render result per pixel
+    allocate_largest_remainder - splits whole pixels between nodes by share
     scale_a         - Scales the screen area contributions of each node so that they sum
                          to one.
 
@@ -47,12 +66,19 @@ Functions Exported
 """
 
 ## IMPORTS
-import time, json, threading, zmq, subprocess, sys, os, faulthandler
+import time, json, threading, zmq, subprocess, sys, os, faulthandler, queue
+import re, selectors
 from pprint import pprint
 from random import randint, shuffle
-from statistics import mean
 from collections import deque
-from math import floor
+from math import floor, ceil
+
+try:
+    import sqlite3
+except ImportError:
+    # some builds of blender's python lack sqlite, the perf store then keeps its 
+    # estimates in memory only
+    sqlite3 = None
 
 from . import config
 
@@ -60,9 +86,9 @@ from . utils import MsgWrapper, image_file_path, error_message, node_uuid, node_
 from . utils import render_stats, machine_uuid, output_buffer_size, finished_tile
 from . utils import current_frame, t_s, k, render_failed, error_message, state, rendering
 from . utils import synced, mkdir_p, timed_out, finished_view
-from . utils import view, handle_generic_except
+from . utils import view, handle_generic_except, render_target
 from . rules import get_blender_executable
-from . config import read_config_file, write_config_file
+from . config import read_config_file
 from . logging import l_sep, setup_logging
 
 ####  CREATE CRASH LOGS #####
@@ -77,11 +103,206 @@ else:
 
 faulthandler.enable(file = fault_text_file)
 
+_perf_store = None
+_perf_store_lock = threading.Lock()
+
 ## CONSTANTS
 denoising_xbuff = 0.0#12.0
+WORKER_EXIT_TIMEOUT = 5.0 # seconds a worker is given to quit before it is killed
+FULL_FRAME = (0.0, 1.0, 0.0, 1.0) # screen coords of a node rendering whole frames
+SLOT_SEP = '/' # separates a node's uuid from its slot in a render target's uuid
+BANDWIDTH_EWMA = 0.3 # weight of the latest transfer in a node's bandwidth estimate
+SPECULATE_PROGRESS = 0.5 # a node less than this fraction done with its region ...
+SPECULATE_SLOWDOWN = 1.5 # ... at this multiple of its predicted time gets a backup
+PERF_EWMA = 0.2 # weight of the latest tile in a node's k and t_s estimates
+PERF_HISTORY = 50 # samples read back from disk to rebuild a node's estimates
+PERF_BATCH_SIZE = 100 # most samples written to the perf store in one transaction
+PERF_DB_TIMEOUT = 10.0 # seconds to wait on another process writing the perf store
+PERF_STORE_PATH = os.path.normpath(os.path.expanduser("~/cr/.conf/render_perf.db"))
+STATS_FLUSH_INTERVAL = 1.0 # most seconds render stats are held before being sent
+RENDER_LOG_INTERVAL = 5.0 # seconds between progress lines written to the render log
+
+# progress as blender prints it, cycles tiles and samples (2.8x and 3.x), eevee 
+# samples, and the parts of blender internal, which are done in any order
+PROGRESS_PATTERN = re.compile(
+    r"(?:Path Tracing (?:Tile|Sample)|Rendered|Rendering|Sample) (\d+) ?/ ?(\d+)"
+    r"|, Part (\d+)-(\d+)")
+
+# rough size of an exr after compression relative to the uncompressed pixels, 
+# for renders, which compress worse than typical photographs
+EXR_CODEC_RATIO = {
+    'NONE':1.0,
+    'RLE':0.8,
+    'ZIPS':0.6,
+    'ZIP':0.55,
+    'PIZ':0.5,
+    'PXR24':0.4,
+    'B44':0.5,
+    'B44A':0.45,
+    'DWAA':0.2,
+    'DWAB':0.2
+    }
+
+# Script run by a render worker, it reads one json command per line from stdin,
+# applies the settings for the tile and renders it. Blender prints the same
+# progress lines as it does for -f, so CRRenderThread can parse them. The result
+# is saved and 'Saved' printed by the script, under the names -f would use, the
+# frame number and then each view's suffix, so frames don't share a file.
+WORKER_SCRIPT = """
+import bpy, sys, json, traceback
+context = bpy.context
+prefs = context.preferences.addons['cycles'].preferences
+prefs.get_devices()
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    command = json.loads(line)
+    if command.get('exit'):
+        break
+    try:
+        scene = bpy.data.scenes[command['scene']]
+        render = scene.render
+        render.engine = command['engine']
+        render.filepath = command['output_path']
+        render.image_settings.file_format = command['img_out_fmt']
+        if command['threads']:
+            render.threads_mode = 'FIXED'
+            render.threads = command['threads']
+        else:
+            render.threads_mode = 'AUTO'
+        if command['resolution']:
+            render.resolution_x = command['resolution'][0]
+            render.resolution_y = command['resolution'][1]
+            render.resolution_percentage = command['resolution'][2]
+        if command['samples'] and command['engine'] == 'CYCLES':
+            if getattr(scene.cycles, 'progressive', 'PATH') == 'BRANCHED_PATH':
+                scene.cycles.aa_samples = command['samples']
+            else:
+                scene.cycles.samples = command['samples']
+        exec(command['settings'])
+        frame = command['frame']
+        scene.frame_set(frame)
+        bpy.ops.render.render(scene=scene.name)
+        if render.use_multiview and render.image_settings.views_format == 'INDIVIDUAL':
+            paths = [render.frame_path(frame=frame, view=v.name) 
+                for v in render.views if v.use]
+        else:
+            paths = [render.frame_path(frame=frame)]
+        bpy.data.images['Render Result'].save_render(
+            render.frame_path(frame=frame), scene=scene)
+        for path in paths:
+            print("Saved: '" + path + "'", flush=True)
+    except Exception:
+        print('Error: render worker failed: ' +
+            ' '.join(traceback.format_exc().splitlines()), flush=True)
+        sys.exit(1)
+"""
 
 
 
+class CRLineReader:
+    """ Reads the lines a render process writes to its stdout without polling
+    
+    On posix the reader waits on the pipe with a selector and reads whatever has
+    arrived in one go, so a thread watching a render sleeps until blender writes
+    and can still wake up on time to send its stats. On windows, where select 
+    can't wait on pipes, it falls back to a blocking readline, which sleeps just
+    the same but ignores the timeout.
+    
+    Bytes read past the last complete line are kept for the next call. A render
+    worker's stdout outlives the reader, anything the worker writes after the 
+    tile is saved and before the reader is dropped is discarded with it.
+    
+    """
+    
+    def __init__(self, stream):
+        
+        self.stream = stream
+        self.lines = deque()
+        self.partial = b''
+        self.eof = False
+        self.selector = None
+        
+        if os.name == 'posix':
+            try:
+                self.fd = stream.fileno()
+                self.selector = selectors.DefaultSelector()
+                self.selector.register(self.fd, selectors.EVENT_READ)
+            except (OSError, ValueError):
+                self.selector = None
+                
+    def readline(self, timeout = None):
+        """ Return the next line of output
+        
+        Arguments:
+            timeout     -   float   - most seconds to wait for a line, None waits
+                                        until one arrives
+        Returns:
+            string  - the line without its line ending, '' if none arrived in time
+                        or None once the process has closed its stdout
+        Side Effects:
+            Reads from the stream
+        Exceptions Raised:
+            None
+        
+        """
+        
+        if not self.lines and not self.eof:
+            
+            if self.selector is None:
+                self.read_blocking()
+            elif self.selector.select(timeout):
+                self.read_available()
+                
+        if self.lines:
+            return self.lines.popleft()
+        elif self.eof:
+            return None
+        else:
+            return ''
+            
+    def read_available(self):
+        """ Read what the process has written so far and split it into lines
+        """
+        
+        data = os.read(self.fd, 65536)
+        
+        if not data:
+            self.close()
+            if self.partial:
+                self.lines.append(self.decode(self.partial))
+                self.partial = b''
+            return
+            
+        chunks = (self.partial + data).split(b'\n')
+        self.partial = chunks.pop()
+        self.lines.extend(self.decode(chunk) for chunk in chunks)
+        
+    def read_blocking(self):
+        
+        data = self.stream.readline()
+        
+        if data:
+            self.lines.append(self.decode(data))
+        else:
+            self.close()
+            
+    def decode(self, data):
+        
+        return data.decode('utf-8', errors = 'replace').rstrip("\r\n")
+        
+    def close(self):
+        """ Stop waiting on the stream, it is left open for its owner to close
+        """
+        
+        self.eof = True
+        
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+            
+        
 class CRRenderThread(threading.Thread):
     
     def __init__(
@@ -95,7 +316,8 @@ class CRRenderThread(threading.Thread):
             resolution,
             engine, 
             samples, 
-            views={}
+            views={},
+            target=None
         ):
         
         threading.Thread.__init__(self, daemon= True)
@@ -116,6 +338,8 @@ class CRRenderThread(threading.Thread):
         self.samples = samples
         self.flush_timer = time.perf_counter()
         self.views = views
+        # the render slot of the node this is for, its perf data is kept apart
+        self.target = target or node.machine_uuid
         
         self.start()
         
@@ -137,7 +361,7 @@ class CRRenderThread(threading.Thread):
                 self.flush_to_sock(self.line_buffer)
                 self.line_buffer.clear()
                 
-            elif timed_out(self.flush_timer, 1.0): #wait up to 1 second before flushing
+            elif timed_out(self.flush_timer, STATS_FLUSH_INTERVAL): #wait before flushing
                 #flush but also reset the timer
                 self.flush_to_sock(self.line_buffer)
                 self.flush_timer = time.perf_counter()
@@ -155,23 +379,27 @@ class CRRenderThread(threading.Thread):
                  str(self.coords) )
         
         percent_complete = 0
+        sent_complete = None
         
         start_time = time.perf_counter()
         start_draw_time = 0.0
+        log_time = 0.0
         rendering = True
+        reader = CRLineReader(self.process.stdout)
         
         
         while rendering:
             
-            if not self.proc_alive(): 
-                self.render_logger.warning("Proc exited without rendeirng a tile")
-                break
-            #don't even attempt reading if the stream is closed
-            
+            # sleep until the process writes, waking in time to send any stats 
+            # that are due
+            if self.line_buffer:
+                timeout = max(0.0, STATS_FLUSH_INTERVAL -\
+                    (time.perf_counter() - self.flush_timer))
+            else:
+                timeout = None
             
             try:
-                self.process.stdout.flush()
-                buf = self.process.stdout.readline()
+                stats = reader.readline(timeout)
             except:
                 
                 location= "CCRenderThread.run"
@@ -180,105 +408,55 @@ class CRRenderThread(threading.Thread):
                 
                 handle_generic_except(location, message, self.render_logger)
                 
-            # no need to send null bytes. 
-            if buf == b'': continue
-            
-            stats = buf.decode('utf-8').rstrip("\n").rstrip("\r")
-            #msg_parts = stats.split(sep='|')
-            #tiles = msg_parts[-1]
+                stats = None
+                
+            if stats is None: 
+                self.render_logger.warning("Proc exited without rendeirng a tile")
+                break
             
+            # no need to send empty lines, we may just be due to send stats
+            if not stats:
+                self.should_we_flush()
+                continue
            
         #### CALCULATE THE PERCENTAGE COMPLETE FROM STAT OUTPUT ####
               
-            # get the numerator and denominator for the number of parts/tiles complete
-            if stats.rfind("Path Tracing Tile") > 0:
+            progress = parse_progress(stats)
             
-                # set start_draw_time only if it hasn't been set already.
-                if start_draw_time == 0.0: start_draw_time = time.perf_counter()
+            if progress is not None:
                 
-                cycles_frac_comp = stats[ stats.rfind("Path Tracing Tile") +\
-                    len("Path Tracing Tile") + 1:].split(',')[0]
-                
-                if cycles_frac_comp.find('/') > -1:
-                    fraction_complete_parts = cycles_frac_comp.split('/')
-                else:
-                    fraction_complete_parts =""
-                
-                if len(fraction_complete_parts) == 2:
-                    numerator = fraction_complete_parts[0]
-                    denominator = fraction_complete_parts[1]
-                    
-                    
-                    if numerator.isdigit() and denominator.isdigit():
-                        percent_complete = int(numerator)/int(denominator)
-                        
-            elif stats.rfind("Path Tracing Sample") > 0:
-            
                 # set start_draw_time only if it hasn't been set already.
                 if start_draw_time == 0.0: start_draw_time = time.perf_counter()
                 
-                cycles_frac_comp = stats[ stats.rfind("Path Tracing Sample") +\
-                    len("Path Tracing Sample") + 1:].split(',')[0]
-                
-                if cycles_frac_comp.find('/') > -1:
-                    fraction_complete_parts = cycles_frac_comp.split('/')
-                else:
-                    fraction_complete_parts =""
+                numerator, denominator, parts = progress
                 
-                if len(fraction_complete_parts) == 2:
-                    numerator = fraction_complete_parts[0]
-                    denominator = fraction_complete_parts[1]
+                if parts and denominator:
+                    #blender render uses parts which are not
+                    # always in order lowest to highest
+                    percent_complete += 1/denominator
+                elif denominator:
+                    percent_complete = numerator/denominator
                     
+                # progress lines come many times a second, only the latest one 
+                # is worth sending and they're logged every so often
+                if self.line_buffer and self.line_buffer[-1][2]:
+                    self.line_buffer[-1] = [percent_complete, stats, True]
+                elif percent_complete != sent_complete:
+                    self.line_buffer.append([percent_complete, stats, True])
                     
-                    if numerator.isdigit() and denominator.isdigit():
-                        percent_complete = int(numerator)/int(denominator)
-            
-            elif stats.rfind("Rendered") > 0:
-                if start_draw_time == 0.0: start_draw_time = time.perf_counter()
-            
-                cycles_frac_comp = stats[ stats.rfind("Rendered") +\
-                    len("Rendered") + 1:].split(',')[0]
+                sent_complete = percent_complete
                 
-                if cycles_frac_comp.find('/') > -1:
-                    fraction_complete_parts = cycles_frac_comp.split('/')
-                else:
-                    fraction_complete_parts =""
-                
-                if len(fraction_complete_parts) == 2:
-                    numerator = fraction_complete_parts[0]
-                    denominator = fraction_complete_parts[1].split(' ')[0]
+                if timed_out(log_time, RENDER_LOG_INTERVAL):
+                    log_time = time.perf_counter()
+                    self.render_logger.info("CRRenderThread.run" + l_sep + " " +\
+                        stats)
                     
-                    
-                    if numerator.isdigit() and denominator.isdigit():
-                        percent_complete = int(numerator)/int(denominator)
-                        
-            elif stats.rfind(", Part") > 0:
-                
-                # set start_draw_time only if it hasn't been set already.
-                if start_draw_time == 0.0: start_draw_time = time.perf_counter()
-                
-                blend_int_comp = stats[ stats.rfind(", Part") +\
-                        len(", Part") + 1:]
-                
-                if blend_int_comp.find('-') > -1:
-                    fraction_complete_parts = blend_int_comp.split('-')
-                else:
-                    fraction_complete_parts =""
+            else:
                 
-                if len(fraction_complete_parts) == 2:
-                    numerator = fraction_complete_parts[0]
-                    denominator = fraction_complete_parts[1]
-                    
-                    
-                    if numerator.isdigit() and denominator.isdigit():
-                        #blender render uses parts which are not
-                        # always in order lowest to highest
-                        percent_complete += 1/int(denominator)
-            
-            self.render_logger.info("CRRenderThread.run" + l_sep + " " +\
-                buf.decode('utf-8').rstrip("\n"))           
+                self.render_logger.info("CRRenderThread.run" + l_sep + " " +\
+                    stats)           
             
-            self.line_buffer.append([percent_complete, stats])
+                self.line_buffer.append([percent_complete, stats, False])
             
             
             #Detect whether we've reached the end of the render, the render process
@@ -302,10 +480,7 @@ class CRRenderThread(threading.Thread):
                 
                 session_uuid = self.node.session_uuid.decode('utf-8')
                 
-                #Calculate new k and t_s values and store them in conf
-                conf_setup = read_config_file([config.node_perf_data])
-                perf_data = conf_setup[config.node_perf_data].get(session_uuid)
-                
+                #Calculate new k and t_s values and add them to the perf store
                 coords = self.coords
                 A = (coords[1]-coords[0]) * (coords[3] - coords[2]) *\
                     (self.screen_res[0] * self.screen_res[1] *\
@@ -314,48 +489,10 @@ class CRRenderThread(threading.Thread):
                 k_new =  draw_time / (A * self.samples) # k is seconds per pixel sample
                 t_s_new = setup_time
                 
-                if perf_data is not None and isinstance(perf_data, dict):
-                    # this is the case where we already have previous data for this
-                    # session, though a different engine may have been used so 
-                    # we may still end up adding a new entry for the particular engine
-                    
-                    eng_perf_data =\
-                        conf_setup[config.node_perf_data][session_uuid].get(self.engine)
-                    
-                    #lets check to see if there is data for this engine, if not
-                    # we'll add an entry for it.
-                    if eng_perf_data:
-                    
-                        t_s_avg = mean([eng_perf_data[1], t_s_new])
-                        k_all = deque(eng_perf_data[0], maxlen=25)
-                        k_all.append(k_new)
-                        k_avg = mean(k_all)
-            
-                        datum = [list(k_all), t_s_avg]
-                        eng_perf_data = datum
-                        
-                        conf_setup[config.node_perf_data][session_uuid][self.engine] =\
-                            datum
-                        
-                    else:
-                        datum = [[k_new], t_s_new]
-                        k_avg = mean([k_new]) 
-                        conf_setup[config.node_perf_data][session_uuid][self.engine] =\
-                            datum
-                    
-                    write_config_file(conf_setup)
-            
-                else:                    
-                    #in the case where there is no data whatsoever for this
-                    # node we'll simply create a new entry in the config file
-                    # for it.
-                    datum = [[k_new], t_s_new]
-                    conf_setup[config.node_perf_data][session_uuid] =\
-                        {self.engine:datum}
-                    write_config_file(conf_setup)
-                    k_avg = k_new
-                    
-                    
+                # the store only updates its cache here, the sample is written to
+                # disk on its own thread so reporting the tile isn't held up
+                k_avg, t_s_avg = perf_store().add(session_uuid, self.engine, 
+                    self.target, k_new, t_s_new)
                 
                 #either we rendered one view of a tile or all of a tile
                 # find out and act accordingly
@@ -383,7 +520,8 @@ class CRRenderThread(threading.Thread):
                                 attributes = {image_file_path:img_tile_path,
                                             current_frame:self.frame_no,
                                             view:rendered_view,
-                                            t_s:datum[1],
+                                            render_target:self.target,
+                                            t_s:t_s_avg,
                                             k:k_avg #send just the avg not all data
                                             })
                             
@@ -403,7 +541,8 @@ class CRRenderThread(threading.Thread):
                                 attributes = {image_file_path:img_tile_path,
                                             current_frame:self.frame_no,
                                             view:rendered_view,
-                                            t_s:datum[1],
+                                            render_target:self.target,
+                                            t_s:t_s_avg,
                                             k:k_avg #send just the avg not all data
                                             })
                             
@@ -413,11 +552,14 @@ class CRRenderThread(threading.Thread):
                             
                             break
                             
-                        buf = self.process.stdout.readline()
+                        stats = reader.readline()
                         
-                        if buf == b'':continue# don't process empty lines
+                        if stats is None:
+                            # the process quit before saving the other views
+                            tile_rendered = False
+                            rendering = False
+                            break
                         
-                        stats = buf.decode('utf-8').rstrip("\n").rstrip("\r")
                         if 'Saved' in stats:
                             img_tile_path = stats.split('\'')[1]
                         
@@ -431,7 +573,8 @@ class CRRenderThread(threading.Thread):
                         attributes = {image_file_path:img_tile_path,
                                     current_frame:self.frame_no,
                                     view:rendered_view,
-                                    t_s:datum[1],
+                                    render_target:self.target,
+                                    t_s:t_s_avg,
                                     k:k_avg #send just the avg not all data
                                     })
                 
@@ -473,6 +616,7 @@ class CRRenderThread(threading.Thread):
                     t_uuid = self.frame_task_id,
                     attributes = {error_message:errors,
                                     node_uuid:self.node.machine_uuid,
+                                    render_target:self.target,
                                     node_name:self.node.node_name,
                                     state:synced}
                                     )   
@@ -490,6 +634,7 @@ class CRRenderThread(threading.Thread):
                 self.render_logger.error("CRRenderThread.run" + l_sep +\
                     "errors detected whilst rendering" + err_string)
                 
+        reader.close()
         self.render_logger.info("Closing RenderThread Socket")
         self.sock.disconnect("inproc://" + self.parnt_thrd.render_thread_sock_addr)
         self.sock.close(linger=0)
@@ -504,9 +649,10 @@ class CRRenderThread(threading.Thread):
         update_msg = MsgWrapper(message = render_stats, 
             t_uuid = self.frame_task_id,
             attributes = {
-            render_stats:buffer,
+            render_stats:[line[:2] for line in buffer],
             node_name:self.node.node_name,
             machine_uuid:self.node.machine_uuid,
+            render_target:self.target,
             state:rendering})
             
         self.sock.send_string(json.dumps(update_msg.serialize()))
@@ -524,10 +670,141 @@ class CRRenderThread(threading.Thread):
         else:
             return False
         
+def parse_progress(line):
+    """ Return how far through its render a process is from a line of its output
+    
+    Arguments:
+        line    -   string  - a line blender printed while rendering
+    
+    Returns:
+        tuple   -   (int - tiles, samples or parts done, int - of how many, 
+                    bool - True if the count is of blender internal's parts, 
+                    which finish in any order so only the number seen counts)
+                    or None if the line isn't a progress line
+    
+    """
+    
+    match = PROGRESS_PATTERN.search(line)
+    
+    if match is None:
+        return None
+    elif match.group(1) is not None:
+        return int(match.group(1)), int(match.group(2)), False
+    else:
+        return int(match.group(3)), int(match.group(4)), True
+        
+        
+def slot_uuid(machine_uuid, slot, slots):
+    """ Return the uuid of one of a node's render slots as a render target
+    
+    Arguments:
+        machine_uuid    -   string  - uuid of the node
+        slot            -   int     - number of the slot, from 0
+        slots           -   int     - number of slots the node is divided into
+    
+    Returns:
+        string  - the target's uuid, slot_node gives back the node's uuid
+    
+    Description:
+        The number of slots is part of the uuid since a slot's k and t_s depend
+        on how much of the node it has, see partition_devices.
+    
+    """
+    
+    return SLOT_SEP.join((machine_uuid, str(slot), str(slots)))
+    
+    
+def slot_node(target_uuid):
+    """ Return the uuid of the node a render target belongs to
+    """
+    
+    return target_uuid.split(SLOT_SEP)[0]
+    
+    
+def partition_devices(comp_dev, comp_devices, threads, slot, slots):
+    """ Return the share of a node's devices and CPU cores one render slot uses
+    
+    Arguments:
+        comp_dev        -   string  - enumeration in 'CPU', 'CUDA' 'OPENCL' denoting 
+                                        the type of device being used
+        comp_devices    -   list    - the node's compute devices as sent with a 
+                                        render, dicts of 'use', 'id', 'name' and 'type'
+        threads         -   int     - CPU threads for the node, 0 for blender to 
+                                        decide
+        slot            -   int     - number of the slot, from 0
+        slots           -   int     - number of slots the node is divided into
+    
+    Returns:
+        tuple   -   (list - comp_devices with 'use' set only for the slot's devices,
+                    int - threads for the slot, 
+                    list - CPU cores for the slot, None if they can't be found)
+    Side Effects:
+        None
+    Exceptions Raised:
+        None
+    
+    Description:
+        The GPUs of the selected type that are in use are dealt out to the slots 
+        in turn, so a node with four GPUs and two slots renders two tiles at once 
+        with two GPUs each. With more slots than GPUs, slots share GPUs. 
+        
+        The CPU cores are split into contiguous blocks, one per slot, as are the 
+        threads if a number of them was set.
+    
+    """
+    
+    slots = max(1, slots)
+    
+    in_use = [device['id'] for device in comp_devices 
+                if device['type'] == comp_dev and device['use']]
+                
+    if in_use and comp_dev not in ('CPU', 'NONE'):
+        
+        mine = set(in_use[slot % len(in_use)::slots]) if len(in_use) >= slots\
+            else {in_use[slot % len(in_use)]}
+            
+        comp_devices = [dict(device, use = device['use'] and 
+                            (device['type'] != comp_dev or device['id'] in mine))
+                        for device in comp_devices]
+                        
+    cpu_count = os.cpu_count()
+    
+    if cpu_count:
+        per_slot = max(1, cpu_count // slots)
+        first = (slot * per_slot) % cpu_count
+        cores = list(range(first, min(first + per_slot, cpu_count)))
+    else:
+        cores = None
+        
+    if threads > 0:
+        threads = max(1, threads // slots)
+    elif cores:
+        threads = len(cores)
+        
+    return comp_devices, threads, cores
+    
+    
+def bind_cores(process, cores, logger):
+    """ Restrict a render process to a set of CPU cores where the OS allows it
+    
+    Blender's render threads are started once it begins rendering, after this
+    is called, and inherit the process's affinity. On platforms without 
+    sched_setaffinity the slot is held to its share by its thread count alone.
+    """
+    
+    if not cores or not hasattr(os, 'sched_setaffinity'): return
+    
+    try:
+        os.sched_setaffinity(process.pid, cores)
+    except OSError as e:
+        logger.warning("bind_cores" + l_sep +\
+            " could not bind render process to cores " + str(cores) + ": " + str(e))
+            
+            
 def create_render_process(trusted, coords, tile_x, tile_y, comp_dev, comp_devices,
                             threads, blend_file, output_path, engine, img_out_fmt, 
                             current_frame, exr_codec,
-                            logger, scene_name):
+                            logger, scene_name, cores = None):
     """ Create a process using Popen and return a reference to it
     
     Arguments:
@@ -547,6 +824,7 @@ def create_render_process(trusted, coords, tile_x, tile_y, comp_dev, comp_device
                                     documentation on the different image formats supported
         current_frame   -   int     - the frame number that will be rendered
         logger          -   logging.logger  - a reference to a current logging instance
+        cores           -   list    - CPU cores to run the process on, None for all
     
     Returns:
         Subprocess.process
@@ -574,7 +852,69 @@ def create_render_process(trusted, coords, tile_x, tile_y, comp_dev, comp_device
         "scene = bpy.data.scenes['"+ scene_name +"']\n" +\
         "prefs = context.preferences.addons['cycles'].preferences\n" +\
         "prefs.get_devices()\n" +\
-        "scene.render.use_border = True\n" +\
+        render_settings_script(coords, tile_x, tile_y, comp_dev, comp_devices,
+                               exr_codec)
+                                
+    
+    #Re CR-779, we now use get_parent_executable to avoid
+    # starting the wrong process
+    
+    exe_path = get_blender_executable()
+    
+    process = subprocess.Popen([
+        exe_path, 
+        "-b",
+        "-noaudio", 
+        blend_file,
+        load_trusted,
+        "-S", scene_name,
+        "-o", output_path,
+        "--python-expr", 
+        import_string,
+        "-E", engine,
+        "-F", img_out_fmt,
+        "-t", str(threads),
+        "-f", str(current_frame),
+        "--", "render_proc"
+        ],
+        stdout=subprocess.PIPE, 
+        stderr=subprocess.STDOUT)
+        
+    bind_cores(process, cores, logger)
+
+    return process
+    
+    
+def render_settings_script(coords, tile_x, tile_y, comp_dev, comp_devices, 
+                            exr_codec):
+    """ Return python source that applies the tile's settings to a scene
+    
+    Arguments:
+        coords          -   tuple   - (xmin, xmax, ymin, ymax) screen coordinates to 
+                                        render
+        tile_x          -   int     - render tile size in pixels for x dim
+        tile_y          -   int     - render tile size in pixels for y dim
+        comp_dev        -   string  - enumeration in 'CPU', 'CUDA' 'OPENCL' denoting 
+                                        the type of device being used
+        comp_devices    -   py_dict - A collection of the render devices of the current 
+                                    devices available
+        exr_codec       -   string  - codec used when saving exr images
+    
+    Returns:
+        string  - python source, it expects the names scene and prefs to be defined
+    Side Effects:
+        None
+    Exceptions Raised:
+        None
+    
+    Description:
+        The border, tile size and compute devices are set the same way for a
+        render process started per tile and for a warm render worker, this 
+        function builds the script both of them run before rendering.
+    
+    """
+    
+    import_string = "scene.render.use_border = True\n" +\
         "scene.render.use_crop_to_border = True\n" +\
         "scene.render.use_overwrite = True\n" +\
         "scene.render.border_min_x =" + str(coords[0])+"\n" +\
@@ -630,68 +970,956 @@ def create_render_process(trusted, coords, tile_x, tile_y, comp_dev, comp_device
                 import_string+="if device is not None: device.use="+\
                                 str(item['use'])+"\n"
                                 
-        
+    return import_string
     
-    #Re CR-779, we now use get_parent_executable to avoid
-    # starting the wrong process
     
-    exe_path = get_blender_executable()
+class CRRenderWorker:
+    """ A blender process that keeps a session's blend file loaded between renders
     
-    process = subprocess.Popen([
-        exe_path, 
-        "-b",
-        "-noaudio", 
-        blend_file,
-        load_trusted,
-        "-S", scene_name,
-        "-o", output_path,
-        "--python-expr", 
-        import_string,
-        "-E", engine,
-        "-F", img_out_fmt,
-        "-t", str(threads),
-        "-f", str(current_frame),
-        "--", "render_proc"
-        ],
-        stdout=subprocess.PIPE, 
-        stderr=subprocess.STDOUT)
-
-    return process
-            
-def calculate_optimal_render_area(machines, screen_x, screen_y, samples):
-    """ Calculate the optimal screen area for each node based on their performance
+    Starting blender, reading the blend file and building the render engine's
+    device state costs seconds per tile, which for small tiles and animations is
+    often more than the render itself. A worker loads the file once and then 
+    renders each tile it is sent over its stdin, reporting progress on its stdout 
+    exactly like a process made by create_render_process.
     
-    Arguments:
-        machines    -   py_dict -   Collection of currently available render nodes
-        screen_x    -   int     -   image resolution in x direction
-        screen_y    -   int     -   image resolution in y direction
-        samples     -   int     -   number of pixel samples that will be taken
+    The worker stands in for the subprocess.Popen it replaces, it has the stdout,
+    poll, kill and communicate members that CRRenderThread and the owners of 
+    render_processes use. Since the worker outlives each render, communicate 
+    only waits for it once it has been killed or stopped.
     
-    Returns:
-        py_dict     {node_uuid - string - unique id for a render node : 
-                            Ai - float - proportion of the
-                                        total screen area that the node will render}
-                                    
-    Side Effects:
-        None
-    Exceptions Raised:
-        None
-    Description: 
-        This method takes the stored performance data in each machine passed via the
-        machines argument, and calculates firstly a To. To is an estimated optimum time
-        that if all machines finish in, will be the fastest possible render time. It then
-        uses this value to calculate the amount of screen area to give to each machine 
-        so that it will finish in time To. 
+    """
+    
+    def __init__(self, trusted, blend_file, top_hash, scene_name, logger, 
+                 cores = None):
         
+        self.trusted = trusted
+        self.blend_file = blend_file
+        self.top_hash = top_hash
+        self.scene_name = scene_name
+        self.logger = logger
+        self.cores = cores
+        self.closing = False
         
-    """
+        if trusted:
+            load_trusted = "-y"
+        else:
+            load_trusted = "-Y"
+        
+        self.process = subprocess.Popen([
+            get_blender_executable(), 
+            "-b",
+            "-noaudio", 
+            blend_file,
+            load_trusted,
+            "-S", scene_name,
+            "--python-expr", 
+            WORKER_SCRIPT,
+            "--", "render_proc"
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, 
+            stderr=subprocess.STDOUT)
+            
+        self.stdout = self.process.stdout
+        
+        bind_cores(self.process, cores, logger)
+        
+        self.logger.info("CRRenderWorker.__init__:" + l_sep +\
+            " started render worker for: " + blend_file + " at top hash: " +\
+            str(top_hash))
     
-    ##### CALCULATE OPTIMAL RENDER TIME #######
+    def is_current(self, trusted, blend_file, top_hash, scene_name, cores = None):
+        """ Return True if the worker is alive and has this version of the file
+        """
+        
+        return self.poll() is None and not self.closing and\
+            (self.trusted, self.blend_file, self.top_hash, self.scene_name,
+                self.cores) ==\
+            (trusted, blend_file, top_hash, scene_name, cores)
+        
+    def render(self, coords, tile_x, tile_y, comp_dev, comp_devices, threads, 
+               output_path, engine, img_out_fmt, current_frame, exr_codec, 
+               resolution = None, samples = 0):
+        """ Send the worker a tile to render and return the worker
+        
+        Arguments:
+            resolution      -   list    - [x, y, percentage] or None to keep the 
+                                            file's resolution
+            samples         -   int     - samples per pixel, 0 keeps the file's 
+                                            samples
+            
+            The other arguments are the same as for create_render_process.
+        
+        Returns:
+            CRRenderWorker - self, for use in place of a render process
+        Side Effects:
+            Writes a command to the worker's stdin
+        Exceptions Raised:
+            BrokenPipeError if the worker has exited
+        
+        """
+        
+        command = {
+            'scene':self.scene_name,
+            'settings':render_settings_script(coords, tile_x, tile_y, comp_dev,
+                                              comp_devices, exr_codec),
+            'output_path':output_path,
+            'engine':engine,
+            'img_out_fmt':img_out_fmt,
+            'threads':int(threads),
+            'frame':int(current_frame),
+            'resolution':resolution,
+            'samples':samples
+            }
+            
+        self.process.stdin.write(bytes(json.dumps(command) + "\n", 'utf-8'))
+        self.process.stdin.flush()
+        
+        return self
+        
+    def poll(self):
+        
+        return self.process.poll()
+        
+    def kill(self):
+        
+        self.closing = True
+        self.process.kill()
+        
+    def communicate(self, timeout = None):
+        
+        if not self.closing:
+            return (None, None)
+        
+        return self.process.communicate(timeout = timeout)
+        
+    def stop(self):
+        """ Ask the worker to quit, killing it if it doesn't in time
+        """
+        
+        self.closing = True
+        
+        try:
+            self.process.stdin.write(bytes(json.dumps({'exit':True}) + "\n", 
+                                           'utf-8'))
+            self.process.stdin.close()
+            self.process.wait(timeout = WORKER_EXIT_TIMEOUT)
+            
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            
+            self.logger.warning("CRRenderWorker.stop:" + l_sep +\
+                " worker did not exit, killing it")
+            self.process.kill()
+            
+            
+def render_worker(worker, trusted, blend_file, top_hash, scene_name, logger,
+                  cores = None):
+    """ Return a warm render worker with the given version of the blend file loaded
+    
+    Arguments:
+        worker          -   CRRenderWorker  - the caller's current worker or None
+        trusted         -   boolean - sets the -Y or -y option for blender's command line
+        blend_file      -   string  - path to the blend file to be opened for rendering
+        top_hash        -   string  - top hash of the session's data in blend_file,
+                                        or any value that changes with the file
+        scene_name      -   string  - scene to render
+        logger          -   logging.logger  - a reference to a current logging instance
+        cores           -   list    - CPU cores to run the worker on, None for all
+    
+    Returns:
+        CRRenderWorker
+    Side Effects:
+        Stops worker and starts a new one if worker is dead or has a different 
+        version of the file loaded.
+    Exceptions Raised:
+        None
+    
+    Description:
+        The top hash is the same for every render until the session's data 
+        changes, so a worker is reused across tiles and frames and only reloads
+        the file once a sync update has changed it.
+    
+    """
+    
+    if worker is not None:
+        
+        if worker.is_current(trusted, blend_file, top_hash, scene_name, cores):
+            return worker
+            
+        worker.stop()
+    
+    return CRRenderWorker(trusted, blend_file, top_hash, scene_name, logger, cores)
+    
+    
+class CRPerfStore:
+    """ Append only store of render performance samples for load balancing
+    
+    Each tile a node renders gives a sample of k, seconds per pixel sample, and
+    t_s, the setup time in seconds. Samples are appended to an sqlite database in 
+    WAL mode so that the render threads of all the processes on a machine can 
+    write to it at once, and the estimates the load balancer uses are kept as an
+    exponentially weighted moving average in memory, segmented by session, 
+    engine and node.
+    
+    The render thread that reports a tile's stats only ever touches the cache,
+    samples are written to disk by a writer thread in batches. Should sqlite not 
+    be available in blender's python the store keeps its estimates in memory only.
+    
+    """
+    
+    def __init__(self, path, logger):
+        
+        self.path = path
+        self.logger = logger
+        self.cache = {} # (session, engine, node) : [k, t_s]
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        
+        self.writer = threading.Thread(target = self.write_samples, daemon = True)
+        self.writer.start()
+        
+    def connect(self):
+        """ Open a connection to the database, creating its table if needed """
+        
+        mkdir_p(os.path.split(self.path)[0])
+        
+        conn = sqlite3.connect(self.path, timeout = PERF_DB_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS perf_samples (" +\
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT, engine TEXT, " +\
+            "node TEXT, k REAL, t_s REAL, time REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS perf_samples_key ON " +\
+            "perf_samples (session, engine, node, id)")
+        conn.commit()
+        
+        return conn
+        
+    def add(self, session, engine, node, k_new, t_s_new):
+        """ Record a sample and return the updated estimates for its node
+        
+        Arguments:
+            session         -   string  - uuid of the session the tile belongs to
+            engine          -   string  - render engine used for the tile
+            node            -   string  - machine uuid of the node that rendered it
+            k_new           -   float   - seconds per pixel sample for the tile
+            t_s_new         -   float   - setup time of the tile in seconds
+        
+        Returns:
+            tuple   -   (k, t_s) the node's estimates including this sample
+        Side Effects:
+            Updates the cache and queues the sample to be written to disk.
+        Exceptions Raised:
+            None
+        
+        Description:
+            When there are no estimates in the cache for this node yet the sample
+            becomes the estimate, the writer thread then replaces it with one that
+            includes the samples already on disk.
+        
+        """
+        
+        key = (session, engine, node)
+        
+        with self.lock:
+            
+            estimate = self.cache.get(key)
+            reload = estimate is None
+            
+            if reload:
+                estimate = [k_new, t_s_new]
+            else:
+                estimate[0] += PERF_EWMA * (k_new - estimate[0])
+                estimate[1] += PERF_EWMA * (t_s_new - estimate[1])
+                
+            self.cache[key] = estimate
+            k_avg, t_s_avg = estimate
+            
+        self.pending.put((key, k_new, t_s_new, time.time(), reload))
+        
+        return k_avg, t_s_avg
+        
+    def get(self, session, engine, node):
+        """ Return the estimates (k, t_s) for a node, None if it has no samples """
+        
+        key = (session, engine, node)
+        
+        with self.lock:
+            estimate = self.cache.get(key)
+            
+        if estimate is not None:
+            return tuple(estimate)
+            
+        estimate = self.load(key)
+        
+        if estimate is None:
+            return None
+            
+        with self.lock:
+            estimate = self.cache.setdefault(key, estimate)
+            
+            return tuple(estimate)
+            
+    def load(self, key, conn = None):
+        """ Average the most recent samples on disk for key, None if there are none """
+        
+        if sqlite3 is None:
+            return None
+            
+        try:
+            
+            if conn is None:
+                conn = self.connect()
+                close = True
+            else:
+                close = False
+                
+            rows = conn.execute("SELECT k, t_s FROM perf_samples WHERE session=? " +\
+                "AND engine=? AND node=? ORDER BY id DESC LIMIT ?", 
+                key + (PERF_HISTORY,)).fetchall()
+                
+            if close:
+                conn.close()
+                
+        except sqlite3.Error as e:
+            
+            self.logger.warning("CRPerfStore.load" + l_sep +\
+                " could not read render performance data: " + str(e))
+            
+            return None
+            
+        if not rows:
+            return None
+            
+        rows.reverse()
+        
+        estimate = list(rows[0])
+        
+        for k_old, t_s_old in rows[1:]:
+            estimate[0] += PERF_EWMA * (k_old - estimate[0])
+            estimate[1] += PERF_EWMA * (t_s_old - estimate[1])
+            
+        return estimate
+        
+    def write_samples(self):
+        """ Write queued samples to disk in batches, runs on the writer thread """
+        
+        conn = None
+        
+        while True:
+            
+            batch = [self.pending.get()]
+            
+            while len(batch) < PERF_BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+                    
+            if sqlite3 is None:
+                continue
+                
+            try:
+                
+                if conn is None:
+                    conn = self.connect()
+                    
+                with conn:
+                    conn.executemany("INSERT INTO perf_samples " +\
+                        "(session, engine, node, k, t_s, time) VALUES (?,?,?,?,?,?)",
+                        [key + (k_new, t_s_new, t) 
+                            for key, k_new, t_s_new, t, reload in batch])
+                        
+            except sqlite3.Error as e:
+                
+                self.logger.warning("CRPerfStore.write_samples" + l_sep +\
+                    " could not write render performance data: " + str(e))
+                
+                continue
+                
+            # nodes whose first sample in this process was in the batch now get
+            # estimates that include their history as well
+            for key in {item[0] for item in batch if item[4]}:
+                
+                estimate = self.load(key, conn)
+                
+                if estimate is not None:
+                    with self.lock:
+                        self.cache[key] = estimate
+                    
+
+def perf_store():
+    """ Return this process's render performance store, creating it on first use
+    
+    Arguments:
+        None
+    
+    Returns:
+        CRPerfStore
+    Side Effects:
+        Starts the store's writer thread the first time it is called.
+    Exceptions Raised:
+        None
+    
+    Description:
+        The store is created lazily so that only the processes which render or 
+        balance load open the database.
+    
+    """
+    
+    global _perf_store
+    
+    with _perf_store_lock:
+        
+        if _perf_store is None:
+            _perf_store = CRPerfStore(PERF_STORE_PATH, 
+                setup_logging('render_perf_store'))
+            
+        return _perf_store
+    
+    
+class CRFrameQueue:
+    """ Frames of an animation shared between the nodes rendering it
+    
+    Arguments:
+        job             -   utils.MsgWrapper - the render command that started the 
+                                            animation, copied for each frame
+        frames          -   iterable  - frame numbers to render, in order
+        nodes           -   iterable  - uuids of the nodes rendering the animation
+        batch_size      -   int       - most frames a node reserves at once
+    
+    Description:
+        Splitting every frame of an animation across all nodes makes each node 
+        pay its setup time on every frame and leaves the frame waiting for the 
+        slowest node. Here each node renders whole frames instead, taking the
+        next one from the queue whenever it is idle, so fast nodes simply render
+        more frames and throughput grows with the number of nodes.
+        
+        Nodes reserve a contiguous run of up to batch_size frames so a node's 
+        render worker steps through the animation in order. The run shrinks as 
+        the queue empties so no node is left holding most of the last frames.
+        
+        Finished frames are kept until the render engine in blender asks for 
+        them, blender renders the frames of an animation one at a time while 
+        the nodes are free to work ahead.
+        
+    """
+    
+    def __init__(self, job, frames, nodes, batch_size = 1):
+        
+        self.job = job
+        self.frames = list(frames)
+        self.pending = deque(self.frames)
+        self.batch_size = max(1, batch_size)
+        self.batches = {node:deque() for node in nodes}
+        self.started = set()
+        self.rendering = {} # node uuid : frame
+        self.results = {} # frame : [[utils.MsgWrapper, ...], complete]
+        self.engines = {} # frame : t_uuid of the render engine waiting for it
+        self.delivered = set()
+        
+    def idle_nodes(self):
+        """ Return the uuids of nodes that aren't rendering a frame right now
+        """
+        
+        return [node for node in self.batches if node not in self.rendering]
+        
+    def next_frame(self, node_uuid):
+        """ Return the next frame for an idle node to render or None if there isn't one
+        """
+        
+        batch = self.batches.get(node_uuid)
+        
+        if batch is None: return None
+        
+        if not batch:
+            
+            size = min(self.batch_size, 
+                       -(-len(self.pending) // len(self.batches)))
+            
+            while self.pending and len(batch) < size:
+                batch.append(self.pending.popleft())
+                
+        if not batch: return None
+        
+        self.rendering[node_uuid] = batch[0]
+        
+        return batch[0]
+        
+    def frame_rendered(self, node_uuid, frame):
+        """ Record that a node finished rendering a frame, it is now idle
+        """
+        
+        batch = self.batches.get(node_uuid)
+        
+        if batch and frame in batch:
+            batch.remove(frame)
+            
+        if self.rendering.get(node_uuid) == frame:
+            self.rendering.pop(node_uuid)
+            
+    def drop_node(self, node_uuid):
+        """ Stop using a node, its unfinished frames go back to the front of the queue
+        
+        Returns:
+            boolean - True if there are still nodes left to render the animation
+        """
+        
+        batch = self.batches.pop(node_uuid, deque())
+        self.rendering.pop(node_uuid, None)
+        self.pending.extendleft(reversed(batch))
+        
+        return bool(self.batches)
+        
+    def add_result(self, frame, msg, complete):
+        """ Keep a result msg for a frame until its render engine asks for it
+        """
+        
+        result = self.results.setdefault(frame, [[], False])
+        result[0].append(msg)
+        result[1] = result[1] or complete
+        
+    def take_frame(self, frame):
+        """ Return the engine's t_uuid and the result msgs for a frame, if both are in
+        
+        Returns:
+            (bytes, list) - t_uuid and results if the frame is ready to be delivered
+                            to the engine waiting on it, otherwise None
+        """
+        
+        result = self.results.get(frame)
+        t_uuid = self.engines.get(frame)
+        
+        if result is None or not result[1] or t_uuid is None:
+            return None
+            
+        self.results.pop(frame)
+        self.engines.pop(frame)
+        self.delivered.add(frame)
+        
+        return t_uuid, result[0]
+        
+    def finished(self):
+        """ Return True once every frame has been delivered to blender
+        """
+        
+        return len(self.delivered) >= len(self.frames)
+        
+        
+class CRTileQueue:
+    """ Tiles of a frame that nodes take one at a time as they become idle
+    
+    Arguments:
+        job             -   utils.MsgWrapper - the render command for the frame, 
+                                            copied for each tile
+        tiles           -   list      - screen coords (xmin, xmax, ymin, ymax) of
+                                        each tile, see split_screen
+        nodes           -   iterable  - uuids of the nodes rendering the frame
+    
+    Description:
+        calculate_optimal_render_area sizes one region per node from each node's 
+        k and t_s, when those are off or a node slows down everyone waits for 
+        it. Splitting the frame into many small tiles that idle nodes pull from 
+        this queue balances the load as the render runs instead, a slow node 
+        just takes fewer tiles. With a warm render worker on each node, the 
+        setup cost per tile is small.
+        
+    """
+    
+    def __init__(self, job, tiles, nodes):
+        
+        self.job = job
+        self.tiles = list(tiles)
+        self.pending = deque(range(len(self.tiles)))
+        self.nodes = set(nodes)
+        self.started = set()
+        self.rendering = {} # node uuid : tile number
+        self.received = set()
+        
+    def idle_nodes(self):
+        """ Return the uuids of nodes that aren't rendering a tile right now
+        """
+        
+        return [node for node in sorted(self.nodes) if node not in self.rendering]
+        
+    def next_tile(self, node_uuid):
+        """ Return the number of the next tile for an idle node or None if there isn't one
+        """
+        
+        if node_uuid not in self.nodes or not self.pending: return None
+        
+        tile_no = self.pending.popleft()
+        self.rendering[node_uuid] = tile_no
+        
+        return tile_no
+        
+    def tile_rendered(self, node_uuid):
+        """ Record that a node finished its tile, it is now idle
+        """
+        
+        self.rendering.pop(node_uuid, None)
+        
+    def drop_node(self, node_uuid):
+        """ Stop using a node, its unfinished tile goes back to the front of the queue
+        
+        Returns:
+            boolean - True if there are still nodes left to render the frame
+        """
+        
+        self.nodes.discard(node_uuid)
+        
+        tile_no = self.rendering.pop(node_uuid, None)
+        
+        if tile_no is not None and tile_no not in self.received:
+            self.pending.appendleft(tile_no)
+            
+        return bool(self.nodes)
+        
+    def tile_received(self, tile_no):
+        """ Record that a tile's result has reached blender
+        """
+        
+        self.received.add(tile_no)
+        
+    def finished(self):
+        """ Return True once every tile's result has reached blender
+        """
+        
+        return len(self.received) >= len(self.tiles)
+        
+        
+class CRSpeculation:
+    """ Regions of a frame being rendered, watched for nodes that fall behind
+    
+    Arguments:
+        progress        -   float   - fraction done under which a late node is 
+                                        a straggler
+        slowdown        -   float   - multiple of its predicted render time a node
+                                        must have taken to be late
+    
+    Description:
+        A node's render time for a region is predicted from its k and t_s, a node
+        that is well past that and not yet half way through its region, because 
+        it's thermally throttled or busy with something else say, holds up the 
+        whole frame. CRClientServerManager gives the region of such a straggler
+        to an idle node as well, which ever copy of the region comes back first
+        is used and the other is cancelled.
+        
+        Regions are numbered, tiles of a CRTileQueue by their tile number, the 
+        regions of screen_divide by the order of their nodes' uuids. A region's 
+        number names the backup's output so it doesn't overwrite anything the 
+        node rendered before.
+        
+        The counters launches and wins are kept for the whole session,
+        frame_launches and frame_wins are reset for each frame.
+        
+        A cancelled copy's failure, or its result if it finished before the 
+        cancel reached it, may arrive after the next frame has begun, so the 
+        nodes whose copies were cancelled or superseded are remembered until the
+        end of the frame after. Results from them are dropped, as are results 
+        from nodes that were given a region this frame but no longer have one.
+        
+    """
+    
+    def __init__(self, progress = SPECULATE_PROGRESS, slowdown = SPECULATE_SLOWDOWN):
+        
+        self.progress = progress
+        self.slowdown = slowdown
+        self.launches = 0 # backups started
+        self.wins = 0 # backups whose result came back before the straggler's
+        self.frame_count = 0 # frames begun, to expire cancelled and stale
+        # node uuid : (frame_count, region), renders cancelled because another 
+        # copy of their region finished first, their failure msgs may arrive 
+        # after the frame is finalised
+        self.cancelled = {}
+        # node uuid : (frame_count, region), nodes whose copy was already 
+        # rendered and is downloading when another copy was accepted, their 
+        # result is dropped
+        self.stale = {}
+        
+        self.clear()
+        
+    def clear(self):
+        """ Stop watching the current frame
+        """
+        
+        self.active = False
+        self.job = None
+        self.nodes = set()
+        self.screen_x = 0.0
+        self.screen_y = 0.0
+        self.samples = 1
+        self.regions = {} # region : screen coords
+        self.owners = {} # region : uuid of the node first given the region
+        self.assigned = {} # node uuid : region, until the result is accepted
+        self.running = {} # node uuid : [start time, predicted time, fraction done]
+        self.done = set() # regions whose result has been accepted
+        self.given = set() # uuids of the nodes given a region this frame
+        self.frame_launches = 0
+        self.frame_wins = 0
+        
+    def begin(self, job, nodes, screen_x, screen_y, samples):
+        """ Start watching a frame
+        
+        Arguments:
+            job         -   utils.MsgWrapper - the render command for the frame
+            nodes       -   iterable  - uuids of the nodes rendering the frame
+            screen_x    -   float   - width of the image in pixels
+            screen_y    -   float   - height of the image in pixels
+            samples     -   int     - samples per pixel
+        """
+        
+        self.clear()
+        
+        # what's still outstanding from before the last frame isn't coming
+        self.frame_count += 1
+        
+        for nodes in (self.cancelled, self.stale):
+            for node_uuid in [node for node, (frame, region) in nodes.items() 
+                                if frame < self.frame_count - 1]:
+                nodes.pop(node_uuid)
+        
+        self.active = True
+        self.job = job
+        self.nodes = set(nodes)
+        self.screen_x = screen_x
+        self.screen_y = screen_y
+        self.samples = samples
+        
+    def predict(self, machine, coords):
+        """ Return the seconds machine is expected to take to render coords
+        """
+        
+        pixels = (coords[1] - coords[0]) * (coords[3] - coords[2]) *\
+            self.screen_x * self.screen_y
+            
+        return machine.t_s + machine.k * pixels * self.samples
+        
+    def start(self, node_uuid, region, coords, predicted):
+        """ Record that a node has been sent a region, a copy if it already had one
+        """
+        
+        if not self.active: return
+        
+        if region in self.owners:
+            self.launches += 1
+            self.frame_launches += 1
+        else:
+            self.owners[region] = node_uuid
+            
+        self.regions[region] = coords
+        self.assigned[node_uuid] = region
+        self.given.add(node_uuid)
+        self.running[node_uuid] = [time.perf_counter(), predicted, 0.0]
+        
+    def update(self, node_uuid, fraction):
+        """ Record the fraction of its region a node has rendered so far
+        """
+        
+        entry = self.running.get(node_uuid)
+        
+        if entry is not None:
+            entry[2] = fraction
+            
+    def rendered(self, node_uuid):
+        """ Record that a node has finished rendering, its result is downloading
+        """
+        
+        self.running.pop(node_uuid, None)
+        
+    def copies(self, region):
+        """ Return the uuids of the nodes with a copy of region not yet accepted
+        """
+        
+        return [node for node, reg in self.assigned.items() if reg == region]
+        
+    def remaining(self, node_uuid, now = None):
+        """ Return the seconds a node is expected to need to finish its region
+        """
+        
+        if now is None: now = time.perf_counter()
+        
+        started, predicted, fraction = self.running[node_uuid]
+        
+        if fraction <= 0.0: return float('inf')
+        
+        return (now - started) * (1.0 - fraction) / fraction
+        
+    def stragglers(self, now = None):
+        """ Return the uuids of late nodes that have no copy of their region yet
+        
+        The most overdue, relative to their predicted time, come first.
+        """
+        
+        if now is None: now = time.perf_counter()
+        
+        late = []
+        
+        for node_uuid, (started, predicted, fraction) in self.running.items():
+            
+            if len(self.copies(self.assigned[node_uuid])) > 1: continue
+            
+            elapsed = now - started
+            
+            if elapsed > self.slowdown * predicted and fraction < self.progress:
+                late.append((elapsed / max(predicted, 1e-9), node_uuid))
+                
+        return [node_uuid for overdue, node_uuid in sorted(late, reverse = True)]
+        
+    def next_check(self, now = None):
+        """ Return the perf_counter time the next node will be late, None if none will
+        """
+        
+        if now is None: now = time.perf_counter()
+        
+        due = [started + self.slowdown * predicted 
+            for node_uuid, (started, predicted, fraction) in self.running.items()
+            if fraction < self.progress and 
+                started + self.slowdown * predicted > now and
+                len(self.copies(self.assigned[node_uuid])) == 1]
+                
+        return min(due) if due else None
+        
+    def accept(self, node_uuid, region = None):
+        """ Decide whether to use a result from a node
+        
+        Arguments:
+            node_uuid   -   string  - the node, or render slot, the result is from
+            region      -   int     - the region the result is of if the msg 
+                                        says, a tile's number, or None
+        
+        Returns:
+            tuple   -   (boolean - True if this is the first result for the region,
+                        string - uuid of the region's owner, 
+                        list - uuids of nodes still rendering a copy of the region,
+                            they should be cancelled)
+        
+        Description:
+            Results from nodes that were never given a region through this class
+            are always accepted, so a frame renders as before when speculation is
+            off. A result is dropped if another copy of its region was accepted
+            first, which includes a cancelled copy that finished before the
+            cancel reached its node, no failure will come for that one.
+        """
+        
+        # a node taking tiles from a queue may have been given another tile since
+        for superseded in (self.stale, self.cancelled):
+            
+            entry = superseded.get(node_uuid)
+            
+            if entry is not None and (region is None or region == entry[1]):
+                superseded.pop(node_uuid)
+                return False, node_uuid, []
+                
+        if region is not None and region in self.done:
+            return False, node_uuid, []
+        
+        region = self.assigned.pop(node_uuid, None)
+        self.running.pop(node_uuid, None)
+        
+        if region is None: 
+            return node_uuid not in self.given, node_uuid, []
+            
+        if region in self.done: return False, node_uuid, []
+        
+        self.done.add(region)
+        
+        if node_uuid != self.owners[region]:
+            self.wins += 1
+            self.frame_wins += 1
+            
+        losers = []
+        
+        for node in self.copies(region):
+            
+            self.assigned.pop(node)
+            
+            if self.running.pop(node, None) is not None:
+                losers.append(node)
+                self.cancelled[node] = (self.frame_count, region)
+            else:
+                self.stale[node] = (self.frame_count, region)
+                
+        return True, self.owners[region], losers
+        
+    def drop(self, node_uuid):
+        """ Stop using a node whose render failed
+        
+        Returns:
+            boolean - True if another node is still working on the node's region
+        """
+        
+        self.nodes.discard(node_uuid)
+        self.running.pop(node_uuid, None)
+        
+        region = self.assigned.pop(node_uuid, None)
+        
+        return region is not None and bool(self.copies(region))
+        
+    def was_cancelled(self, node_uuid):
+        """ Return True, once, if node_uuid's render was cancelled by accept
+        """
+        
+        return self.cancelled.pop(node_uuid, None) is not None
+        
+        
+def result_bytes_per_pixel(channels, exr_codec, color_depth = '32'):
+    """ Return the expected size in bytes per pixel of a rendered exr
+    
+    Arguments:
+        channels        -   int     - channels in all render passes and layers 
+        exr_codec       -   string  - codec the exr is saved with
+        color_depth     -   string  - '16' for half float, '32' for full float
+    """
+    
+    bytes_per_channel = 2 if color_depth == '16' else 4
+    
+    return channels * bytes_per_channel * EXR_CODEC_RATIO.get(exr_codec, 1.0)
+    
+    
+def calculate_optimal_render_area(machines, screen_x, screen_y, samples, 
+                                  bytes_per_pixel = 0.0):
+    """ Calculate the optimal screen area for each node based on their performance
+    
+    Arguments:
+        machines    -   py_dict -   Collection of currently available render nodes
+        screen_x    -   int     -   image resolution in x direction
+        screen_y    -   int     -   image resolution in y direction
+        samples     -   int     -   number of pixel samples that will be taken
+        bytes_per_pixel - float -   expected size of the result per pixel, see 
+                                    result_bytes_per_pixel
+    
+    Returns:
+        py_dict     {node_uuid - string - unique id for a render node : 
+                            Ai - float - proportion of the
+                                        total screen area that the node will render}
+                                    
+    Side Effects:
+        None
+    Exceptions Raised:
+        None
+    Description: 
+        This method takes the stored performance data in each machine passed via the
+        machines argument, and calculates firstly a To. To is an estimated optimum time
+        that if all machines finish in, will be the fastest possible render time. It then
+        uses this value to calculate the amount of screen area to give to each machine 
+        so that it will finish in time To. 
+        
+        A node's time includes sending its result back. Kx is the time to transfer
+        the result per pixel sample, from the node's measured bandwidth, so a 
+        node behind a slow link gets less of the screen and all nodes' results 
+        are in at about the same time. Nodes without a measurement, like the 
+        local node, have no transfer time.
+        
+    """
+    
+    ##### CALCULATE OPTIMAL RENDER TIME #######
     
     Ts = {uuid:machine.t_s for uuid, machine in machines.items()}
     K = {uuid:machine.k for uuid, machine in machines.items()}
-    #This needs to use actual data for transit time
-    Kx = {uuid:0.0 for uuid, machine in machines.items()} 
+    Kx = {uuid:bytes_per_pixel / (machine.bandwidth * samples)\
+            if getattr(machine, 'bandwidth', 0.0) > 0.0 and samples > 0 else 0.0\
+          for uuid, machine in machines.items()} 
     
      #A is the total 'area' to be rendered, but we calculate area 
      # as the area in pixels multiplied by how many times each pixel is to 
@@ -715,55 +1943,207 @@ def calculate_optimal_render_area(machines, screen_x, screen_y, samples):
     to  = A / sum_expr_1 + sum_expr_2 / sum_expr_1
     
     ##### CALCULATE NUM PIXELS FOR EACH NODE #######
-    # We need this result to be a dimensionless fraction of the total screen area
-    node_num_pix_columns = {uuid:
-        int(round( 
-            ((to - Ts[uuid]) / (Kx[uuid] + K[uuid]) / samples ) // screen_y))\
+    # The ideal number of pixel columns for each node, rounded to whole columns
+    # that add up to the screen width with at least one column each.
+    node_ideal_columns = {uuid:
+            (to - Ts[uuid]) / (Kx[uuid] + K[uuid]) / samples / screen_y\
          for uuid in machines}
     
-    node_pix_columns = [v for v in node_num_pix_columns.values()]
+    node_num_pix_columns = allocate_largest_remainder(
+        node_ideal_columns, int(screen_x), minimum = 1)
+    
+    return node_num_pix_columns
     
-    diff = screen_x - sum(node_pix_columns)
     
-    #We use diff as a 'bank' to make all nodes with 0 columns have 
-    # at least one col, then start taking from the nodes with the most
-    # cols until all nodes have at least one
+def allocate_largest_remainder(shares, total, minimum = 1):
+    """ Split a whole number of units between nodes in proportion to their shares
     
-    while diff or min([v for v in node_num_pix_columns.values()]) < 1:
+    Arguments:
+        shares      -   py_dict -   {node_uuid: float share}, shares below zero 
+                                    count as zero
+        total       -   int     -   number of units to split, e.g. pixel columns
+        minimum     -   int     -   units every node gets, lowered to 
+                                    total // len(shares) if there aren't enough
+    
+    Returns:
+        py_dict     {node_uuid: int units}, the units sum to total
+    
+    Side Effects:
+        None
+    Exceptions Raised:
+        None
+    Description:
+        Largest remainder method. Every node gets its minimum first, the rest 
+        is divided in proportion to the shares, each node gets the whole part 
+        of its quota and the units left over go one each to the nodes with the 
+        largest fractional parts. No node ends up more than one unit from its
+        quota of the rest, and the cost is one sort however far the shares are
+        from the total. If every share is zero the units are split evenly.
         
-        node_keys_sorted_by_pixel_cols = \
-            [k for k, v in sorted(node_num_pix_columns.items(), 
-                key= lambda item: item[1])]
+        bisect_screen uses it for each cut, so tiles in 2D get the same 
+        guarantees for their areas.
         
-        if diff > 0:
-            
-            diff -= 1
-            
-            node_num_pix_columns[node_keys_sorted_by_pixel_cols[0]] += 1 
-            
-            print("ADDING :", 1, " Pixel columns")
-            
-        elif diff < 0:
+    """
+    
+    if not shares: return {}
+    
+    minimum = max(0, min(minimum, total // len(shares)))
+    spare = total - minimum * len(shares)
+    
+    weights = {uuid:max(share, 0.0) for uuid, share in shares.items()}
+    weight_sum = sum(weights.values())
+    
+    if weight_sum <= 0.0:
+        weights = {uuid:1.0 for uuid in shares}
+        weight_sum = float(len(shares))
         
-            diff += 1
-            
-            node_num_pix_columns[node_keys_sorted_by_pixel_cols[-1]] += 1 
-            
-        else:
+    quotas = {uuid:spare * weight / weight_sum for uuid, weight in weights.items()}
+    
+    units = {uuid:minimum + int(floor(quota)) for uuid, quota in quotas.items()}
+    
+    left_over = max(0, total - sum(units.values()))
+    
+    by_remainder = sorted(quotas, 
+                          key = lambda uuid: quotas[uuid] - floor(quotas[uuid]),
+                          reverse = True)
+    
+    for uuid in by_remainder[:left_over]:
+        units[uuid] += 1
+        
+    return units
+    
 
-            if node_num_pix_columns[node_keys_sorted_by_pixel_cols[0]] ==\
-                node_num_pix_columns[node_keys_sorted_by_pixel_cols[-1]]:
-                print("ERROR: hmmm, looks like something broke.")
-                break
-            else:
-                #Robin hood protocol
-                #take from larget & give to smallest
-                node_num_pix_columns[node_keys_sorted_by_pixel_cols[-1]] -= 1
-                node_num_pix_columns[node_keys_sorted_by_pixel_cols[0]] += 1
+def bisect_screen(shares, x_0, x_1, y_0, y_1):
+    """ Divide a rectangle of pixels between nodes in proportion to their shares
+    
+    Arguments:
+        shares      -   list    -   [(node_uuid, share), ...], a share is any 
+                                    non negative weight, e.g. pixel columns
+        x_0, x_1    -   int     -   pixel bounds of the rectangle in x, x_1 exclusive
+        y_0, y_1    -   int     -   pixel bounds of the rectangle in y, y_1 exclusive
+    
+    Returns:
+        py_dict     {node_uuid - string - unique id for a render node : 
+                        (x_0, x_1, y_0, y_1) - int - pixel bounds of its tile}
+        None if the rectangle doesn't have enough pixels to give each node a tile
+    
+    Side Effects:
+        None
+    Exceptions Raised:
+        None
+    Description:
+        Recursive bisection. The nodes are split into two groups whose shares 
+        sum as near to equal as possible, then the rectangle is cut across its 
+        longer side in the ratio of the two groups' shares, and each half is 
+        divided between its group in the same way. Cutting the longer side 
+        keeps each tile close to square however many nodes there are, and every
+        node's area stays within a row or column of its share, apart from nodes
+        with tiny shares, which always get at least a line. A rectangle with a 
+        side at least as long as the number of nodes can always be divided.
+        
+    """
+    
+    if len(shares) == 1:
+        return {shares[0][0]:(x_0, x_1, y_0, y_1)}
+    
+    group_a, group_b = [], []
+    sum_a = sum_b = 0.0
+    
+    for share in sorted(shares, key = lambda item: item[1], reverse = True):
+        
+        if sum_a <= sum_b and len(group_a) < len(shares) - 1 or not group_a:
+            group_a.append(share)
+            sum_a += share[1]
+        else:
+            group_b.append(share)
+            sum_b += share[1]
+    
+    if sum_a + sum_b > 0.0:
+        fraction = sum_a / (sum_a + sum_b)
+    else:
+        fraction = len(group_a) / len(shares)
+        
+    width = x_1 - x_0
+    height = y_1 - y_0
+    
+    cut_x = width >= height and width > 1 or height < 2
+    
+    length, across = (width, height) if cut_x else (height, width)
+    
+    # each side of the cut gets a line for every node in its group, so each
+    # half still has a side as long as its number of nodes and can always be
+    # divided in turn. Without enough lines for that, enough for a pixel each.
+    if length >= len(shares):
+        min_a, min_b = len(group_a), len(group_b)
+    else:
+        min_a = ceil(len(group_a) / max(across, 1))
+        min_b = ceil(len(group_b) / max(across, 1))
+    
+    if min_a + min_b > length: return None
+    
+    lines = allocate_largest_remainder({0:fraction, 1:1.0 - fraction}, length, 
+                                       minimum = 0)[0]
+    lines = min(max(lines, min_a), length - min_b)
+    
+    if cut_x:
+        
+        tiles_a = bisect_screen(group_a, x_0, x_0 + lines, y_0, y_1)
+        tiles_b = bisect_screen(group_b, x_0 + lines, x_1, y_0, y_1)
+        
+    else:
+        
+        tiles_a = bisect_screen(group_a, x_0, x_1, y_0, y_0 + lines)
+        tiles_b = bisect_screen(group_b, x_0, x_1, y_0 + lines, y_1)
+        
+    if tiles_a is None or tiles_b is None:
+        return None
+        
+    tiles_a.update(tiles_b)
+    
+    return tiles_a
+    
+    
+def tile_coords(tile, screen_x, screen_y):
+    """ Return the screen coords (xmin, xmax, ymin, ymax) for a tile's pixel bounds
+    
+    Inner edges are pushed out by half the denoising buffer on each side, the
+    0.1 of a pixel keeps rounding from losing a row or column, see 
+    CrenderEngine.write_result
+    """
+    
+    half_buffer = denoising_xbuff / 2.0
+    
+    px_0, px_1, py_0, py_1 = tile
+    
+    x_min = 0.0 if px_0 == 0 else (px_0 - half_buffer + 0.1) / screen_x
+    x_max = 1.0 if px_1 == int(screen_x) else\
+        (px_1 + half_buffer + 0.1) / screen_x
+    y_min = 0.0 if py_0 == 0 else (py_0 - half_buffer + 0.1) / screen_y
+    y_max = 1.0 if py_1 == int(screen_y) else\
+        (py_1 + half_buffer + 0.1) / screen_y
+        
+    return (x_min, x_max, y_min, y_max)
+    
+    
+def split_screen(screen_x, screen_y, num_tiles):
+    """ Return the screen coords of num_tiles near square tiles of equal area
+    
+    The tiles are ordered bottom to top and left to right, so that the image 
+    fills in row by row. A screen too small to split is returned as one tile.
+    """
+    
+    tiles = bisect_screen([(i, 1.0) for i in range(max(1, num_tiles))], 
+                          0, int(screen_x), 0, int(screen_y))
+                          
+    if tiles is None:
+        return [FULL_FRAME]
+        
+    return [tile_coords(tile, screen_x, screen_y) for tile in 
+            sorted(tiles.values(), key = lambda tile: (tile[2], tile[0]))]
     
-    return node_num_pix_columns
  
-def screen_divide(machines, screen_x, screen_y, samples, manual_loadb, logger):
+def screen_divide(machines, screen_x, screen_y, samples, manual_loadb, logger,
+                  bytes_per_pixel = 0.0):
     """return screen coordinates (xmin, xmax, ymin, ymax) of n divisions
     
     Divides the screen into n sections and returns a list of tuples containing
@@ -773,6 +2153,7 @@ def screen_divide(machines, screen_x, screen_y, samples, manual_loadb, logger):
     n - int: number of divisions the screen dimensions should be divided into
     screen_x - int: the screen dimension in the x direction
     screen_y - int: the screen dimension in the y direction
+    bytes_per_pixel - float: expected size of the result per pixel
     """
     
     x_buffer = denoising_xbuff / screen_x
@@ -787,25 +2168,43 @@ def screen_divide(machines, screen_x, screen_y, samples, manual_loadb, logger):
             node.node_A_manual * screen_x for uuid, node in machines.items()}
     else:
         dict_num_pix = calculate_optimal_render_area(
-            machines, screen_x, screen_y, samples)
+            machines, screen_x, screen_y, samples, bytes_per_pixel)
         
         #We here assign the values just calculated to each node so they're visible 
         # in the user interface.  
         for uuid, mach in machines.items():
             mach.node_A_auto = dict_num_pix[uuid]
                                                 
-    # TODO:JIRA:CR-57 this method of screen division only creates divisions in the
-    # x axis, which means that the resulting divisions become very tall
-    # and skinny as the number of nodes increases. Our testing that 
-    # showed a quadratic relationship between division size and render
-    # time used near square divisions. We will want to upgrade this later 
-    # to create divisions vertically as well as horizontally.
-    
     grid = [mac for mac in machines.values()]
     
     #we don't want to have the same machine draw the same part of the screen each time
     shuffle(grid)
     
+    # CR-57, strips become very tall and skinny as the number of nodes increases,
+    # and our testing that showed a quadratic relationship between division size
+    # and render time used near square divisions. So by default the screen is 
+    # divided in both x and y, strips are kept as a fallback.
+    tiles = None
+    
+    if len(grid) > 1 and\
+        read_config_file([config.screen_layout])[config.screen_layout] == 'tiles':
+        
+        tiles = bisect_screen(
+            [(mac.machine_uuid, dict_num_pix[mac.machine_uuid]) for mac in grid],
+            0, int(screen_x), 0, int(screen_y))
+            
+    if tiles is not None:
+        
+        for machine in grid:
+            
+            machine.screen_coords = tile_coords(
+                tiles[machine.machine_uuid], screen_x, screen_y)
+            
+            logger.info("screen_divide" + l_sep + " NODE: " + 
+                str(machine.node_name) + " : " + str(machine.machine_uuid) +
+                "  screen coords: " + str(machine.screen_coords))
+                  
+        return machines
     
     for i in range(0, len(grid)):
         
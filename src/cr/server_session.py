@@ -22,7 +22,6 @@ import sys, bpy, time, json, time, os, subprocess, atexit, signal, platform
 from tempfile import TemporaryDirectory
 from mathutils import Vector, Euler, Color
 from collections import deque
-from statistics import median, mean
 from contextlib import redirect_stdout
 from . import hash_tree, rules, utils, network_engine, config, render
 #from . import unit_tests#TODO: Unit testing... generally...
@@ -42,6 +41,7 @@ import faulthandler
 MAIN_PROJECT_FILE = 0
 crowdrender = sys.modules[__package__]
 SESSION_FILES = 1
+PARTIAL_DIR = '.partial' # where interrupted uploads are kept so they can resume
 
 if platform.system() in ('Darwin', 'Linux'):
     BIG_OOPS_SIGNALS = [
@@ -110,7 +110,7 @@ class CRServerSession :
                     utils.node_uuid:self.machine_uuid}
                     )
         
-            self.ssp_cip_pubsub.send_string(json.dumps(status_msg.serialize()))
+            utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(status_msg.serialize()))
             
             
     status = property(fget = get_status, fset = set_status)
@@ -127,6 +127,8 @@ class CRServerSession :
         # self.last_render_time = 0.0
         # self.last_draw_time = 0.0
         self.render_processes = []
+        self.render_targets = {} # render target uuid : the process rendering it
+        self.render_workers = {} # render slot, None for the whole node : worker
         self.node_name = utils.get_computer_name()
         self.undo_active = False
         
@@ -342,8 +344,17 @@ class CRServerSession :
                 utils.retry:retry,
                 utils.command:utils.open_blend_file,
                 utils.cancelled_command:utils.cancel_upload,
-                utils.node_uuid:self.file_requester.server_router_id}
+                utils.node_uuid:self.file_requester.server_router_id,
+                utils.use_chunk_store:True,
+                utils.use_swarm:True,
+                utils.resume_path:os.path.join(self.session_path, PARTIAL_DIR),
+                utils.priority:network_engine.PRIORITY_SYNC}
             )
+            
+        # On a resync we usually still have the last version of the file, only the
+        # parts that have changed since then need to be transferred.
+        if os.path.exists(self.blend_file):
+            get_file_msg.attributes[utils.delta_base] = self.blend_file
         
         
         self.file_req_sock.send_json(get_file_msg.serialize())
@@ -356,7 +367,7 @@ class CRServerSession :
                 utils.node_uuid:self.machine_uuid
                 })
         
-        self.ssp_cip_pubsub.send_string(
+        utils.send_msg_string(self.ssp_cip_pubsub, 
             json.dumps(
                 upload_task_begin_msg.serialize()
                     )
@@ -484,7 +495,7 @@ class CRServerSession :
                     utils.node_uuid:self.machine_uuid}
                                          )
             
-            self.ssp_cip_pubsub.send_string(
+            utils.send_msg_string(self.ssp_cip_pubsub, 
                 json.dumps(
                     upload_task_fin.serialize()))
             #if there are retries left, we can try again, if not then we exit
@@ -502,7 +513,7 @@ class CRServerSession :
                     utils.node_uuid:self.machine_uuid}
                                          )
             
-            self.ssp_cip_pubsub.send_string(
+            utils.send_msg_string(self.ssp_cip_pubsub, 
                 json.dumps(
                     upload_task_fin.serialize()))
             
@@ -533,11 +544,11 @@ class CRServerSession :
                 )
                 
                 
-            self.ssp_cip_pubsub.send_string(
+            utils.send_msg_string(self.ssp_cip_pubsub, 
                 json.dumps(
                     update_render_stats.serialize()))
             
-            self.ssp_cip_pubsub.send_string(
+            utils.send_msg_string(self.ssp_cip_pubsub, 
                 json.dumps(
                     reset_file_upload_progress.serialize()))
             
@@ -688,7 +699,7 @@ class CRServerSession :
             if self.cip_ssp_pubsub in socks:
             
                 cip_ssp_pubsub_message = MsgWrapper.deserialize( 
-                    self.cip_ssp_pubsub.recv_string())
+                    utils.recv_msg_string(self.cip_ssp_pubsub))
             
                 msg_uuid = cip_ssp_pubsub_message.attributes[utils.message_uuid]
                 # avoid duplicate messages due to TCP retransmit on pub sub socks
@@ -770,7 +781,7 @@ class CRServerSession :
                  #the renderthread only sends stats, so we merely pass the msg
                 # on, no need to decode it.
                 msg = self.render_thread_sock.recv_string()
-                self.ssp_cip_pubsub.send_string(msg)
+                utils.send_msg_string(self.ssp_cip_pubsub, msg)
                 
                 unserial_msg = MsgWrapper.deserialize(msg)
                 
@@ -782,21 +793,20 @@ class CRServerSession :
                     
                 elif unserial_msg.message == utils.finished_tile:
                     
-                    self.status = utils.synced
-                    for proc in self.render_processes:
-                        stdout, stderr = proc.communicate()
-                    self.render_processes.clear()
+                    target = self.render_finished(unserial_msg)
+                    
                     self.logger.info("Received " + unserial_msg.message +\
                                     " message" + l_sep + " Setting status to "+\
-                                    " synced " + l_sep + str(utils.synced))
+                                    utils.states[self.status])
                 
-                    self.k = unserial_msg.attributes.get(utils.k, 1.0)
-                    self.t_s = unserial_msg.attributes.get(utils.t_s, 0.1)
+                    # a slot's estimates are its own, kept by the client
+                    if target == self.machine_uuid:
+                        self.k = unserial_msg.attributes.get(utils.k, 1.0)
+                        self.t_s = unserial_msg.attributes.get(utils.t_s, 0.1)
                 
                 elif unserial_msg.message == utils.render_failed:
                 
-                    self.render_processes.clear()
-                    self.status = utils.synced
+                    self.render_finished(unserial_msg, wait = False)
                     self.logger.warning("CRServerSession.process_msgs" +\
                         "render failed, heres the error msg: "+\
                         l_sep.join(unserial_msg.attributes[utils.error_message])
@@ -860,6 +870,10 @@ class CRServerSession :
         
         self.temp_dir.cleanup()
         
+        for worker in self.render_workers.values():
+            worker.stop()
+        self.render_workers.clear()
+        
         # Log that we're exiting
         self.logger.info('Shutting down, saving file...')
         
@@ -938,9 +952,16 @@ class CRServerSession :
             utils.make_hash_tree:self.make_hash_tree,
             utils.recv_fail:self.handle_file_recv_fail,
             utils.progress_update:self.send_transfer_prog,
-            utils.cancel_upload:self.cancel_upload
+            utils.cancel_upload:self.cancel_upload,
+            utils.swarm_peers:self.swarm_peers
             }
     
+    def swarm_peers(self, msg):
+        """ Pass the file server endpoints of the other render nodes to the requester
+        """
+        
+        self.file_req_sock.send_json(msg.serialize())
+        
     def cancel_upload(self, msg):
         """ Cleanup on cancelling an upload
         """
@@ -989,7 +1010,7 @@ class CRServerSession :
         """
         msg.attributes[utils.status] = utils.uploading
         
-        self.ssp_cip_pubsub.send_string(json.dumps(msg.serialize()))
+        utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(msg.serialize()))
                     
     def handle_ssp_hello(self, msg):
         """ Respond to a hello msg, used when establishing connections
@@ -1016,7 +1037,7 @@ class CRServerSession :
             response_msg = MsgWrapper(message = utils.hello,
                 attributes = {utils.machine_uuid:self.machine_uuid})
                             
-            self.ssp_cip_pubsub.send_string(json.dumps(response_msg.serialize()))
+            utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(response_msg.serialize()))
         
             self.logger.info("CRServerSession.handle_hello: " + l_sep +\
                     "responding to hello request from client..")
@@ -1068,7 +1089,7 @@ class CRServerSession :
                 utils.render_stats:[[0, "starting..."]],
                 utils.machine_uuid:self.machine_uuid,
                 utils.state:utils.rendering})
-            self.ssp_cip_pubsub.send_string(json.dumps(update_msg.serialize()))
+            utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(update_msg.serialize()))
         
         views = msg.attributes[utils.views]
         samples = msg.attributes[utils.eng_samples]
@@ -1097,6 +1118,30 @@ class CRServerSession :
         output_path = os.path.join(
             self.output_path, scene_name + "_" + self.machine_uuid)
         
+        # a node divided into render slots renders a tile in each at once, every
+        # slot with its own share of the node's devices and CPU cores
+        slot = msg.attributes.get(utils.render_slot)
+        target = msg.attributes.get(utils.render_target) or self.machine_uuid
+        cores = None
+        
+        if slot is not None:
+            
+            compute_devices, threads, cores = render.partition_devices(
+                compute_device, compute_devices, threads, slot, 
+                node.get(utils.render_slots, 1))
+                
+            output_path += "_slot" + str(slot) + "_"
+        
+        # tiles taken from a queue need their own file, the last one may still
+        # be downloading when the next one is saved
+        if msg.attributes.get(utils.tile_no) is not None:
+            output_path += "_tile" + str(msg.attributes[utils.tile_no]) + "_"
+        
+        # as do frames taken from a queue, the next frame is sent as soon as the
+        # last is rendered, while the file server may still be reading it
+        if msg.attributes.get(utils.first_frame) is not None:
+            output_path += "_frame" + str(msg.attributes[utils.current_frame]) + "_"
+        
         
         self.current_frame = msg.attributes[utils.current_frame]
         start_frame, end_frame = msg.attributes[utils.frame_range]
@@ -1104,13 +1149,14 @@ class CRServerSession :
          
         bpy.data.use_autopack = False
         
-        if not is_animation:
+        if not is_animation and msg.attributes.get(utils.first_tile, True):
         
             self.logger.info("saving main file")
         
             bpy.ops.wm.save_as_mainfile(filepath = self.blend_file, compress= False)
             
-        elif is_animation and self.current_frame == start_frame:
+        elif is_animation and (self.current_frame == start_frame or\
+                msg.attributes.get(utils.first_frame, False)):
             
             self.logger.info("saving main file")
         
@@ -1124,14 +1170,28 @@ class CRServerSession :
         
         ## CREATE RENDER PPROCESS
             
-        process = create_render_process(
-            self.load_trusted, coords, tile_x, 
-            tile_y, compute_device, compute_devices, threads,
-            self.blend_file, output_path, engine, img_output_fmt, 
-            self.current_frame, exr_codec,
-            self.logger, scene_name)
+        if utils.read_config_file([config.render_workers])[config.render_workers]:
+            
+            self.render_workers[slot] = render.render_worker(
+                self.render_workers.get(slot), self.load_trusted, self.blend_file,
+                self._hash_tree.top_hash, scene_name, self.logger, cores)
+                
+            process = self.render_workers[slot].render(
+                coords, tile_x, tile_y, compute_device, compute_devices, threads,
+                output_path, engine, img_output_fmt, self.current_frame, 
+                exr_codec, msg.attributes[utils.screen_res], samples)
+                
+        else:
+            
+            process = create_render_process(
+                self.load_trusted, coords, tile_x, 
+                tile_y, compute_device, compute_devices, threads,
+                self.blend_file, output_path, engine, img_output_fmt, 
+                self.current_frame, exr_codec,
+                self.logger, scene_name, cores)
             
         self.render_processes.append(process)
+        self.render_targets[target] = process
         
         render.CRRenderThread(
             msg.t_uuid, 
@@ -1143,10 +1203,40 @@ class CRServerSession :
             msg.attributes[utils.screen_res], 
             engine, 
             samples, 
-            views = views)
+            views = views,
+            target = target)
+        
+    def render_finished(self, msg, wait = True):
+        """ Forget the process of a render target that has finished or failed
+        
+        Arguments:
+            msg     -   utils.MsgWrapper - finished_tile or render_failed msg from 
+                                            a CRRenderThread
+            wait    -   boolean - wait for the process to exit
+        
+        Returns:
+            string  - uuid of the render target the msg is for
+        Side Effects:
+            Sets the status back to synced once no render target is busy
         
+        """
         
+        target = msg.attributes.get(utils.render_target) or self.machine_uuid
         
+        process = self.render_targets.pop(target, None)
+        
+        if process is not None:
+            
+            if wait: process.communicate()
+            
+            if process in self.render_processes:
+                self.render_processes.remove(process)
+                
+        if not self.render_targets:
+            self.render_processes.clear()
+            self.status = utils.synced
+            
+        return target
         
     def cancel_render(self, msg):
         """ does what it says on the tin...
@@ -1155,8 +1245,32 @@ class CRServerSession :
         # if this is the local machine, just kill the process that is currently
         # rendering, or all of them if there's more than one. 
         
+        # the client cancels a late node's copy of a region by naming the node,
+        # only the user's cancel is for every node
+        if msg.attributes.get(utils.machine_uuid, self.machine_uuid) !=\
+                self.machine_uuid:
+            return
+        
+        # only one render slot's render is cancelled when the client has 
+        # received its region from another node
+        target = msg.attributes.get(utils.render_target)
+        
+        # the slot has already finished, the node's other slots keep rendering
+        if target is not None and target not in self.render_targets:
+            return
+        
+        if target is not None:
             
+            process = self.render_targets[target]
+            process.kill()
             
+            try:
+                process.communicate(timeout = 1)
+            except:
+                self.logger.error("CRServerMachine:cancel_rendering:" +\
+                                     "error when trying to cancel render proc.")
+                                     
+            return
             
         for proc in self.render_processes:
             
@@ -1171,6 +1285,7 @@ class CRServerSession :
             
         self.status = utils.synced
         self.render_processes.clear()
+        self.render_targets.clear()
         
         # for remote nodes, send the cancel msg.    
     
@@ -1207,10 +1322,6 @@ class CRServerSession :
         
         self.session_uuid = msg.s_uuid
         
-        self.get_load_balance_variables('CYCLES') #Making the assumption that most
-        # will want to use cycles, though in 2.8 this will have to change to EEVEE 
-        # probably since eevee is the default engine on opening blender 2.8
-        
         #override the machine uuid if this is a cloud based instance running on virtual 
         # hardware
         if access_key != '':
@@ -1218,8 +1329,14 @@ class CRServerSession :
                 " overriding machine uuid with supplied access_key: " +\
                 str(access_key))
             self.machine_uuid = access_key
-                
         
+        # perf data is kept per machine uuid, so this has to wait for the override
+        self.get_load_balance_variables('CYCLES') #Making the assumption that most
+        # will want to use cycles, though in 2.8 this will have to change to EEVEE 
+        # probably since eevee is the default engine on opening blender 2.8
+                
+        # files this node is receiving that other render nodes can fetch from it
+        self.swarm_files = network_engine.CRSwarmFiles()
         
         self.file_requester = network_engine.CRFileRequest(
                                            'server_node',
@@ -1233,7 +1350,17 @@ class CRServerSession :
                                            start_port = self.start_port,
                                            port_range = self.port_range,
                                            local_public_key = self.server_key_pub,
-                                           local_sec_key = self.server_key_secret
+                                           local_sec_key = self.server_key_secret,
+                                           chunk_store_path = os.path.join(
+                                               utils.get_cr_path(), 'chunk_store'),
+                                           chunk_store_size = 1024 * 1024 *\
+                                               utils.read_config_file(
+                                                   [config.chunk_store_size]
+                                                   )[config.chunk_store_size],
+                                           swarm_files = self.swarm_files,
+                                           compression = utils.read_config_file(
+                                               [config.file_compression]
+                                               )[config.file_compression]
                                            )
                                            
         self.file_server = network_engine.CRFileServer(
@@ -1247,7 +1374,8 @@ class CRServerSession :
                                             self.network_timeout,
                                             local_addresses= local_addresses,
                                             local_public_key = self.server_key_pub,
-                                            local_sec_key = self.server_key_secret
+                                            local_sec_key = self.server_key_secret,
+                                            swarm_files = self.swarm_files
                                             )   
                                                    
         # send all available endpoints to the client and let it decide which it can
@@ -1520,8 +1648,8 @@ class CRServerSession :
             None
         
         Side Effects:
-                Reads relevant data from the conf file and sets values for
-                k and t_s.
+                Reads relevant data from the render perf store and sets values 
+                for k and t_s.
                 
         Description:
             This function extracts the relvant render performance data, k and Ts which are
@@ -1537,30 +1665,16 @@ class CRServerSession :
         
         s_uuid = self.session_uuid.decode('utf-8')
         
-        perf_data = utils.read_config_file([config.node_perf_data])
-        
         self.logger.info("Reading load balance variables")
         
-        data = perf_data[config.node_perf_data].get(s_uuid)
+        estimate = render.perf_store().get(s_uuid, engine, self.machine_uuid)
         
-        if data is not None and isinstance(data, dict): # added additional check for 
-                                        # data being of type dict for older versions 
-                                        # storing incompatible data in a list
-                                        
-            eng_data = data.get(engine)
-            if eng_data is not None:    
-                self.t_s = eng_data[1]
-                k_all = eng_data[0]
-                self.k = mean(k_all) #store and send only mean value of K
-            
-            # The session exists but the engine hasn't been used on this scene before
-            else:
-                self.k = 1.0
-                self.t_s = 0.1
-        # No data at all for this session.  
-        else:
+        # No data for this node rendering the session with this engine yet
+        if estimate is None:
             self.k = 1.0
             self.t_s = 0.1
+        else:
+            self.k, self.t_s = estimate
             
             
     
@@ -1596,7 +1710,7 @@ class CRServerSession :
                             utils.missing_block:node_uuid,
                             utils.repair_message:"Missing datablock"}
                                 )
-                self.ssp_cip_pubsub.send_string(json.dumps(repair_msg.serialize()))
+                utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(repair_msg.serialize()))
                 continue
             
             attrib_hashes = node_data[utils.attribute_hashes]
@@ -1652,7 +1766,7 @@ class CRServerSession :
                     
                     
                                         
-                    self.ssp_cip_pubsub.send_string(json.dumps(repair_msg.serialize()))
+                    utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(repair_msg.serialize()))
             
                 #if we find an attribute with the wrong hash value we log it.
                 
@@ -1694,7 +1808,7 @@ class CRServerSession :
                                 utils.repair_item:server_node.name,
                                 utils.repair_attr:attr,
                                 utils.repair_message:"Incorrect Data"})
-                            self.ssp_cip_pubsub.send_string(
+                            utils.send_msg_string(self.ssp_cip_pubsub, 
                                 json.dumps(repair_msg.serialize()))
                     
                         if self._hash_tree.top_hash == client_top_hash:
@@ -1728,7 +1842,7 @@ class CRServerSession :
                                 utils.repair_attr:attr,
                                 utils.repair_message:"Unable to Sync"})
                                 
-                        self.ssp_cip_pubsub.send_string(
+                        utils.send_msg_string(self.ssp_cip_pubsub, 
                                 json.dumps(err_msg.serialize()))
                             
         #Ideally the hash_tree has been repaired by the time we get here
@@ -1767,7 +1881,7 @@ class CRServerSession :
                             utils.repair_item:err_msg}
                                 )
             
-                self.ssp_cip_pubsub.send_string(json.dumps(repair_msg.serialize()))
+                utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(repair_msg.serialize()))
                             
             else:
                 
@@ -1799,7 +1913,7 @@ class CRServerSession :
                                 utils.node_uuid:nodes_to_request}
                                                 )
                                                 
-        self.ssp_cip_pubsub.send_string(json.dumps(
+        utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(
                             rqst_attrib_hashes.serialize()))
     
                  
@@ -1820,7 +1934,7 @@ class CRServerSession :
             s_uuid = self.session_uuid,
             attributes = {utils.machine_uuid:self.machine_uuid})
         
-        self.ssp_cip_pubsub.send_string(json.dumps(
+        utils.send_msg_string(self.ssp_cip_pubsub, json.dumps(
                                             rqst_nodes.serialize()))
                                             
             
@@ -393,6 +393,13 @@ class CRNodes(bpy.types.PropertyGroup):
         description = "Number of CPU threads to use simultaneously while rendering",
         default = 0,
         min=0, max=65536)                                        
+        
+    render_slots: bpy.props.IntProperty(
+        name = "render_slots",
+        description = "Number of tiles a render node renders at once, each with "+\
+                    "its share of the node's GPUs and CPU cores",
+        default = 1,
+        min=1, max=16)
                         
     node_A_manual:  bpy.props.FloatProperty(
         name = "node manual render tile size",
@@ -495,6 +502,18 @@ class CrowdRenderSceneSettings(bpy.types.PropertyGroup):
         name = "load balancer manual",
         description ="true if the load balancer is in manual mode",
         default = False)
+        
+    dynamic_tiles:  BoolProperty(
+        name = "Share tiles dynamically",
+        description ="Split each frame into many small tiles that nodes take"+\
+        " as they finish, instead of one region per node sized in advance",
+        default = False)
+        
+    frame_distribution:  BoolProperty(
+        name = "Render animations by frame",
+        description ="Nodes render whole frames of an animation from a shared"+\
+        " queue instead of each frame being split between all nodes",
+        default = False)
             
             
     active_load_balance_node:  StringProperty(
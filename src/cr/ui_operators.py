@@ -129,6 +129,8 @@ operator_ptr = 'operator_ptr'
 upload_tasks = {}
 #
 EVENT_TIMER_DURATION = 0.032
+MSG_POLL_TIMEOUT = 10 # millisecs the msg thread waits on its sockets
+MSG_TICK_BUDGET = 0.008 # secs of each timer tick that can be spent handling msgs
 ### request bus
 request_queue = deque()
 
@@ -294,6 +296,171 @@ class CRListDict(collections.UserList):
         super(CRListDict, self).append((value, dictionary))
 
 
+class CROutbox:
+    """ Stands in for a socket owned by a CRMsgThread on the main thread
+
+    Description:
+    zmq sockets must only be used by the thread that owns them, so code on
+    Blender's main thread sends through this object instead. Messages are put
+    on the owning thread's outbox deque and sent on its next pass.
+    """
+
+    def __init__(self, msg_thread, conn_name):
+
+        self.msg_thread = msg_thread
+        self.conn_name = conn_name
+
+    def send_string(self, string):
+
+        self.msg_thread.outbox.append((self.conn_name, string))
+
+    def close(self, linger = 0):
+
+        self.msg_thread.stop()
+
+
+class CRMsgThread(threading.Thread):
+    """ Owns the CLI's sockets, receives and decodes msgs away from the UI thread
+
+    Description:
+    Decoding every msg from the CIP and SIP on Blender's main thread adds to the
+    time it takes to draw the UI, especially when many nodes are uploading and
+    sending progress updates. This thread polls the sockets, deserialises each
+    msg and puts it in the inbox deque for CRMain to handle. Progress updates are
+    coalesced per node so that only the latest one is handled, in the position
+    of the first that arrived. CRMain handles msgs from the inbox within a time
+    budget each tick so a burst of msgs can't stall the UI.
+
+    The deques are the only state shared between the threads, their append and
+    popleft methods are atomic so no locking is needed for them.
+    """
+
+    def __init__(self, connections, logger):
+
+        threading.Thread.__init__(self, daemon = True)
+
+        self.connections = connections
+        self.logger = logger
+        self.inbox = deque()
+        self.outbox = deque()
+        self.latest_progress = {}
+        self.progress_lock = threading.Lock()
+        self.running = False
+
+        self.poller = zmq.Poller()
+
+        for conn in self.connections.values():
+            self.poller.register(conn, zmq.POLLIN)
+
+    def stop(self):
+
+        self.running = False
+
+    def run(self):
+
+        self.running = True
+
+        while self.running:
+
+            try:
+
+                self.send_msgs()
+
+                events = dict(self.poller.poll(MSG_POLL_TIMEOUT))
+
+                for conn in self.connections.values():
+
+                    if conn in events:
+
+                        self.recv_msgs(conn)
+
+            except zmq.ZMQError as e:
+
+                if e.errno == zmq.ETERM: break
+
+                handle_generic_except(location = "CRMsgThread.run",
+                    log_string = "Unexpected zmq error while processing msgs",
+                    logger = self.logger)
+
+            except:
+
+                handle_generic_except(location = "CRMsgThread.run",
+                    log_string = "Unknown error while attempting to process msgs",
+                    logger = self.logger)
+
+        for conn in self.connections.values():
+
+            self.poller.unregister(conn)
+            conn.close(linger = 0)
+
+    def send_msgs(self):
+        """ Send everything the main thread has put in the outbox """
+
+        outbox_popleft = self.outbox.popleft
+
+        while self.outbox:
+
+            conn_name, string = outbox_popleft()
+
+            self.connections[conn_name].send_string(string)
+
+    def recv_msgs(self, conn):
+        """ Receive up to a PIPELINE's worth of msgs from conn and queue them
+        """
+
+        # get more than one message, but no more than a maximum
+        # amount, this helps clear the incoming msg buffer under
+        # times of heavy usage, like when lots of machines
+        # are uploading
+        getting_msgs = PIPELINE
+
+        while getting_msgs:
+
+            getting_msgs -= 1
+
+            try:
+
+                raw_msg = conn.recv_multipart(zmq.NOBLOCK)[0]
+
+            except zmq.ZMQError as e:
+
+                if e.errno == zmq.EAGAIN: break
+
+                raise
+
+            con_message = utils.MsgWrapper.deserialize(
+                json.loads(raw_msg.decode('utf-8'), object_hook = utils.as_BTObject))
+
+            if con_message.message == utils.progress_update:
+
+                node_uuid = con_message.attributes.get(utils.node_uuid)
+
+                with self.progress_lock:
+
+                    # only queue a place holder for the first update, later
+                    # ones just replace the msg it refers to.
+                    if not node_uuid in self.latest_progress:
+                        self.inbox.append((utils.progress_update, node_uuid))
+
+                    self.latest_progress[node_uuid] = con_message
+
+            else:
+
+                self.inbox.append((None, con_message))
+
+    def get_msg(self):
+        """ Return the next msg for the main thread or None if there isn't one
+        """
+
+        if not self.inbox: return None
+
+        coalesced, item = self.inbox.popleft()
+
+        if coalesced is None: return item
+
+        with self.progress_lock:
+
+            return self.latest_progress.pop(item)
 
 
 class PackLogs(bpy.types.Operator):
@@ -753,8 +920,8 @@ class CRMain(bpy.types.Operator):
 
         #wm.event_timer_remove(self.timer)
 
-        self.cli_cip_dealer.close(linger =0)
-        self.cli_sip_dealer.close(linger =0)
+        # stops the msg thread which closes the sockets it owns
+        self.msg_thread.stop()
 
         self.tasks.clear()
 
@@ -945,6 +1112,15 @@ class CRMain(bpy.types.Operator):
         self.cli_sip_dealer.setsockopt(zmq.TCP_KEEPALIVE, 1)
         self.cli_sip_dealer.connect("tcp://127.0.0.1:" + str(start_port + 2))
         self.connections['cli_sip_dealer'] = self.cli_sip_dealer
+        
+        # hand the sockets over to the msg thread, from here on the main thread 
+        # only sends through the outboxes
+        self.msg_thread = CRMsgThread(dict(self.connections), self.logger)
+        
+        self.cli_cip_dealer = CROutbox(self.msg_thread, 'cli_cip_dealer')
+        self.cli_sip_dealer = CROutbox(self.msg_thread, 'cli_sip_dealer')
+        
+        self.msg_thread.start()
 
         self.logger.info("CRClient Network interfaces initialised")
 
@@ -1188,60 +1364,42 @@ class CRMain(bpy.types.Operator):
 
 
 
-        ######## RECEIVE MSGS FROM THE CIP AND CALL HANDLERS ################
-
-
+        ######## HANDLE MSGS FROM THE CIP AND SIP ################
+        
+        # msgs have already been received and decoded by the msg thread, only 
+        # the handlers, which need bpy, are run here. Stop once this tick's budget
+        # is used up, anything left over is handled on the next tick.
+        
+        tick_start = time.perf_counter()
+        get_msg = self.msg_thread.get_msg
 
         try:
-
-            #for now, retain a message data block for each interface
-            for conn in self.connections.values():
-
-
-                if conn.poll(timeout=1):
-
-                    # get more than one message, but no more than a maximum
-                    # amount, this helps clear the incoming msg buffer under
-                    # times of heavy usage, like when lots of machines
-                    # are uploading
-                    getting_msgs = PIPELINE
+            
+            while not timed_out(tick_start, MSG_TICK_BUDGET):
+                
+                con_message = get_msg()
+                
+                if con_message is None: break
+                
+                # if we received an alive msg then we need to respond back with a list
+                # servers we want to connect to.
+                if con_message.message in self.msg_map:
                     
-                    while getting_msgs:
-                        
-                        getting_msgs -= 1
-                        
-                        con_message = utils.MsgWrapper.deserialize(
-                            json.loads(
-                            conn.recv_multipart(zmq.NOBLOCK)[0].decode('utf-8'),
-                            object_hook = utils.as_BTObject))
-                        
-                        # if we received an alive msg then we need to respond back with a list
-                        # servers we want to connect to.
-                        if con_message.message in self.msg_map:
-                            
-                            
-                            func = self.msg_map[con_message.message]
-                            
-                            func(context, con_message)
-                            
-                            #self.cli_cip_pubsub.send_string(json.dumps
-                            
-                        elif con_message.command in self.msg_map:
-                            
-                            func = self.msg_map[con_message.command]
-                            
-                            func(context, con_message)
-                            
-                            #self.cli_cip_pubsub.send_string(json.dumps
+                    
+                    func = self.msg_map[con_message.message]
+                    
+                    func(context, con_message)
+                    
+                elif con_message.command in self.msg_map:
+                    
+                    func = self.msg_map[con_message.command]
+                    
+                    func(context, con_message)
                             
-        except zmq.ZMQError as e:
-            
-            if e.errno == zmq.EAGAIN: pass
-            
         except:
             
             location = "CRMain.process_msgs"
-            log_string = "Unknown error while attempting to recv message"
+            log_string = "Unknown error while attempting to handle message"
             
             handle_generic_except(location=location, log_string = log_string,
                         logger = ui_ops_logger)
@@ -3747,6 +3905,7 @@ class connect_remote_server(bpy.types.Operator):
                      'type':device.type} for device in node.compute_devices],
                 'compute_device':node.compute_device,
                 'process_threads':node.process_threads,
+                'render_slots':node.render_slots,
                 'threads_mode':node.threads_mode,
                 'reports':[
                     {'name':report.name,
@@ -4641,6 +4800,9 @@ class NodeSettingsDialog(bpy.types.Operator):
         else:
             row.enabled = True                        
         row.prop(cr_nodes_settings, "process_threads", text='')
+        row = layout.row(align=True)
+        row.label(text = 'Render Slots')
+        row.prop(cr_nodes_settings, "render_slots", text='')
 
 
 class ConnectNode(bpy.types.Operator):
@@ -286,6 +286,8 @@ class RENDER_PT_network_panel(CrenderButtonsPanel, bpy.types.Panel):
             box = layout.box()
             box.label(text = "Render Nodes")
             box.operator("crowdrender.show_load_balancer", icon = "SETTINGS")
+            box.prop(context.scene.crowd_render, "dynamic_tiles")
+            box.prop(context.scene.crowd_render, "frame_distribution")
             box.prop(context.scene.render.image_settings, "exr_codec", )
             
             #LOCAL NODE
@@ -40,7 +40,8 @@ from __future__ import print_function
 
 import binascii, logging, os, sys, uuid, requests, pathlib
 import zmq, cProfile, platform, tempfile
-import time, json, sys, bpy, threading
+import time, json, sys, bpy, threading, heapq, zlib
+from math import ceil
 
 import distro
 from mathutils import Vector, Quaternion, Euler, Color
@@ -116,6 +117,7 @@ get_nodes_by_uuid = 'GET_NODES_BY_UUID'
 get_node_attrib_hashes = 'GET_NODE_ATTRIB_HASHES'
 update_timeout_prefs = 'UPDATE_TIMEOUT_PREFS'
 update_node_status = 'UPDATE_NODE_STATUS'
+swarm_peers = 'SWARM_PEERS'
 
 
 
@@ -131,6 +133,7 @@ cancel_tile_download = 'cancel_tile_download'
 client_address = 'client_address'
 client_uuid = 'client_uuid'
 client_m_uuid = 'utils.client_m_uuid'
+color_depth = 'color_depth'
 command = 'command'
 compute_devices = 'compute_devices'
 compute_device = 'compute_device'
@@ -140,7 +143,9 @@ coords = 'coords'
 creds = 'creds'
 crowdrender_session_metadata = '.crowdrender_session_metadata'
 current_frame = 'current_frame'
+delta_base = 'delta_base'
 duplicated_nodes = 'duplicated_nodes'
+dynamic_tiles = 'dynamic_tiles'
 endpoint = 'endpoint'
 eng_samples = 'eng_samples'
 errors= 'errors'
@@ -158,7 +163,11 @@ file_server_down = 'file_server_down'
 finished_frame = 'finished_frame'
 finished_tile = 'finished_tile'
 finished_view = 'finished_view'
+first_frame = 'first_frame'
+first_tile = 'first_tile'
+frame_distribution = 'frame_distribution'
 frame_range = 'frame_range'
+frame_step = 'frame_step'
 headers = 'headers'
 frame_task_uuid = 'frame_task_uuid'
 hello = 'hello'
@@ -206,6 +215,7 @@ parent_node_uuid = 'parent_node_uuid'
 payload = 'payload'
 percent_complete = 'percent complete'
 persistent_images = 'persistent_images'
+priority = 'priority'
 process_threads = 'process_threads'
 progress_tiles = 'progress_tiles'
 progress_update = 'progress_update'
@@ -221,6 +231,9 @@ render_job_id = 'render_job_id'
 render_stats = 'render_stats'
 render_layer_name = 'render_layer_name'
 render_pass_name = 'render_pass_name'
+render_slot = 'render_slot'
+render_slots = 'render_slots'
+render_target = 'render_target'
 repair_attr = 'repair_attr'
 repair_item = 'repair_item'
 repair_message = 'repair_message'
@@ -232,7 +245,9 @@ resolution_x = 'resolution_x'
 resolution_y = 'resolution_y'
 resolution_percent = 'resolution_percent'
 response_data = 'response_data'
+result_channels = 'result_channels'
 result_ready = 'result_ready'
+resume_path = 'resume_path'
 resync = 'resync'
 render_engine = 'render_engine'
 resync = 'resync'
@@ -258,16 +273,21 @@ session_token = 'session_token'
 session_uuid = 'session_uuid'
 set_enabled_state = 'set_enabled_state'
 show_req_notification = 'show_req_notification'
+speculative_launches = 'speculative_launches'
+speculative_wins = 'speculative_wins'
 ssp_alive = 'ssp_alive'
 status = 'status'
 state = 'state'
 status_update = 'status_update'
+swarm_nodes = 'swarm_nodes'
 sync_manifest = 'sync_manifest'
+tile_no = 'tile_no'
 tile_x = 'tile_x'
 tile_y = 'tile_y'
 tiles = 'tiles'
 tile_request = 'tile_request'
 timeout = 'timeout'
+transfer_rate = 'transfer_rate'
 transform_vector = 'transform_vector'
 trying_again = 'trying_again'
 top_hash = 'top_hash'
@@ -278,7 +298,9 @@ upload_task_uuid ='upload_task_uuid'
 upload_task = 'upload_task'
 upload_task_begin = 'upload_task_begin'
 upload_task_complete = 'upload_task_complete'
+use_chunk_store = 'use_chunk_store'
 use_nodes = 'use_nodes'
+use_swarm = 'use_swarm'
 user_blend_file = 'user_blend_file'
 user_engine = 'user_engine'
 user_file_path= 'user_file_path'
@@ -871,7 +893,133 @@ def func_time(func):
         return ret
     #End of inner
     return inner
-#End of func_time    
+#End of func_time
+
+class CRDeadlines:
+    """ A shared heap of deadlines that threads can sleep on
+
+    Components register a deadline against a key (a request uuid, a machine uuid
+    etc) and then ask for the keys that have expired. The owning thread uses
+    poll_timeout() to block in zmq's poll until either a socket has an event or
+    the next deadline is due, rather than waking on a fixed short interval to
+    check every timer itself.
+
+    Rescheduling or cancelling a key is O(1), stale heap entries are discarded
+    lazily when they reach the top of the heap. All times are from
+    time.perf_counter() so they are comparable with timed_out().
+    """
+
+    def __init__(self):
+
+        self.heap = []
+        self.deadlines = {}
+        self.lock = threading.Lock()
+        self.sequence = 0 # tie breaker so keys themselves are never compared
+
+    def __contains__(self, key):
+
+        return key in self.deadlines
+
+    def __len__(self):
+
+        return len(self.deadlines)
+
+    def schedule(self, key, delay):
+        """ Set the deadline for key to be delay seconds from now
+
+        Arguments:
+            key:    hashable    - identifies the owner of this deadline
+            delay:  float       - seconds from now until the deadline expires
+        Returns:
+            deadline: float     - the deadline in perf_counter time
+        Side Effects:
+            replaces any existing deadline for key
+        """
+
+        return self.schedule_at(key, time.perf_counter() + delay)
+
+    def schedule_at(self, key, deadline):
+        """ Set the deadline for key to an absolute perf_counter time """
+
+        with self.lock:
+
+            self.deadlines[key] = deadline
+            self.sequence += 1
+            heapq.heappush(self.heap, (deadline, self.sequence, key))
+
+        return deadline
+
+    def cancel(self, key):
+        """ Remove any deadline for key, does nothing if there isn't one """
+
+        with self.lock:
+
+            self.deadlines.pop(key, None)
+
+    def next_deadline(self):
+        """ Return the earliest live deadline, or None if there are no deadlines """
+
+        with self.lock:
+
+            heap = self.heap
+
+            while heap:
+
+                deadline, _, key = heap[0]
+
+                if self.deadlines.get(key) == deadline:
+
+                    return deadline
+
+                heapq.heappop(heap)# stale entry, cancelled or rescheduled
+
+        return None
+
+    def pop_expired(self):
+        """ Remove and return the keys whose deadlines have passed
+
+        Returns:
+            expired:    pylist  - keys in the order their deadlines expired
+        """
+
+        expired = []
+        now = time.perf_counter()
+
+        with self.lock:
+
+            heap = self.heap
+
+            while heap and heap[0][0] <= now:
+
+                deadline, _, key = heapq.heappop(heap)
+
+                if self.deadlines.get(key) == deadline:
+
+                    self.deadlines.pop(key)
+                    expired.append(key)
+
+        return expired
+
+    def poll_timeout(self, max_wait):
+        """ Return the time in millisecs a poll may block before the next deadline
+
+        Arguments:
+            max_wait:   int     - the longest time in millisecs to block for, used
+                                  when there are no deadlines at all.
+        Returns:
+            timeout:    int     - millisecs, between 0 and max_wait inclusive
+        """
+
+        deadline = self.next_deadline()
+
+        if deadline is None:
+
+            return max_wait
+
+        wait = ceil((deadline - time.perf_counter()) * 1000.0)
+
+        return int(min(max(wait, 0), max_wait))
+
 
 class UploadTask:
     """ an upload task represents the nodes, and their progress in uploading files """
@@ -1537,12 +1685,101 @@ def as_BTObject(dct):
             
     elif '__set__' in dct:
         # return a set of the resulting dictionary
-        return set(dct['__set__']) 
-        
+        return set(dct['__set__'])
+
     else:
         return dct
 
-    
+
+## MSG COMPRESSION
+# Msgs sent between the CIP and render nodes can be large, hash tree dumps and sync
+# manifests are full of the same long uuids and attribute names. Msgs over
+# COMPRESS_THRESHOLD bytes are compressed with zlib, using a preset dictionary of
+# strings common to most msgs. Compressed frames start with COMPRESSED_PREFIX, which
+# can never start a json string, so uncompressed msgs are still understood.
+# NOTE: the dictionary must be the same on every node, if it is changed, the
+# version byte at the end of the prefix must be changed too.
+
+COMPRESS_THRESHOLD = 4096 # bytes
+COMPRESS_LEVEL = 6
+COMPRESSED_PREFIX = b'\x00CRZ\x01'
+
+# zlib favours strings at the end of the dictionary, so the most common are last
+COMPRESS_DICT = bytes("".join([
+    'Path Tracing Tile', 'Path Tracing Sample', 'Rendered', 'Remaining:',
+    'Mem:', 'Peak:', 'Time:', 'Frame:', '_RenderSettings',
+    '_CyclesRenderSettings', '_Object::', '_Mesh::', '_Material::',
+    '_Scene::', '_World::', '_Camera::', '_Light::', '_NodeTree::',
+    '"location": ', '"rotation_euler": ', '"scale": ',
+    '{"__vector__": "Vector", "x": ', '{"__euler__": "Euler", "order": "XYZ", "x": ',
+    '{"__color__": "Color", "r": ', '{"__proparray__": [',
+    '"repair_item": ', '"repair_message": ', '"status": ', '"status_update": ',
+    '"render_stats": ', '"percent complete": ', '"node_name": ',
+    '"machine_uuid": ', '"message_uuid": ', '"top_hash": ', '"sync_manifest": ',
+    '"attribute_hashes": ', '"nodes_by_uuid": ', '"node_uuid": ',
+    '"_BlendData::', '{"attributes": {', '"command": "', '"message": "',
+    '"t_uuid": "', '"s_uuid": "', '"public_key": "'
+    ]), 'utf-8')
+
+
+def compress_msg(msg_string):
+    """ Return msg_string encoded as bytes, compressed if it is large enough
+
+    Arguments:
+        msg_string:     string  -   the msg to send, usually a json string
+    Returns:
+        frame:          bytes   -   the frame to send
+    Side Effects:
+        None
+    Exceptions:
+        None
+    Description:
+        Msgs shorter than COMPRESS_THRESHOLD are just encoded, compressing them
+        saves too little to be worth the time. Longer msgs are compressed using
+        COMPRESS_DICT and prefixed with COMPRESSED_PREFIX.
+    """
+
+    frame = msg_string.encode('utf-8')
+
+    if len(frame) < COMPRESS_THRESHOLD: return frame
+
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zdict = COMPRESS_DICT)
+
+    compressed = compressor.compress(frame) + compressor.flush()
+
+    # only use the compressed version if it is actually smaller
+    if len(compressed) + len(COMPRESSED_PREFIX) < len(frame):
+        return COMPRESSED_PREFIX + compressed
+
+    else:
+        return frame
+
+
+def decompress_msg(frame):
+    """ Return the msg string from a frame made by compress_msg """
+
+    if frame.startswith(COMPRESSED_PREFIX):
+
+        decompressor = zlib.decompressobj(zdict = COMPRESS_DICT)
+
+        frame = decompressor.decompress(frame[len(COMPRESSED_PREFIX):]) +\
+             decompressor.flush()
+
+    return frame.decode('utf-8')
+
+
+def send_msg_string(socket, msg_string, flags = 0):
+    """ Send msg_string over socket, compressing it if it is large """
+
+    return socket.send(compress_msg(msg_string), flags)
+
+
+def recv_msg_string(socket, flags = 0):
+    """ Receive a msg string sent by send_msg_string from socket """
+
+    return decompress_msg(socket.recv(flags))
+
+
 def handle_generic_except(location, log_string, logger=None):
     """ handle a general exception, log data to logger
     
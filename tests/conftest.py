@@ -0,0 +1,60 @@
+""" Loads the cr package outside blender for tests of its pure python parts
+
+The modules of cr import bpy, zmq and other modules only found inside blender,
+those are stubbed, and the package is loaded without running its __init__, which
+registers the addon. Importing cr also creates its directories and log files, 
+so HOME and the working directory point at a temporary directory while the 
+tests run.
+"""
+
+import importlib, os, sys, types
+from unittest import mock
+
+import pytest
+
+CR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'src', 'cr')
+BLENDER_MODULES = ('bpy', 'bpy.types', 'mathutils', 'cycles', 'zmq', 'zmq.auth',
+                   'zmq.auth.thread', 'zmq.error', 'distro', 'requests')
+
+
+class AddonPackage(types.ModuleType):
+    """ The cr package, with a stub for anything the addon's __init__ sets up """
+    
+    def __getattr__(self, name):
+        
+        if name.startswith('__'): raise AttributeError(name)
+        
+        # from . import x looks for x here before importing it
+        if os.path.exists(os.path.join(CR_PATH, name + '.py')):
+            return importlib.import_module('cr.' + name)
+        
+        return mock.MagicMock()
+
+
+@pytest.fixture(scope = 'session')
+def cr(tmp_path_factory):
+    """ Return a function that imports a module of cr by name """
+    
+    home = tmp_path_factory.mktemp('home')
+    cwd = os.getcwd()
+    
+    stubs = {name:mock.MagicMock() for name in BLENDER_MODULES 
+                if name not in sys.modules}
+    package = AddonPackage('cr')
+    package.__path__ = [CR_PATH]
+    package.bl_info = {'version':(0, 0, 0)}
+    package.process = 'client'
+    stubs['cr'] = package
+    
+    os.chdir(str(home))
+    
+    try:
+        with mock.patch.dict(os.environ, {'HOME':str(home), 
+                                          'USERPROFILE':str(home)}),\
+             mock.patch.dict(sys.modules, stubs):
+            
+            yield lambda name: importlib.import_module('cr.' + name)
+            
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,50 @@
+""" Checks the outstanding request bookkeeping of a chunk map """
+
+import pytest
+
+
+@pytest.fixture
+def engine(cr):
+    
+    return cr('network_engine')
+
+
+def test_counts_follow_requests(engine):
+    
+    size = engine.CHUNK_SIZE
+    c_map = engine.CRChunkMap(size * 8)
+    
+    c_map.next_requests(2, 2, 0.0, 'a')
+    c_map.request_chunk(6, 0.0, 'b')
+    
+    assert c_map.in_flight_bytes == size * 5
+    assert c_map.in_flight_count == {'a':2, 'b':1}
+    
+    c_map.mark_received(0, size * 2)
+    c_map.mark_failed(size * 6)
+    
+    assert c_map.in_flight_bytes == size * 2
+    assert c_map.in_flight_count == {'a':1}
+
+
+def test_expire_releases_only_timed_out_requests(engine):
+    
+    size = engine.CHUNK_SIZE
+    c_map = engine.CRChunkMap(size * 8)
+    rto = {'a':1.0, 'b':5.0}
+    
+    c_map.request_chunk(0, 0.0, 'b')
+    c_map.request_chunk(1, 0.0, 'a')
+    c_map.request_chunk(2, 2.0, 'a')
+    
+    expired = c_map.expire(2.5, rto.get)
+    
+    assert [offset for offset, req in expired] == [size]
+    assert c_map.in_flight_bytes == size * 2
+    assert c_map.in_flight_count == {'a':1, 'b':1}
+    assert c_map.next_timeout(rto.get) == 3.0
+    
+    c_map.expire(10.0, rto.get)
+    
+    assert c_map.in_flight_bytes == 0
+    assert c_map.next_timeout(rto.get) is None
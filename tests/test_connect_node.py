@@ -0,0 +1,56 @@
+""" Checks that the file server only shakes hands once with each endpoint """
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+
+@pytest.fixture
+def engine(cr):
+    
+    return cr('network_engine')
+
+
+@pytest.fixture
+def utils(cr):
+    
+    return cr('utils')
+
+
+def file_server(utils):
+    
+    return SimpleNamespace(router = MagicMock(), logger = MagicMock(),
+        render_node_eps = [], handshakes = {}, deadlines = utils.CRDeadlines())
+
+
+def connect_msg(utils, endpoint):
+    
+    return utils.MsgWrapper(command = utils.connect_node, attributes = {
+        utils.server_endpoint:[endpoint], utils.requesting_id:'node'})
+
+
+def test_pending_endpoint_is_not_challenged_again(engine, utils):
+    
+    server = file_server(utils)
+    endpoint = {utils.address:'10.0.0.2:5000', utils.public_key:'key'}
+    
+    engine.CRFileServer.connect_node(server, connect_msg(utils, endpoint))
+    engine.CRFileServer.connect_node(server, connect_msg(utils, endpoint))
+    
+    assert server.router.connect.call_count == 1
+    assert len(server.handshakes) == 1
+
+
+def test_connected_endpoint_is_skipped(engine, utils):
+    
+    server = file_server(utils)
+    endpoint = {utils.address:'10.0.0.2:5000', utils.public_key:'key'}
+    
+    engine.CRFileServer.connect_node(server, connect_msg(utils, endpoint))
+    engine.CRFileServer.handshake_complete(server, b'node')
+    engine.CRFileServer.connect_node(server, connect_msg(utils, endpoint))
+    
+    assert server.render_node_eps == [endpoint]
+    assert server.router.connect.call_count == 1
+    assert not server.handshakes
@@ -0,0 +1,75 @@
+""" Checks that copies from an older file are made off the requester's thread """
+
+import queue, select, socket, threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+
+@pytest.fixture
+def engine(cr):
+    
+    return cr('network_engine')
+
+
+@pytest.fixture
+def requester(engine):
+    
+    wake_recv, wake_send = socket.socketpair()
+    wake_recv.setblocking(False)
+    wake_send.setblocking(False)
+    
+    req = SimpleNamespace(workers = None, delta_copies = set(),
+        copied = queue.Queue(), wake_recv = wake_recv, wake_send = wake_send,
+        logger = MagicMock(), started = [], copy_threads = [])
+    
+    def copy_from_delta_base(base_path, remote_sigs, file):
+        
+        req.copy_threads.append(threading.current_thread())
+        
+        return [(0, 10)]
+    
+    req.copy_from_delta_base = copy_from_delta_base
+    req.start_file_data = lambda task_data, reused: req.started.append(reused)
+    
+    yield req
+    
+    req.workers.shutdown(wait = True)
+    wake_recv.close()
+    wake_send.close()
+
+
+def copy(engine, requester, req_uuid):
+    
+    task_data = {engine.signatures:engine.pack_signatures([]),
+        engine.f_handle:MagicMock(), engine.file_id:'scene.blend'}
+    
+    engine.CRFileRequest.start_delta_copy(requester, req_uuid, task_data, 'old')
+    
+    # wait for the worker to wake us, as poll would
+    select.select([requester.wake_recv], [], [], 5.0)
+    
+    return task_data
+
+
+def test_transfer_starts_once_the_copy_is_done(engine, requester):
+    
+    copy(engine, requester, b'req')
+    
+    engine.CRFileRequest.finish_delta_copies(requester)
+    
+    assert requester.started == [[(0, 10)]]
+    assert requester.copy_threads[0] is not threading.current_thread()
+    assert not requester.delta_copies
+
+
+def test_cancelled_copy_is_dropped(engine, requester):
+    
+    task_data = copy(engine, requester, b'req')
+    requester.delta_copies.clear() # as cancel_all_tasks does
+    
+    engine.CRFileRequest.finish_delta_copies(requester)
+    
+    assert requester.started == []
+    task_data[engine.f_handle].close.assert_called_once()
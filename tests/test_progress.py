@@ -0,0 +1,80 @@
+""" Checks that progress from both directions of a transfer reaches blender """
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+
+class Router:
+    """ Stands in for the ROUTER socket connected to blender """
+    
+    def __init__(self):
+        
+        self.sent = []
+        
+    def send_multipart(self, frames):
+        
+        self.sent.append(frames)
+        
+    def msgs(self):
+        
+        return [json.loads(frames[1].decode('utf-8')) for frames in self.sent]
+
+
+@pytest.fixture
+def client_interface(cr):
+    
+    return cr('client_interface')
+    
+
+@pytest.fixture
+def utils(cr):
+    
+    return cr('utils')
+
+
+def progress_msg(utils, percent):
+    
+    return utils.MsgWrapper(message = utils.progress_update, s_uuid = b'session', 
+        t_uuid = b'session', attributes = {utils.percent_complete:percent})
+
+
+def test_upload_progress_reaches_blender(client_interface, utils):
+    
+    router = Router()
+    progress = client_interface.CRProgressAggregator(10.0)
+    machine = SimpleNamespace(machine_uuid = 'node', node_name = 'node 1', 
+        cli_cip_router = router, client = SimpleNamespace(progress = progress))
+        
+    client_interface.CRServerMachine.handle_transfer_prog_update(machine, 
+        progress_msg(utils, 50.0))
+    client_interface.CRServerMachine.handle_transfer_prog_update(machine, 
+        progress_msg(utils, 75.0))
+    
+    # coalesced until the main loop publishes them
+    assert router.sent == []
+    
+    progress.publish(router)
+    
+    assert len(router.sent) == 1
+    
+    # completion is sent without waiting for the main loop
+    client_interface.CRServerMachine.handle_transfer_prog_update(machine, 
+        progress_msg(utils, 100.0))
+        
+    assert len(router.sent) == 2
+    
+    
+def test_download_progress_reaches_blender(client_interface, utils):
+    
+    router = Router()
+    manager = SimpleNamespace(cli_cip_router = router, 
+        progress = client_interface.CRProgressAggregator(10.0))
+    
+    msg = progress_msg(utils, 100.0)
+    msg.attributes[utils.node_uuid] = 'node'
+    
+    client_interface.CRClientServerManager.handle_prog_update(manager, msg)
+    
+    assert len(router.sent) == 1
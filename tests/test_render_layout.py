@@ -0,0 +1,133 @@
+""" Property checks for the pixel allocation used to lay out render regions
+
+render.allocate_largest_remainder and render.bisect_screen are pure functions,
+but render imports modules that need blender, so it is loaded by the cr fixture,
+see conftest.py.
+"""
+
+import random
+from math import floor
+
+import pytest
+
+
+@pytest.fixture(scope = 'module')
+def render(cr):
+    
+    return cr('render')
+
+
+def random_shares(rng, n_nodes):
+    
+    return {str(i):rng.choice((0.0, -1.0, rng.random(), rng.random() * 1000.0))
+                for i in range(n_nodes)}
+
+
+def test_allocation_sums_to_total(render):
+    
+    rng = random.Random(46)
+    
+    for _ in range(5000):
+        
+        shares = random_shares(rng, rng.randint(1, 80))
+        total = rng.randint(0, 5000)
+        
+        units = render.allocate_largest_remainder(shares, total, 
+                                                  rng.randint(0, 5))
+        
+        assert set(units) == set(shares)
+        assert sum(units.values()) == total
+
+
+def test_allocation_meets_minimum(render):
+    
+    rng = random.Random(47)
+    
+    for _ in range(5000):
+        
+        shares = random_shares(rng, rng.randint(1, 80))
+        total = rng.randint(0, 5000)
+        minimum = rng.randint(0, 5)
+        
+        units = render.allocate_largest_remainder(shares, total, minimum)
+        
+        assert min(units.values()) >= min(minimum, total // len(shares))
+
+
+def test_allocation_within_one_of_quota(render):
+    
+    rng = random.Random(48)
+    
+    for _ in range(5000):
+        
+        shares = random_shares(rng, rng.randint(1, 80))
+        total = rng.randint(0, 5000)
+        minimum = min(rng.randint(0, 5), total // len(shares))
+        
+        units = render.allocate_largest_remainder(shares, total, minimum)
+        
+        weights = {uuid:max(share, 0.0) for uuid, share in shares.items()}
+        weight_sum = sum(weights.values())
+        
+        if weight_sum <= 0.0:
+            weights = {uuid:1.0 for uuid in shares}
+            weight_sum = float(len(shares))
+            
+        spare = total - minimum * len(shares)
+        
+        for uuid, weight in weights.items():
+            
+            quota = spare * weight / weight_sum
+            
+            assert floor(quota) <= units[uuid] - minimum <= floor(quota) + 1
+
+
+def test_allocation_of_nothing(render):
+    
+    assert render.allocate_largest_remainder({}, 100) == {}
+    assert render.allocate_largest_remainder({'a':0.0, 'b':0.0}, 5) in (
+        {'a':3, 'b':2}, {'a':2, 'b':3})
+
+
+def test_bisection_covers_frame(render):
+    
+    rng = random.Random(43)
+    
+    for _ in range(2000):
+        
+        n_nodes = rng.randint(1, 24)
+        shares = [(str(i), rng.choice((0.0, rng.random(), rng.random() * 100.0)))
+                    for i in range(n_nodes)]
+        width = rng.randint(1, 400)
+        height = rng.randint(1, 400)
+        
+        tiles = render.bisect_screen(shares, 0, width, 0, height)
+        
+        if width * height < n_nodes:
+            # not every node can have a pixel
+            continue
+            
+        if tiles is None:
+            # a frame with a side as long as the number of nodes always divides
+            assert max(width, height) < n_nodes
+            continue
+        
+        assert set(tiles) == {uuid for uuid, share in shares}
+        
+        for x_0, x_1, y_0, y_1 in tiles.values():
+            
+            assert 0 <= x_0 < x_1 <= width
+            assert 0 <= y_0 < y_1 <= height
+            
+        areas = [(x_1 - x_0) * (y_1 - y_0) for x_0, x_1, y_0, y_1 in tiles.values()]
+        
+        assert sum(areas) == width * height
+        
+        # tiles that sum to the frame and lie inside it can only overlap if
+        # they leave a gap elsewhere, check a few pixels to be sure they don't
+        for _ in range(20):
+            
+            px, py = rng.randrange(width), rng.randrange(height)
+            
+            assert sum([x_0 <= px < x_1 and y_0 <= py < y_1 
+                        for x_0, x_1, y_0, y_1 in tiles.values()]) == 1
@@ -0,0 +1,77 @@
+""" Checks that copies of a region are only used once across frames """
+
+import pytest
+
+
+@pytest.fixture
+def speculation(cr):
+    
+    return cr('render').CRSpeculation()
+
+
+def start_frame(speculation, regions):
+    
+    speculation.begin(None, [node for node, region in regions], 100.0, 100.0, 1)
+    
+    for node, region in regions:
+        speculation.start(node, region, (0.0, 1.0, 0.0, 1.0), 1.0)
+
+
+def test_untracked_results_are_accepted(speculation):
+    
+    assert speculation.accept('a') == (True, 'a', [])
+    
+    
+def test_copy_that_finished_before_its_cancel_is_dropped(speculation):
+    
+    start_frame(speculation, [('a', 0), ('b', 1)])
+    speculation.start('c', 0, (0.0, 1.0, 0.0, 1.0), 1.0) # c copies a's region
+    
+    assert speculation.accept('c') == (True, 'a', ['a'])
+    
+    # a finished before the cancel reached it, its result arrives anyway
+    assert speculation.accept('a')[0] is False
+    # and no failure will come for it
+    assert speculation.was_cancelled('a') is False
+    
+    # c has no region now, a second result from it is a duplicate
+    assert speculation.accept('c')[0] is False
+    
+    
+def test_cancelled_copy_fails(speculation):
+    
+    start_frame(speculation, [('a', 0), ('b', 1)])
+    speculation.start('c', 0, (0.0, 1.0, 0.0, 1.0), 1.0)
+    
+    speculation.accept('c')
+    
+    assert speculation.was_cancelled('a') is True
+    assert speculation.was_cancelled('a') is False
+    
+    
+def test_cancelled_entries_expire(speculation):
+    
+    start_frame(speculation, [('a', 0), ('b', 1)])
+    speculation.start('c', 0, (0.0, 1.0, 0.0, 1.0), 1.0)
+    speculation.accept('c')
+    
+    # a's failure may still arrive during the next frame
+    start_frame(speculation, [('a', 0), ('b', 1)])
+    assert 'a' in speculation.cancelled
+    
+    # but a real failure of a two frames on isn't mistaken for it
+    start_frame(speculation, [('a', 0), ('b', 1)])
+    assert speculation.was_cancelled('a') is False
+    
+    
+def test_new_tile_of_cancelled_node_is_accepted(speculation):
+    
+    start_frame(speculation, [('a', 0), ('b', 1)])
+    speculation.start('c', 0, (0.0, 1.0, 0.0, 1.0), 1.0)
+    speculation.accept('c', 0)
+    
+    # a is given another tile from the queue before its old one's result arrives
+    speculation.start('a', 2, (0.0, 1.0, 0.0, 1.0), 1.0)
+    
+    assert speculation.accept('a', 2)[0] is True
+    assert speculation.accept('a', 0)[0] is False